@@ -2,12 +2,29 @@
 import os
 import logging
 import re
+import secrets
+import signal
+import sys
 import time # للتخزين المؤقت
 from decimal import Decimal, InvalidOperation, ROUND_DOWN, ROUND_UP, Context as DecimalContext # للتقريب الدقيق والتحكم بالدقة
 from datetime import datetime, timedelta
-from typing import List, Dict, Tuple, Any, Set, Optional, Union # لتحسين Type Hinting
+from typing import List, Dict, Tuple, Any, Set, Optional, Union, Callable, Awaitable, Generic, TypeVar # لتحسين Type Hinting
 import asyncio
-from collections import defaultdict
+import bisect
+import math
+from array import array
+import contextvars
+import functools
+import hashlib
+import heapq
+import json
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict, defaultdict, deque
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
 
 # --- تحميل المتغيرات من ملف .env ---
 # تأكد من تثبيت المكتبة: pip install python-dotenv
@@ -21,13 +38,27 @@ except ImportError:
     print("pip install python-dotenv")
     logger = logging.getLogger(__name__)
 
+# --- بث الأسعار عبر WebSocket (اختياري) ---
+# pip install websockets
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+# --- خادم Webhook (اختياري) ---
+# pip install aiohttp
+try:
+    from aiohttp import web
+except ImportError:
+    web = None
+
 
 # --- استيراد مكتبات البوت والـ API ---
 # تأكد من تثبيت المكتبات: pip install python-telegram-bot python-binance python-dateutil
 try:
     from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
     from telegram.constants import ParseMode
-    from telegram.error import TelegramError # لالتقاط أخطاء تليجرام
+    from telegram.error import TelegramError, RetryAfter # لالتقاط أخطاء تليجرام
     from telegram.ext import (
         Application,
         CommandHandler,
@@ -36,7 +67,11 @@ try:
         ContextTypes,
         CallbackQueryHandler,
         ConversationHandler,
-        PicklePersistence # <<<--- لإضافة الحفظ المستمر (اختياري)
+        TypeHandler,
+        ApplicationHandlerStop,
+        BaseRateLimiter,
+        BaseUpdateProcessor,
+        BasePersistence, # <<<--- لإضافة الحفظ المستمر
     )
     from binance.client import Client
     from binance.enums import *
@@ -63,7 +98,7 @@ try:
     from config import (
         TELEGRAM_BOT_TOKEN, BINANCE_API_KEY,
         BINANCE_SECRET_KEY, MAX_TRADE_AMOUNT_USDT,
-        RESTRICTED_PAIRS, LOG_TRADES
+        RESTRICTED_PAIRS, LOG_TRADES, RATE_LIMIT
     )
 except ImportError as e:
     logger.critical(f"فشل في استيراد ملف الإعدادات: {e}")
@@ -100,6 +135,616 @@ if BINANCE_API_KEY and BINANCE_SECRET_KEY:
 else:
     logger.warning("مفاتيح Binance API غير موجودة. وظائف التداول معطلة.")
 
+# --- محدد معدل الطلبات (Rate Limiter) ---
+ORDER_BUDGET_MAX_WAIT_SECONDS = 5.0 # أقصى انتظار لرصيد الأوامر قبل رفض الأمر
+ORDER_METHODS = {'create_order', 'create_oco_order'}
+REQUEST_WEIGHTS = {
+    'ping': 1, 'get_exchange_info': 20, 'get_symbol_info': 20, 'get_account': 20,
+    'get_my_trades': 20, 'create_order': 1, 'create_oco_order': 1, 'cancel_order': 1,
+    'stream_get_listen_key': 2, 'stream_keepalive': 2, 'stream_close': 2,
+}
+
+# The Telegram user whose update is being handled (set by rate_limit_gate)
+current_user_id: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar('current_user_id', default=None)
+
+class RateLimitExceeded(Exception):
+    """Raised when a budget cannot be satisfied within the allowed wait."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Rate limit exceeded, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+class TokenBucket:
+    """Token bucket refilled continuously: `capacity` tokens per `period_seconds`."""
+
+    def __init__(self, capacity: float, period_seconds: float = 60.0):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / period_seconds
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self) -> float:
+        self._refill()
+        return self.tokens
+
+    def delay_for(self, amount: float = 1.0) -> float:
+        """Seconds until `amount` tokens are available (0 if available now)."""
+        self._refill()
+        deficit = min(amount, self.capacity) - self.tokens
+        return deficit / self.rate if deficit > 0 else 0.0
+
+    def try_acquire(self, amount: float = 1.0) -> bool:
+        if self.delay_for(amount) > 0:
+            return False
+        self.tokens -= min(amount, self.capacity)
+        return True
+
+    async def acquire(self, amount: float = 1.0, max_wait: Optional[float] = None) -> None:
+        """Waits (FIFO) until `amount` tokens are available, then consumes them."""
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            wait = self.delay_for(amount)
+            if max_wait is not None and wait > max_wait:
+                raise RateLimitExceeded(wait)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                self._refill()
+            self.tokens -= amount
+
+    def limit_remaining(self, remaining: float) -> None:
+        """Caps local tokens to what the server reports as remaining."""
+        self._refill()
+        self.tokens = min(self.tokens, max(remaining, 0.0))
+
+def request_weight(method: str, params: Dict[str, Any]) -> int:
+    """Binance REST weight for a python-binance client method."""
+    if method == 'get_symbol_ticker':
+        return 2 if 'symbol' in params else 4
+    if method == 'get_ticker':
+        if 'symbol' in params: return 2
+        symbols = params.get('symbols')
+        if symbols:
+            count = len(symbols) if isinstance(symbols, (list, tuple)) else str(symbols).count(',') + 1
+            return 2 if count <= 20 else 40 if count <= 100 else 80
+        return 80
+    if method == 'get_open_orders':
+        return 6 if 'symbol' in params else 80
+    return REQUEST_WEIGHTS.get(method, 1)
+
+class ExchangeRateLimiter:
+    """
+    Central scheduler for Binance REST calls implementing config.RATE_LIMIT:
+    a global request-weight bucket (kept in sync with X-MBX-USED-WEIGHT-1M),
+    per-user order/trade budgets and a global pause after HTTP 429/418.
+    """
+
+    def __init__(self, limits: Dict[str, int]):
+        self.limits = limits
+        self.weight = TokenBucket(limits.get('request_weight_per_minute', 1200))
+        self._user_buckets: Dict[int, Dict[str, TokenBucket]] = {}
+        self._blocked_until = 0.0
+
+    def user_bucket(self, user_id: int, kind: str) -> TokenBucket:
+        buckets = self._user_buckets.setdefault(user_id, {})
+        if kind not in buckets:
+            buckets[kind] = TokenBucket(self.limits.get(kind, 60))
+        return buckets[kind]
+
+    async def acquire(self, method: str, params: Dict[str, Any]) -> None:
+        """Waits until the call fits every applicable budget."""
+        user_id = current_user_id.get()
+        if method in ORDER_METHODS and user_id is not None:
+            buckets = [self.user_bucket(user_id, 'orders_per_minute')]
+            if method == 'create_order' and params.get('type') == ORDER_TYPE_MARKET:
+                buckets.append(self.user_bucket(user_id, 'trades_per_minute'))
+            await self._acquire_all(buckets, ORDER_BUDGET_MAX_WAIT_SECONDS)
+        delay = self._blocked_until - time.monotonic()
+        if delay > 0:
+            logger.warning(f"Binance rate limit pause active, waiting {delay:.1f}s before {method}")
+            await asyncio.sleep(delay)
+        await self.weight.acquire(request_weight(method, params))
+
+    @staticmethod
+    async def _acquire_all(buckets: List[TokenBucket], max_wait: float) -> None:
+        """Takes one token from every bucket, or none of them if any would wait longer than `max_wait`."""
+        while True:
+            wait = max(bucket.delay_for() for bucket in buckets)
+            if wait > max_wait:
+                raise RateLimitExceeded(wait)
+            if wait <= 0:
+                # No await between the check and the take, so no other task can drain a bucket in between
+                for bucket in buckets:
+                    bucket.try_acquire()
+                return
+            await asyncio.sleep(wait)
+
+    def observe_used_weight(self, used_weight: Optional[str]) -> None:
+        """Syncs the weight bucket with the server-side counter."""
+        if not used_weight: return
+        try:
+            self.weight.limit_remaining(self.weight.capacity - int(used_weight))
+        except ValueError:
+            pass
+
+    def block_for(self, seconds: float) -> None:
+        """Pauses all calls after a 429/418 response."""
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+        self.weight.limit_remaining(0)
+
+exchange_rate_limiter = ExchangeRateLimiter(RATE_LIMIT)
+
+async def rate_limit_gate(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Runs before every handler (group -1): binds the user for per-user budgets
+    and enforces RATE_LIMIT['api_calls_per_minute'] on incoming requests.
+    """
+    user = update.effective_user
+    if not user: return
+    current_user_id.set(user.id)
+    if not exchange_rate_limiter.user_bucket(user.id, 'api_calls_per_minute').try_acquire():
+        logger.warning(f"User {user.id} exceeded api_calls_per_minute, dropping update.")
+        if update.callback_query:
+            try: await update.callback_query.answer("⏳ طلبات كثيرة، الرجاء الانتظار قليلاً.", show_alert=False)
+            except TelegramError: pass
+        raise ApplicationHandlerStop
+
+# --- بوابة Binance غير المتزامنة ---
+BINANCE_GATEWAY_WORKERS = 16 # عدد الخيوط المخصصة لطلبات REST
+
+class BinanceGateway:
+    """
+    Async facade over the synchronous python-binance Client.
+    Every REST call runs in a dedicated thread pool so a slow HTTP round trip
+    never blocks the event loop (and the other users' updates).
+    """
+
+    def __init__(self, client: Optional[Client], max_workers: int = BINANCE_GATEWAY_WORKERS):
+        self.client = client
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="binance")
+        # client.response is shared by all worker threads; capture each call's headers per thread instead
+        self._local = threading.local()
+        session = getattr(client, 'session', None)
+        if session is not None:
+            session.hooks.setdefault('response', []).append(self._capture_used_weight)
+
+    @property
+    def available(self) -> bool:
+        return self.client is not None
+
+    async def call(self, method: str, **params: Any) -> Any:
+        """Runs `client.<method>(**params)` in the gateway pool and awaits the result."""
+        if not self.client:
+            raise RuntimeError("Binance client not initialized.")
+        await exchange_rate_limiter.acquire(method, params)
+        func = functools.partial(getattr(self.client, method), **params)
+        loop = asyncio.get_running_loop()
+        try:
+            result, used_weight = await loop.run_in_executor(self._executor, self._invoke, func)
+        except BinanceAPIException as e:
+            if e.status_code in (418, 429):
+                retry_after = e.response.headers.get('Retry-After') if e.response is not None else None
+                exchange_rate_limiter.block_for(float(retry_after) if retry_after else 60.0)
+                logger.error(f"Binance rate limit hit ({e.status_code}) on {method}, pausing requests.")
+            raise
+        exchange_rate_limiter.observe_used_weight(used_weight)
+        return result
+
+    def _capture_used_weight(self, response: Any, *args: Any, **kwargs: Any) -> None:
+        """requests response hook; runs in the worker thread that made the request."""
+        self._local.used_weight = response.headers.get('x-mbx-used-weight-1m')
+
+    def _invoke(self, func: Any) -> Tuple[Any, Optional[str]]:
+        """Executes in a worker thread; returns the result and the used-weight header of this call."""
+        self._local.used_weight = None
+        result = func()
+        return result, self._local.used_weight
+
+    def shutdown(self) -> None:
+        """Stops the worker threads (pending calls are allowed to finish)."""
+        self._executor.shutdown(wait=False)
+
+exchange_gateway = BinanceGateway(binance_client)
+
+async def binance_call(method: str, **params: Any) -> Any:
+    """Shortcut for `exchange_gateway.call`; all handlers use this instead of `binance_client` directly."""
+    return await exchange_gateway.call(method, **params)
+
+# --- دمج الطلبات المتزامنة (Single-flight) ---
+class SingleFlight:
+    """
+    Deduplicates concurrent loads of the same key: the first caller starts the
+    load, every caller arriving while it is in flight awaits the same task.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(functools.partial(self._forget, key))
+        else:
+            logger.debug(f"Joining in-flight request for {key}")
+        # shield: a caller that gets cancelled must not cancel the shared load
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Future) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+request_coalescer = SingleFlight()
+
+# --- ذاكرة التخزين المؤقت المتطايرة (خارج الحالة المحفوظة) ---
+CacheValue = TypeVar('CacheValue')
+
+class CacheNamespace(Generic[CacheValue]):
+    """
+    One typed cache namespace: entries expire after ttl_seconds (None = never)
+    and the least recently used entry is evicted beyond max_size. Expired
+    entries stay until evicted so callers can fall back to them on errors.
+    """
+
+    def __init__(self, name: str, ttl_seconds: Optional[float] = None, max_size: int = 128):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._entries: 'OrderedDict[str, Tuple[float, CacheValue]]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _is_fresh(self, stored_at: float) -> bool:
+        return self.ttl_seconds is None or time.monotonic() - stored_at < self.ttl_seconds
+
+    def get(self, key: str, default: Optional[CacheValue] = None) -> Optional[CacheValue]:
+        """Returns the fresh value for key (counted as a hit) or default (a miss)."""
+        entry = self._entries.get(key)
+        if entry is None or not self._is_fresh(entry[0]):
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def get_stale(self, key: str, default: Optional[CacheValue] = None) -> Optional[CacheValue]:
+        """Returns the value for key even if expired; does not affect statistics."""
+        entry = self._entries.get(key)
+        return entry[1] if entry is not None else default
+
+    def stored_at(self, key: str) -> Optional[float]:
+        """Monotonic time the entry for key was stored (None if absent)."""
+        entry = self._entries.get(key)
+        return entry[0] if entry is not None else None
+
+    def set(self, key: str, value: CacheValue, stored_at: Optional[float] = None) -> None:
+        """Stores value; pass `stored_at` for values derived from an older entry so they expire with it."""
+        self._entries[key] = (time.monotonic() if stored_at is None else stored_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Optional[str] = None) -> None:
+        """Drops one key, or the whole namespace when key is None."""
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries), 'max_size': self.max_size, 'ttl_seconds': self.ttl_seconds,
+            'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+        }
+
+class VolatileCache:
+    """Registry of in-process cache namespaces; nothing here is ever persisted."""
+
+    def __init__(self):
+        self._namespaces: Dict[str, CacheNamespace] = {}
+
+    def namespace(self, name: str, ttl_seconds: Optional[float] = None, max_size: int = 128) -> CacheNamespace:
+        if name in self._namespaces:
+            raise ValueError(f"Cache namespace '{name}' already registered")
+        cache = CacheNamespace(name, ttl_seconds, max_size)
+        self._namespaces[name] = cache
+        return cache
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: cache.stats() for name, cache in self._namespaces.items()}
+
+volatile_cache = VolatileCache()
+exchange_cache: CacheNamespace[Any] = volatile_cache.namespace('exchange', ttl_seconds=None, max_size=4) # exchange_info / valid_symbols
+tickers_cache: CacheNamespace[Dict[str, Decimal]] = volatile_cache.namespace('tickers', ttl_seconds=60, max_size=8)
+balances_cache: CacheNamespace[List[Dict[str, Any]]] = volatile_cache.namespace('balances', ttl_seconds=60, max_size=4)
+symbol_info_cache: CacheNamespace[Dict[str, Any]] = volatile_cache.namespace('symbol_info', ttl_seconds=300, max_size=512)
+market_stats_cache: CacheNamespace[List[Tuple[str, float, float, str, str]]] = volatile_cache.namespace('market_stats', ttl_seconds=30, max_size=8)
+search_results_cache: CacheNamespace[Tuple[str, List[Tuple[str, float, float, str, str]]]] = volatile_cache.namespace('search_results', ttl_seconds=600, max_size=256)
+
+# --- دفتر الأسعار الحي (WebSocket) ---
+MARKET_STREAM_URL = os.getenv('BINANCE_MARKET_STREAM_URL', 'wss://stream.binance.com:9443/ws/!miniTicker@arr')
+PRICE_BOOK_MAX_STALENESS_SECONDS = 5 # أقصى عمر لآخر تحديث قبل الرجوع إلى REST
+
+class PriceBook(Mapping):
+    """
+    Live symbol -> last price map fed by the market stream.
+    Raw price strings are stored as received; Decimals are built lazily on read
+    so a 1 s stream tick over ~2000 symbols costs no Decimal parsing.
+    """
+
+    def __init__(self):
+        self._raw: Dict[str, str] = {}
+        self._parsed: Dict[str, Decimal] = {}
+        self.updated_at = 0.0
+
+    def apply(self, updates: Any) -> None:
+        """Applies an iterable of (symbol, price_str) pairs."""
+        raw = self._raw; parsed = self._parsed
+        for symbol, price in updates:
+            if raw.get(symbol) != price:
+                raw[symbol] = price
+                parsed.pop(symbol, None)
+        self.updated_at = time.time()
+
+    def is_fresh(self, max_age: float = PRICE_BOOK_MAX_STALENESS_SECONDS) -> bool:
+        return bool(self._raw) and time.time() - self.updated_at <= max_age
+
+    def __getitem__(self, symbol: str) -> Decimal:
+        price = self._parsed.get(symbol)
+        if price is None:
+            price = decimal_context.create_decimal(self._raw[symbol])
+            self._parsed[symbol] = price
+        return price
+
+    def __contains__(self, symbol: object) -> bool:
+        return symbol in self._raw
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def __len__(self) -> int:
+        return len(self._raw)
+
+class MarketDataService:
+    """
+    Background task subscribed to the `!miniTicker@arr` stream that keeps
+    `book` current. The book is seeded once from REST on connect because the
+    stream only carries symbols that changed during the last second.
+    The book is reseeded after every reconnect. Point
+    BINANCE_MARKET_STREAM_URL at market_stream_stub.py to run it against
+    canned frames.
+    """
+
+    def __init__(self, url: str = MARKET_STREAM_URL):
+        self.url = url
+        self.book = PriceBook()
+        self.connected = False
+        self.seeded = False
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def live(self) -> bool:
+        """True when the book can serve prices without touching REST."""
+        return self.connected and self.seeded and self.book.is_fresh()
+
+    def start(self) -> None:
+        if websockets is None:
+            logger.warning("مكتبة websockets غير مثبتة (pip install websockets). سيتم استخدام REST للأسعار.")
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="market-data-stream")
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try: await self._task
+            except asyncio.CancelledError: pass
+            self._task = None
+        self.connected = False
+        self.seeded = False
+
+    async def _seed(self) -> None:
+        if self.seeded or not exchange_gateway.available: return
+        try:
+            snapshot = await request_coalescer.do('symbol_ticker_seed', lambda: binance_call('get_symbol_ticker'))
+            self.book.apply((t['symbol'], t['price']) for t in snapshot)
+            self.seeded = True
+            logger.info(f"Price book seeded with {len(self.book)} symbols.")
+        except Exception as e:
+            logger.error(f"Failed to seed price book: {e}")
+
+    async def _run(self) -> None:
+        backoff = 1
+        while True:
+            try:
+                async with websockets.connect(self.url, ping_interval=20, max_size=2 ** 23) as ws:
+                    self.connected = True
+                    backoff = 1
+                    logger.info(f"Connected to market stream {self.url}")
+                    await self._seed()
+                    async for raw in ws:
+                        self._handle_message(raw)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Market stream disconnected: {e}. Reconnecting in {backoff}s")
+            finally:
+                self.connected = False
+                # Quiet symbols got no frames during the outage; reseed on the next connect
+                self.seeded = False
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 60)
+
+    def _handle_message(self, raw: Union[str, bytes]) -> None:
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            logger.debug("Ignoring non-JSON market stream frame.")
+            return
+        if isinstance(data, dict): # combined-stream wrapper or single ticker
+            data = data.get('data', [data])
+            if isinstance(data, dict): data = [data]
+        self.book.apply((t['s'], t['c']) for t in data if 's' in t and 'c' in t)
+
+market_data = MarketDataService()
+
+# --- تدفق بيانات المستخدم (أرصدة وأوامر لحظية) ---
+USER_STREAM_BASE_URL = os.getenv('BINANCE_USER_STREAM_URL', 'wss://stream.binance.com:9443/ws')
+USER_STREAM_KEEPALIVE_SECONDS = 30 * 60 # Binance يلغي listenKey بعد 60 دقيقة بدون تجديد
+CLOSED_ORDER_STATUSES = {'FILLED', 'CANCELED', 'REJECTED', 'EXPIRED', 'EXPIRED_IN_MATCH'}
+
+class UserDataStream:
+    """
+    listenKey-based consumer of the account's user data stream. After each
+    (re)connect it seeds balances and open orders from REST once, then keeps
+    them current from `outboundAccountPosition` and `executionReport` events,
+    so the balance and order screens need no REST weight while it is live.
+    """
+
+    def __init__(self, base_url: str = USER_STREAM_BASE_URL, keepalive_seconds: float = USER_STREAM_KEEPALIVE_SECONDS):
+        self.base_url = base_url.rstrip('/')
+        self.keepalive_seconds = keepalive_seconds
+        self.balances: Dict[str, Tuple[Decimal, Decimal]] = {} # asset -> (free, locked)
+        self.open_orders: Dict[int, Dict[str, Any]] = {} # orderId -> order in REST shape
+        self.connected = False
+        self.seeded = False
+        self._listen_key: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def live(self) -> bool:
+        """True when balances and open orders can be served from memory."""
+        return self.connected and self.seeded
+
+    def start(self) -> None:
+        if websockets is None or not exchange_gateway.available:
+            logger.warning("User data stream disabled (websockets or Binance client missing). Using REST for balances/orders.")
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="user-data-stream")
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try: await self._task
+            except asyncio.CancelledError: pass
+            self._task = None
+        self.connected = False
+        self.seeded = False
+        if self._listen_key:
+            try: await binance_call('stream_close', listenKey=self._listen_key)
+            except Exception as e: logger.debug(f"Failed to close listenKey: {e}")
+            self._listen_key = None
+
+    def orders(self) -> List[Dict[str, Any]]:
+        """Open orders, oldest first (same shape as `get_open_orders`)."""
+        return sorted(self.open_orders.values(), key=lambda o: o.get('time', 0))
+
+    async def _seed(self) -> None:
+        account_info = await binance_call('get_account')
+        open_orders = await binance_call('get_open_orders')
+        self.balances = {
+            b['asset']: (decimal_context.create_decimal(b['free']), decimal_context.create_decimal(b['locked']))
+            for b in account_info.get('balances', [])
+        }
+        self.open_orders = {o['orderId']: o for o in open_orders}
+        balances_cache.invalidate()
+        self.seeded = True
+        logger.info(f"User data stream seeded: {len(self.balances)} balances, {len(self.open_orders)} open orders.")
+
+    async def _keepalive(self) -> None:
+        while True:
+            await asyncio.sleep(self.keepalive_seconds)
+            try:
+                await binance_call('stream_keepalive', listenKey=self._listen_key)
+                logger.debug("User data stream listenKey renewed.")
+            except Exception as e:
+                logger.warning(f"listenKey keepalive failed: {e}")
+
+    async def _run(self) -> None:
+        backoff = 1
+        while True:
+            keepalive_task = None
+            try:
+                self._listen_key = await binance_call('stream_get_listen_key')
+                async with websockets.connect(f"{self.base_url}/{self._listen_key}", ping_interval=20) as ws:
+                    self.connected = True
+                    backoff = 1
+                    logger.info("Connected to user data stream.")
+                    keepalive_task = asyncio.create_task(self._keepalive())
+                    # Events arriving while seeding wait in the socket and are applied afterwards
+                    await self._seed()
+                    async for raw in ws:
+                        if not await self._handle_message(raw):
+                            break # listenKey expired: reconnect with a new one
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"User data stream disconnected: {e}. Reconnecting in {backoff}s")
+            finally:
+                self.connected = False
+                self.seeded = False
+                if keepalive_task: keepalive_task.cancel()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 60)
+
+    async def _handle_message(self, raw: Union[str, bytes]) -> bool:
+        """Applies one event; returns False when the stream must be re-established."""
+        try:
+            event = json.loads(raw)
+        except ValueError:
+            logger.debug("Ignoring non-JSON user stream frame.")
+            return True
+        event_type = event.get('e')
+        if event_type == 'outboundAccountPosition':
+            for b in event.get('B', []):
+                self.balances[b['a']] = (decimal_context.create_decimal(b['f']), decimal_context.create_decimal(b['l']))
+            balances_cache.invalidate()
+        elif event_type == 'executionReport':
+            self._apply_execution_report(event)
+            if event.get('x') == 'TRADE':
+                await symbol_discovery.note(event['s'], 'stream')
+        elif event_type == 'listenKeyExpired':
+            logger.warning("User data stream listenKey expired.")
+            return False
+        return True
+
+    def _apply_execution_report(self, event: Dict[str, Any]) -> None:
+        order_id = event['i']
+        current = self.open_orders.get(order_id)
+        if current and current.get('updateTime', 0) > event.get('E', 0):
+            return # Older than what the REST seed already reported
+        if event['X'] in CLOSED_ORDER_STATUSES:
+            self.open_orders.pop(order_id, None)
+            return
+        self.open_orders[order_id] = {
+            'symbol': event['s'], 'orderId': order_id, 'clientOrderId': event.get('c'),
+            'side': event['S'], 'type': event['o'], 'status': event['X'],
+            'origQty': event['q'], 'executedQty': event['z'], 'price': event['p'], 'stopPrice': event['P'],
+            'time': event.get('O', event.get('E', 0)), 'updateTime': event.get('E', 0),
+        }
+
+user_stream = UserDataStream()
+
+async def get_open_orders() -> List[Dict[str, Any]]:
+    """All open orders: from the user data stream when live, otherwise REST (weight 80)."""
+    if user_stream.live:
+        return user_stream.orders()
+    return await binance_call('get_open_orders')
+
 # --- تعريف بيانات الاستدعاء (Callback Data) ---
 # (نفس تعريفات الـ Callbacks السابقة)
 CALLBACK_MAIN_MENU = "main_menu"; CALLBACK_GOTO_TRADING = "goto_trading"; CALLBACK_GOTO_ACCOUNT = "goto_account"
@@ -109,6 +754,7 @@ CALLBACK_GOTO_ALERTS = "goto_alerts"
 CALLBACK_SHOW_HELP = "show_help"; CALLBACK_SHOW_BALANCE = "show_balance"; CALLBACK_SHOW_ORDERS = "show_orders"
 CALLBACK_SHOW_PNL = "show_pnl"; CALLBACK_START_BUY = "start_buy"; CALLBACK_START_SELL = "start_sell"
 CALLBACK_SHOW_GAINERS = "show_gainers"; CALLBACK_SHOW_LOSERS = "show_losers"; CALLBACK_SEARCH_MANUAL_START = "search_manual_start"
+CALLBACK_SHOW_VOLUME_LEADERS = "show_volume_leaders"; CALLBACK_SEARCH_PAGE_PREFIX = "search_page_"
 CALLBACK_HISTORY_TODAY = "history_today"; CALLBACK_HISTORY_BY_PAIR_START = "history_by_pair_start"
 CALLBACK_CONFIRM_TRADE = "confirm_trade_final"; CALLBACK_CANCEL_TRADE = "cancel_trade_conv"
 CALLBACK_ADD_SLTP_YES = "add_sltp_yes"; CALLBACK_ADD_SLTP_NO = "add_sltp_no"; CALLBACK_ADD_SLTP_PERCENT = "add_sltp_percent"
@@ -176,7 +822,6 @@ CALLBACK_QS_TP_PERC_PREFIX = "qs_tp_perc_"
 
 
 # --- ثوابت للتخزين المؤقت وإعدادات المفضلة ---
-CACHE_DURATION_SECONDS = 300 # 5 دقائق
 MAX_FAVORITES = 15
 MAX_FAVORITE_BUTTONS = 5
 # <<<--- إضافة قائمة المفضلة الافتراضية --- >>>
@@ -191,6 +836,166 @@ DEFAULT_ALERT_THRESHOLD = Decimal('5.0') # نسبة 5%
 DEFAULT_ALERT_INTERVAL_MINUTES = 5 # التحقق كل 5 دقائق
 DEFAULT_ALERT_SPAM_DELAY_MINUTES = 60 # إرسال تنبيه لنفس الزوج كل 60 دقيقة كحد أقصى
 
+# --- سجل بيانات الرموز (فهرس O(1)) ---
+@dataclass(frozen=True)
+class SymbolMeta:
+    """Parsed exchange-info entry for one symbol."""
+    symbol: str
+    status: str
+    base_asset: str
+    quote_asset: str
+    base_precision: int
+    quote_precision: int
+    filters: Dict[str, Dict[str, Any]] = field(default_factory=dict, compare=False)
+
+    @property
+    def is_trading(self) -> bool:
+        return self.status == 'TRADING'
+
+class _TrieNode:
+    __slots__ = ('children', 'symbols')
+
+    def __init__(self):
+        self.children: Dict[str, '_TrieNode'] = {}
+        self.symbols: Set[str] = set()
+
+class SymbolSearchIndex:
+    """
+    Search index over trading symbols: a prefix trie keyed by symbol and base
+    asset, plus 2/3-gram posting sets for substring queries. Results are
+    ranked exact symbol, exact base asset, symbol prefix, then other matches;
+    ties are broken by 24h quote volume, then alphabetically.
+    """
+
+    NGRAM_SIZES = (2, 3)
+
+    def __init__(self):
+        self._trie = _TrieNode()
+        self._ngrams: Dict[str, Set[str]] = {}
+        self._base: Dict[str, str] = {}
+        self.liquidity: Dict[str, float] = {}
+
+    def rebuild(self, metas: Any) -> None:
+        trie = _TrieNode()
+        ngrams: Dict[str, Set[str]] = defaultdict(set)
+        base: Dict[str, str] = {}
+        for meta in metas:
+            if not meta.is_trading: continue
+            base[meta.symbol] = meta.base_asset
+            for word in {meta.symbol, meta.base_asset}:
+                node = trie
+                for char in word:
+                    node = node.children.setdefault(char, _TrieNode())
+                    node.symbols.add(meta.symbol)
+            for n in self.NGRAM_SIZES:
+                for i in range(len(meta.symbol) - n + 1):
+                    ngrams[meta.symbol[i:i + n]].add(meta.symbol)
+        self._trie, self._ngrams, self._base = trie, dict(ngrams), base
+
+    def set_liquidity(self, volumes: Any) -> None:
+        """Updates the tie-break ranking from (symbol, quote_volume) pairs."""
+        self.liquidity = dict(volumes)
+
+    def __len__(self) -> int:
+        return len(self._base)
+
+    def _prefixed(self, text: str) -> Set[str]:
+        node = self._trie
+        for char in text:
+            node = node.children.get(char)
+            if node is None: return set()
+        return node.symbols
+
+    def _containing(self, text: str) -> Set[str]:
+        n = max(size for size in self.NGRAM_SIZES if size <= len(text))
+        postings = sorted((self._ngrams.get(text[i:i + n], set()) for i in range(len(text) - n + 1)), key=len)
+        candidates = set(postings[0]).intersection(*postings[1:])
+        # n-grams may match out of order; confirm the real substring
+        return {symbol for symbol in candidates if text in symbol}
+
+    def _rank(self, text: str, symbol: str) -> Tuple[int, float, str]:
+        if symbol == text: tier = 0
+        elif self._base.get(symbol) == text: tier = 1
+        elif symbol.startswith(text): tier = 2
+        else: tier = 3
+        return (tier, -self.liquidity.get(symbol, 0.0), symbol)
+
+    def search(self, text: str, limit: Optional[int] = None) -> List[str]:
+        """Ranked trading symbols matching text (case-insensitive)."""
+        text = text.strip().upper()
+        if not text: return []
+        matches = set(self._prefixed(text))
+        if len(text) >= min(self.NGRAM_SIZES):
+            matches |= self._containing(text)
+        ranked = sorted(matches, key=functools.partial(self._rank, text))
+        return ranked[:limit] if limit is not None else ranked
+
+class SymbolRegistry:
+    """
+    Symbol -> SymbolMeta index built once per exchange-info refresh, so
+    lookups in the trade flow no longer scan the full `symbols` list.
+    """
+
+    def __init__(self):
+        self._by_symbol: Dict[str, SymbolMeta] = {}
+        self._trading_by_quote: Dict[str, List[str]] = {}
+        self._trading_by_base: Dict[str, List[str]] = {}
+        self._source_id: Optional[int] = None
+        self.search_index = SymbolSearchIndex()
+
+    def rebuild(self, exchange_info: Dict[str, Any]) -> None:
+        by_symbol: Dict[str, SymbolMeta] = {}
+        trading_by_quote: Dict[str, List[str]] = defaultdict(list)
+        trading_by_base: Dict[str, List[str]] = defaultdict(list)
+        for s in exchange_info.get('symbols', []):
+            meta = SymbolMeta(
+                symbol=s['symbol'],
+                status=s.get('status', ''),
+                base_asset=s.get('baseAsset', ''),
+                quote_asset=s.get('quoteAsset', ''),
+                base_precision=int(s.get('baseAssetPrecision', 8)),
+                quote_precision=int(s.get('quoteAssetPrecision', s.get('quotePrecision', 8))),
+                filters={f.get('filterType'): f for f in s.get('filters', [])},
+            )
+            by_symbol[meta.symbol] = meta
+            if meta.is_trading:
+                trading_by_quote[meta.quote_asset].append(meta.symbol)
+                trading_by_base[meta.base_asset].append(meta.symbol)
+        # Swap in one step so readers never see a half-built index
+        self._by_symbol, self._trading_by_quote, self._trading_by_base = by_symbol, dict(trading_by_quote), dict(trading_by_base)
+        self.search_index.rebuild(by_symbol.values())
+        self._source_id = id(exchange_info)
+
+    def ensure(self, exchange_info: Optional[Dict[str, Any]]) -> 'SymbolRegistry':
+        """Rebuilds from `exchange_info` if the index was built from another copy (e.g. after a restart)."""
+        if exchange_info and id(exchange_info) != self._source_id:
+            self.rebuild(exchange_info)
+        return self
+
+    def get(self, symbol: str) -> Optional[SymbolMeta]:
+        return self._by_symbol.get(symbol)
+
+    def __contains__(self, symbol: object) -> bool:
+        return symbol in self._by_symbol
+
+    def __len__(self) -> int:
+        return len(self._by_symbol)
+
+    def trading_symbols(self, quote_asset: Optional[str] = None) -> List[str]:
+        """Trading symbols, optionally limited to one quote asset."""
+        if quote_asset is not None:
+            return list(self._trading_by_quote.get(quote_asset, ()))
+        return [s for symbols in self._trading_by_quote.values() for s in symbols]
+
+    def trading_symbols_with_base(self, base_asset: str) -> List[str]:
+        return list(self._trading_by_base.get(base_asset, ()))
+
+symbol_registry = SymbolRegistry()
+
+def get_symbol_registry(context: ContextTypes.DEFAULT_TYPE) -> SymbolRegistry:
+    """Returns the registry, building it from cached exchange info if needed."""
+    return symbol_registry.ensure(exchange_cache.get(EXCHANGE_INFO_CACHE_KEY))
+
 # --- دوال مساعدة ---
 
 async def fetch_and_cache_exchange_info(context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -198,12 +1003,17 @@ async def fetch_and_cache_exchange_info(context: ContextTypes.DEFAULT_TYPE) -> N
     if not binance_client:
         logger.warning("Binance client not initialized. Cannot fetch exchange info.")
         return
+    await request_coalescer.do(EXCHANGE_INFO_CACHE_KEY, lambda: _refresh_exchange_info(context))
+
+async def _refresh_exchange_info(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Downloads exchange info once (callers are coalesced by fetch_and_cache_exchange_info)."""
     try:
         logger.info("Fetching exchange information from Binance...")
-        exchange_info = binance_client.get_exchange_info()
-        context.bot_data[EXCHANGE_INFO_CACHE_KEY] = exchange_info
-        valid_symbols = {s['symbol'] for s in exchange_info.get('symbols', []) if s.get('status') == 'TRADING'}
-        context.bot_data[SYMBOLS_CACHE_KEY] = valid_symbols
+        exchange_info = await binance_call('get_exchange_info')
+        exchange_cache.set(EXCHANGE_INFO_CACHE_KEY, exchange_info)
+        symbol_registry.rebuild(exchange_info)
+        valid_symbols = set(symbol_registry.trading_symbols())
+        exchange_cache.set(SYMBOLS_CACHE_KEY, valid_symbols)
         logger.info(f"Cached exchange info and {len(valid_symbols)} valid symbols.")
     except (BinanceAPIException, BinanceRequestException) as e:
         logger.error(f"Binance API Error fetching exchange info: {e}")
@@ -212,48 +1022,36 @@ async def fetch_and_cache_exchange_info(context: ContextTypes.DEFAULT_TYPE) -> N
 
 def is_valid_symbol(symbol: str, context: ContextTypes.DEFAULT_TYPE) -> bool:
     """Checks if a symbol is valid and trading based on cached info."""
-    valid_symbols: Set[str] = context.bot_data.get(SYMBOLS_CACHE_KEY, set())
+    valid_symbols: Set[str] = exchange_cache.get(SYMBOLS_CACHE_KEY, set())
     if not valid_symbols:
         logger.warning("Valid symbols cache is empty. Cannot validate symbol.")
         # Consider fetching here as a fallback, but might slow down requests
         return False
     return symbol in valid_symbols
 
-def get_symbol_filters(symbol: str, context: ContextTypes.DEFAULT_TYPE) -> Dict[str, Dict[str, Any]]:
-    """Gets all filters for a symbol from cached exchange info."""
-    exchange_info = context.bot_data.get(EXCHANGE_INFO_CACHE_KEY)
-    symbol_filters = {}
-    if exchange_info and 'symbols' in exchange_info:
-        for symbol_data in exchange_info['symbols']:
-            if symbol_data['symbol'] == symbol:
-                for f in symbol_data.get('filters', []):
-                    symbol_filters[f.get('filterType')] = f
-                break
+async def get_symbol_filters(symbol: str, context: ContextTypes.DEFAULT_TYPE) -> Dict[str, Dict[str, Any]]:
+    """Gets all filters for a symbol from the symbol registry."""
+    meta = get_symbol_registry(context).get(symbol)
+    symbol_filters = dict(meta.filters) if meta else {}
     if not symbol_filters:
          # Fallback to individual fetch if needed, but less efficient
-         info = get_symbol_info_direct(symbol, context) # Use direct fetch helper
+         info = await get_symbol_info_direct(symbol, context) # Use direct fetch helper
          if info:
               for f in info.get('filters', []):
                   symbol_filters[f.get('filterType')] = f
     return symbol_filters
 
-def get_symbol_info_direct(symbol: str, context: ContextTypes.DEFAULT_TYPE) -> Optional[Dict[str, Any]]:
+async def get_symbol_info_direct(symbol: str, context: ContextTypes.DEFAULT_TYPE) -> Optional[Dict[str, Any]]:
     """Directly fetches symbol info (used as fallback or if cache is unreliable)."""
     if not binance_client: return None
-    cache_key = f"symbol_info_direct_{symbol}" # Separate cache key for direct fetches
-    cached_info = context.bot_data.get(cache_key)
-    # Add timestamp check for cache validity if needed, e.g., cache for 1 minute
-    # current_time = time.time()
-    # if cached_info and cached_info.get('timestamp', 0) > current_time - 60:
-    #    return cached_info.get('data')
-    if cached_info: return cached_info # Simple cache check for now
+    cached_info = symbol_info_cache.get(symbol)
+    if cached_info: return cached_info
 
     try:
         logger.warning(f"Fetching individual symbol info for {symbol} (direct)")
-        info = binance_client.get_symbol_info(symbol)
+        info = await request_coalescer.do(f"symbol_info_direct_{symbol}", lambda: binance_call('get_symbol_info', symbol=symbol))
         if info:
-            # Cache for a short duration
-            context.bot_data[cache_key] = info # Store directly or with timestamp: {'data': info, 'timestamp': time.time()}
+            symbol_info_cache.set(symbol, info)
             return info
         return None
     except (BinanceAPIException, BinanceRequestException) as e:
@@ -263,23 +1061,27 @@ def get_symbol_info_direct(symbol: str, context: ContextTypes.DEFAULT_TYPE) -> O
         logger.error(f"Generic error fetching direct symbol info for {symbol}: {e}")
         return None
 
-async def get_cached_tickers(context: ContextTypes.DEFAULT_TYPE, quote_asset: str = 'USDT', force_refresh: bool = False) -> Dict[str, Decimal]:
-    """Gets cached ticker prices, refreshing if needed or forced."""
+async def get_cached_tickers(context: ContextTypes.DEFAULT_TYPE, quote_asset: str = 'USDT', force_refresh: bool = False) -> Mapping[str, Decimal]:
+    """Gets ticker prices from the live price book, falling back to the cached REST snapshot."""
+    if market_data.live:
+        return market_data.book # Always fresh, no REST call
     if not binance_client: return {}
     cache_key = f"{TICKERS_CACHE_KEY}_{quote_asset}"
-    current_time = time.time()
-    cached_data = context.bot_data.get(cache_key, {})
-    tickers = cached_data.get('data')
-    cache_time = cached_data.get('timestamp', 0)
-
-    if not force_refresh and tickers and (current_time - cache_time < 60): # Cache tickers for 1 min
+    tickers = None if force_refresh else tickers_cache.get(quote_asset)
+    if tickers:
         logger.debug("Using cached tickers.")
         return tickers
 
-    logger.info(f"Fetching new tickers for {quote_asset} pairs...")
+    # Concurrent callers after expiry share one download instead of stampeding
+    return await request_coalescer.do(cache_key, lambda: _refresh_tickers(context, quote_asset))
+
+async def _refresh_tickers(context: ContextTypes.DEFAULT_TYPE, quote_asset: str) -> Dict[str, Decimal]:
+    """Downloads all ticker prices into tickers_cache (the expired snapshot is returned on error)."""
+    tickers = tickers_cache.get_stale(quote_asset)
+    logger.info("Fetching new tickers for all pairs...")
     try:
         # Fetch all tickers is often simpler and sometimes required if filtering isn't supported well
-        all_tickers_raw = binance_client.get_symbol_ticker()
+        all_tickers_raw = await binance_call('get_symbol_ticker')
         new_tickers = {
             t['symbol']: decimal_context.create_decimal(t['price'])
             for t in all_tickers_raw # Process all tickers first
@@ -292,11 +1094,11 @@ async def get_cached_tickers(context: ContextTypes.DEFAULT_TYPE, quote_asset: st
              pair = f"{base}USDT"
              if pair not in new_tickers:
                   try:
-                       ticker_info = binance_client.get_symbol_ticker(symbol=pair)
+                       ticker_info = await binance_call('get_symbol_ticker', symbol=pair)
                        if ticker_info: new_tickers[pair] = decimal_context.create_decimal(ticker_info['price'])
                   except Exception: pass # Ignore if specific pair fails
 
-        context.bot_data[cache_key] = {'data': new_tickers, 'timestamp': current_time}
+        tickers_cache.set(quote_asset, new_tickers)
         logger.info(f"Cached {len(new_tickers)} tickers (all pairs).")
         # Return all tickers, filtering can happen at the call site if necessary
         return new_tickers
@@ -307,6 +1109,33 @@ async def get_cached_tickers(context: ContextTypes.DEFAULT_TYPE, quote_asset: st
         logger.error(f"Error fetching tickers: {e}", exc_info=True)
         return tickers or {} # Return old cache on error if available
 
+def summarize_balances(raw_balances: Any, tickers_all: Mapping[str, Decimal], min_value_usd: Decimal) -> List[Dict[str, Any]]:
+    """Turns (asset, free, locked) tuples into significant balances with a USDT estimate, sorted by value."""
+    significant_balances = []
+    for asset, free, locked in raw_balances:
+        total = free + locked
+        if total > 0:
+            value_usdt = decimal_context.create_decimal(0)
+            # Estimate value in USDT
+            usdt_pair = f"{asset}USDT"
+            if asset == 'USDT': value_usdt = total
+            elif usdt_pair in tickers_all: value_usdt = total * tickers_all[usdt_pair]
+            # Add fallbacks for major pairs if direct USDT pair is missing
+            elif asset == 'BTC' and 'BTCUSDT' in tickers_all: value_usdt = total * tickers_all['BTCUSDT']
+            elif asset == 'ETH' and 'ETHUSDT' in tickers_all: value_usdt = total * tickers_all['ETHUSDT']
+            elif asset == 'BNB' and 'BNBUSDT' in tickers_all: value_usdt = total * tickers_all['BNBUSDT']
+
+            # Include if value > threshold or it's a major stablecoin/base with some balance
+            if value_usdt >= min_value_usd or (asset in ['USDT', 'BUSD', 'BTC', 'ETH', 'BNB'] and total > Decimal('0.00001')):
+                significant_balances.append({
+                    'asset': asset, 'free': free, 'locked': locked,
+                    'total': total, 'value_usdt': value_usdt
+                })
+
+    # Sort by estimated value
+    significant_balances.sort(key=lambda x: x.get('value_usdt', 0), reverse=True)
+    return significant_balances
+
 async def get_account_balances(context: ContextTypes.DEFAULT_TYPE, min_value_usd: Decimal = Decimal('1.0')) -> List[Dict[str, Any]]:
     """
     Fetches account balances with significant value (approx. > min_value_usd).
@@ -314,54 +1143,34 @@ async def get_account_balances(context: ContextTypes.DEFAULT_TYPE, min_value_usd
     """
     if not binance_client: return []
     cache_key = "account_balances"
-    current_time = time.time()
-    cached_data = context.bot_data.get(cache_key, {})
-    balances = cached_data.get('data')
-    cache_time = cached_data.get('timestamp', 0)
-
-    # Use cache if recent (e.g., within 60 seconds)
-    if balances and (current_time - cache_time < 60):
+    balances = balances_cache.get(cache_key)
+    if balances is None and user_stream.live:
+        # Stream balances are already current; only the USD valuation is computed
+        tickers_all = await get_cached_tickers(context, quote_asset='USDT')
+        balances = summarize_balances(
+            ((asset, free, locked) for asset, (free, locked) in user_stream.balances.items()), tickers_all, min_value_usd)
+        balances_cache.set(cache_key, balances)
+        return balances
+    if balances:
         logger.info("Using cached account balances.")
         return balances
 
+    return await request_coalescer.do(cache_key, lambda: _refresh_account_balances(context, cache_key, min_value_usd))
+
+async def _refresh_account_balances(context: ContextTypes.DEFAULT_TYPE, cache_key: str, min_value_usd: Decimal) -> List[Dict[str, Any]]:
+    """Downloads the account snapshot and caches the significant balances."""
     logger.info("Fetching new account balances...")
     try:
-        account_info = binance_client.get_account()
+        account_info = await binance_call('get_account')
         all_balances = account_info.get('balances', [])
-        significant_balances = []
 
         # Get cached USDT tickers for value estimation (using the function that caches all)
         tickers_all = await get_cached_tickers(context, quote_asset='USDT') # Get cache containing USDT pairs
 
-        for balance in all_balances:
-            asset = balance['asset']
-            # Use Decimal context for precision
-            free = decimal_context.create_decimal(balance['free'])
-            locked = decimal_context.create_decimal(balance['locked'])
-            total = free + locked
-
-            if total > 0:
-                value_usdt = decimal_context.create_decimal(0)
-                # Estimate value in USDT
-                usdt_pair = f"{asset}USDT"
-                if asset == 'USDT': value_usdt = total
-                elif usdt_pair in tickers_all: value_usdt = total * tickers_all[usdt_pair]
-                # Add fallbacks for major pairs if direct USDT pair is missing
-                elif asset == 'BTC' and 'BTCUSDT' in tickers_all: value_usdt = total * tickers_all['BTCUSDT']
-                elif asset == 'ETH' and 'ETHUSDT' in tickers_all: value_usdt = total * tickers_all['ETHUSDT']
-                elif asset == 'BNB' and 'BNBUSDT' in tickers_all: value_usdt = total * tickers_all['BNBUSDT']
-
-
-                # Include if value > threshold or it's a major stablecoin/base with some balance
-                if value_usdt >= min_value_usd or (asset in ['USDT', 'BUSD', 'BTC', 'ETH', 'BNB'] and total > Decimal('0.00001')):
-                    significant_balances.append({
-                        'asset': asset, 'free': free, 'locked': locked,
-                        'total': total, 'value_usdt': value_usdt
-                    })
-
-        # Sort by estimated value
-        significant_balances.sort(key=lambda x: x.get('value_usdt', 0), reverse=True)
-        context.bot_data[cache_key] = {'data': significant_balances, 'timestamp': current_time}
+        significant_balances = summarize_balances(
+            ((b['asset'], decimal_context.create_decimal(b['free']), decimal_context.create_decimal(b['locked'])) for b in all_balances),
+            tickers_all, min_value_usd)
+        balances_cache.set(cache_key, significant_balances)
         return significant_balances
 
     except (BinanceAPIException, BinanceRequestException) as e:
@@ -380,15 +1189,19 @@ async def get_current_price(symbol: str, context: ContextTypes.DEFAULT_TYPE) ->
 
     if symbol in tickers:
         return tickers[symbol]
+    elif market_data.live:
+        # The live book holds every listed symbol, so a miss means an unknown symbol
+        logger.warning(f"Price for {symbol} not found in live price book.")
+        return None
     else:
         # If not in cache, try a direct fetch as fallback
         logger.warning(f"Price for {symbol} not in main ticker cache, fetching directly.")
         try:
-            ticker_info = binance_client.get_symbol_ticker(symbol=symbol)
+            ticker_info = await binance_call('get_symbol_ticker', symbol=symbol)
             if ticker_info and 'price' in ticker_info:
                 price = decimal_context.create_decimal(ticker_info['price'])
                 # Optionally update cache here? Be careful about cache structure.
-                # context.bot_data[TICKERS_CACHE_KEY + '_USDT']['data'][symbol] = price # Risky if structure changes
+                # tickers_cache.get_stale('USDT')[symbol] = price # Risky: mutates a shared snapshot
                 return price
             logger.warning(f"Direct price fetch failed for {symbol}")
             return None
@@ -399,16 +1212,49 @@ async def get_current_price(symbol: str, context: ContextTypes.DEFAULT_TYPE) ->
              logger.error(f"Generic error fetching direct price for {symbol}: {e}")
              return None
 
+async def get_current_prices(symbols: Any, context: ContextTypes.DEFAULT_TYPE) -> Dict[str, Decimal]:
+    """
+    Resolves many symbols against one ticker snapshot; misses are fetched in a
+    single batched get_symbol_ticker(symbols=[...]) call. Unresolved symbols are omitted.
+    """
+    if not binance_client: return {}
+    tickers = await get_cached_tickers(context, quote_asset='USDT')
+    prices: Dict[str, Decimal] = {}
+    misses = []
+    for symbol in symbols:
+        price = tickers.get(symbol)
+        if price is not None: prices[symbol] = price
+        else: misses.append(symbol)
+    if not misses or market_data.live: # The live book holds every listed symbol
+        return prices
+
+    # Unknown symbols would fail the whole batch, so only ask for listed ones
+    registry = get_symbol_registry(context)
+    batch = sorted({symbol for symbol in misses if symbol in registry or not len(registry)})
+    if not batch: return prices
+    logger.warning(f"{len(batch)} prices not in main ticker cache, fetching them in one batch.")
+    try:
+        symbols_param = json.dumps(batch, separators=(',', ':'))
+        for ticker in await binance_call('get_symbol_ticker', symbols=symbols_param):
+            prices[ticker['symbol']] = decimal_context.create_decimal(ticker['price'])
+    except (BinanceAPIException, BinanceRequestException) as e:
+        logger.error(f"Binance API Error fetching batched prices for {batch}: {e}")
+    except Exception as e:
+        logger.error(f"Generic error fetching batched prices for {batch}: {e}")
+    return prices
+
+def get_quote_asset(pair: str, context: ContextTypes.DEFAULT_TYPE) -> str:
+    """Returns the quote asset of a pair from the symbol registry ('' if unknown)."""
+    meta = get_symbol_registry(context).get(pair)
+    return meta.quote_asset if meta else ""
+
 async def get_quote_asset_balance(pair: str, context: ContextTypes.DEFAULT_TYPE) -> Optional[Decimal]:
     """Gets the free balance of the quote asset for a given pair."""
     quote_asset = ""
     # Improved logic to find quote asset (handles BTC, ETH etc. as quote)
-    exchange_info = context.bot_data.get(EXCHANGE_INFO_CACHE_KEY)
-    if exchange_info:
-         for symbol_data in exchange_info.get('symbols', []):
-             if symbol_data['symbol'] == pair:
-                  quote_asset = symbol_data.get('quoteAsset')
-                  break
+    registry = get_symbol_registry(context)
+    if len(registry):
+         quote_asset = get_quote_asset(pair, context)
     else:
          # Fallback basic detection if exchange info is missing
          possible_quotes = ["USDT", "BUSD", "USDC", "TUSD", "DAI", "BTC", "ETH", "BNB", "EUR", "GBP"] # Add more if needed
@@ -440,110 +1286,137 @@ def get_significant_digits(number_str: str) -> int:
         return len(cleaned.split('.')[-1]) if '.' in cleaned else 0
     return 0
 
-def adjust_price(price: Decimal, symbol_filters: Dict[str, Dict[str, Any]]) -> Decimal:
-    """Adjusts price according to PRICE_FILTER (tickSize)."""
-    price_filter = symbol_filters.get('PRICE_FILTER')
-    adjusted_price = price
-    min_price_limit = Decimal('-Infinity') # Default no min limit
-    max_price_limit = Decimal('Infinity')  # Default no max limit
+@dataclass(frozen=True)
+class SymbolQuantizer:
+    """
+    PRICE_FILTER / LOT_SIZE constants of a symbol, parsed once.
+    Shared through quantizer_for() by every symbol with identical filters.
+    """
+    tick_size: Optional[Decimal]
+    min_price: Decimal
+    max_price: Decimal
+    price_precision: int
+    step_size: Optional[Decimal]
+    min_qty: Decimal
+    max_qty: Decimal
+    qty_precision: int
+
+    @classmethod
+    def from_key(cls, key: Tuple[Optional[str], ...]) -> 'SymbolQuantizer':
+        tick_str, min_price_str, max_price_str, step_str, min_qty_str, max_qty_str = key
+        return cls(
+            tick_size=cls._parse_size(tick_str),
+            min_price=decimal_context.create_decimal(min_price_str) if min_price_str is not None else Decimal('-Infinity'),
+            max_price=decimal_context.create_decimal(max_price_str) if max_price_str is not None else Decimal('Infinity'),
+            price_precision=cls._parse_precision(tick_str),
+            step_size=cls._parse_size(step_str),
+            min_qty=decimal_context.create_decimal(min_qty_str) if min_qty_str is not None else Decimal('0'),
+            max_qty=decimal_context.create_decimal(max_qty_str) if max_qty_str is not None else Decimal('Infinity'),
+            qty_precision=cls._parse_precision(step_str),
+        )
 
-    if price_filter:
-        min_price_limit = decimal_context.create_decimal(price_filter.get('minPrice', '0'))
-        max_price_limit = decimal_context.create_decimal(price_filter.get('maxPrice', 'inf'))
-        tick_size_str = price_filter.get('tickSize')
+    @staticmethod
+    def _parse_size(size_str: Optional[str]) -> Optional[Decimal]:
+        if not size_str: return None
+        try:
+            size = decimal_context.create_decimal(size_str)
+            return size if size > 0 else None
+        except (InvalidOperation, TypeError) as e:
+            logger.warning(f"Could not parse tick/step size {size_str}: {e}")
+            return None
 
-        if tick_size_str:
-            try:
-                tick_size = decimal_context.create_decimal(tick_size_str)
-                if tick_size > 0:
-                    # Quantize to the tick size, rounding down (usually safer for limits)
-                    adjusted_price = (price / tick_size).quantize(Decimal('1'), rounding=ROUND_DOWN) * tick_size
-            except (InvalidOperation, TypeError) as e:
-                logger.warning(f"Could not apply tick_size {tick_size_str} to price {price}: {e}")
+    @staticmethod
+    def _parse_precision(size_str: Optional[str]) -> int:
+        if size_str is None: return 8 # Default precision
+        try:
+            return get_significant_digits(size_str)
+        except Exception as e:
+            logger.warning(f"Could not determine precision from '{size_str}': {e}. Using default 8.")
+            return 8
+
+    def round_price(self, price: Decimal) -> Decimal:
+        """Rounds price down to tickSize and clamps it to [minPrice, maxPrice]."""
+        adjusted_price = price
+        if self.tick_size is not None:
+            # Quantize to the tick size, rounding down (usually safer for limits)
+            adjusted_price = (price / self.tick_size).quantize(Decimal('1'), rounding=ROUND_DOWN) * self.tick_size
+
+        # Ensure price respects min/max limits after adjustment
+        if adjusted_price < self.min_price:
+            logger.warning(f"Adjusted price {adjusted_price} below minPrice {self.min_price}. Clamping.")
+            adjusted_price = self.min_price
+        if adjusted_price > self.max_price:
+            logger.warning(f"Adjusted price {adjusted_price} above maxPrice {self.max_price}. Clamping.")
+            adjusted_price = self.max_price
+
+        # Ensure price doesn't become zero or negative if it was positive, unless minPrice allows it
+        if price > 0 and adjusted_price <= 0 and self.min_price > 0:
+            logger.warning(f"Adjusted price became <= 0 for {price}. Using minPrice {self.min_price}.")
+            adjusted_price = self.min_price
+        return adjusted_price
+
+    def round_qty(self, quantity: Decimal) -> Decimal:
+        """Rounds quantity down to stepSize; below minQty becomes 0, above maxQty is clamped."""
+        adjusted_quantity = quantity
+        if self.step_size is not None:
+            # Quantize to the step size, rounding down
+            adjusted_quantity = (quantity / self.step_size).quantize(Decimal('1'), rounding=ROUND_DOWN) * self.step_size
+
+        if adjusted_quantity < self.min_qty:
+            # Clamping to 0 is safer than forcing minQty, which might place an unintended order.
+            logger.warning(f"Adjusted quantity {adjusted_quantity} below minQty {self.min_qty}. Clamping to 0.")
+            adjusted_quantity = Decimal(0)
+        if adjusted_quantity > self.max_qty:
+            logger.warning(f"Adjusted quantity {adjusted_quantity} above maxQty {self.max_qty}. Clamping.")
+            adjusted_quantity = self.max_qty
+        return adjusted_quantity
+
+    def format(self, value: Decimal, filter_type: str = 'PRICE_FILTER') -> str:
+        """Formats a price (PRICE_FILTER) or quantity (LOT_SIZE) to the filter's precision."""
+        precision = self.price_precision if filter_type == 'PRICE_FILTER' else self.qty_precision if filter_type == 'LOT_SIZE' else 8
+        try:
+            formatted_value = f"{value:.{precision}f}"
+            if 'e' in formatted_value.lower():
+                # Fallback to normalize() which handles scientific notation better for very small/large numbers
+                return str(value.normalize())
+            return formatted_value
+        except Exception as e:
+            logger.error(f"Error formatting decimal {value} with precision {precision}: {e}")
+            return str(value.normalize())
 
-    # Ensure price respects min/max limits after adjustment
-    if adjusted_price < min_price_limit:
-        logger.warning(f"Adjusted price {adjusted_price} below minPrice {min_price_limit}. Clamping.")
-        adjusted_price = min_price_limit
-    if adjusted_price > max_price_limit:
-         logger.warning(f"Adjusted price {adjusted_price} above maxPrice {max_price_limit}. Clamping.")
-         adjusted_price = max_price_limit
+@functools.lru_cache(maxsize=4096)
+def _build_quantizer(key: Tuple[Optional[str], ...]) -> SymbolQuantizer:
+    return SymbolQuantizer.from_key(key)
 
+def quantizer_for(symbol_filters: Dict[str, Dict[str, Any]]) -> SymbolQuantizer:
+    """Returns the cached quantizer for a symbol's filters (keyed by the raw filter strings)."""
+    price_filter = symbol_filters.get('PRICE_FILTER')
+    lot_filter = symbol_filters.get('LOT_SIZE')
+    key = (
+        price_filter.get('tickSize') if price_filter else None,
+        price_filter.get('minPrice', '0') if price_filter else None,
+        price_filter.get('maxPrice', 'inf') if price_filter else None,
+        lot_filter.get('stepSize') if lot_filter else None,
+        lot_filter.get('minQty', '0') if lot_filter else None,
+        lot_filter.get('maxQty', 'inf') if lot_filter else None,
+    )
+    return _build_quantizer(key)
 
-    # Ensure price doesn't become zero or negative if it was positive, unless minPrice allows it
-    if price > 0 and adjusted_price <= 0 and min_price_limit > 0:
-        logger.warning(f"Adjusted price became <= 0 for {price}. Using minPrice {min_price_limit}.")
-        adjusted_price = min_price_limit
+async def get_symbol_quantizer(symbol: str, context: ContextTypes.DEFAULT_TYPE) -> SymbolQuantizer:
+    """Gets the quantizer for a symbol from its cached filters."""
+    return quantizer_for(await get_symbol_filters(symbol, context))
 
-    return adjusted_price
+def adjust_price(price: Decimal, symbol_filters: Dict[str, Dict[str, Any]]) -> Decimal:
+    """Adjusts price according to PRICE_FILTER (tickSize)."""
+    return quantizer_for(symbol_filters).round_price(price)
 
 def adjust_quantity(quantity: Decimal, symbol_filters: Dict[str, Dict[str, Any]]) -> Decimal:
     """Adjusts quantity according to LOT_SIZE filter (stepSize, minQty, maxQty)."""
-    lot_filter = symbol_filters.get('LOT_SIZE')
-    adjusted_quantity = quantity
-    min_qty_limit = Decimal('0') # Default min quantity
-    max_qty_limit = Decimal('Infinity') # Default max quantity
-
-    if lot_filter:
-        min_qty_limit = decimal_context.create_decimal(lot_filter.get('minQty', '0'))
-        max_qty_limit = decimal_context.create_decimal(lot_filter.get('maxQty', 'inf'))
-        step_size_str = lot_filter.get('stepSize')
-
-        if step_size_str:
-            try:
-                step_size = decimal_context.create_decimal(step_size_str)
-                if step_size > 0:
-                    # Quantize to the step size, rounding down
-                    adjusted_quantity = (quantity / step_size).quantize(Decimal('1'), rounding=ROUND_DOWN) * step_size
-                    logger.debug(f"Applied step_size {step_size_str}, adjusted quantity: {adjusted_quantity}")
-            except (InvalidOperation, TypeError) as e:
-                logger.warning(f"Could not apply step_size {step_size_str} to quantity {quantity}: {e}")
-
-    # Ensure quantity respects min/max limits after adjustment
-    if adjusted_quantity < min_qty_limit:
-         logger.warning(f"Adjusted quantity {adjusted_quantity} below minQty {min_qty_limit}. Clamping to 0 (or minQty?).")
-         # Clamping to 0 might be safer if the intent was invalid, rather than forcing minQty.
-         adjusted_quantity = Decimal(0)
-         # Alternatively, clamp to min_qty_limit, but this might place an unintended order.
-         # adjusted_quantity = min_qty_limit
-    if adjusted_quantity > max_qty_limit:
-          logger.warning(f"Adjusted quantity {adjusted_quantity} above maxQty {max_qty_limit}. Clamping.")
-          adjusted_quantity = max_qty_limit
-
-    # Ensure quantity doesn't become zero if it was positive, unless minQty allows it
-    if quantity > 0 and adjusted_quantity <= 0 and min_qty_limit > 0:
-        logger.warning(f"Adjusted quantity became <= 0 for {quantity}. Returning 0.")
-        adjusted_quantity = Decimal(0)
-
-    return adjusted_quantity
+    return quantizer_for(symbol_filters).round_qty(quantity)
 
 def format_decimal(value: Decimal, symbol_filters: Dict[str, Dict[str, Any]], filter_type: str) -> str:
     """Formats a Decimal value (price or quantity) according to its filter's precision."""
-    precision = 8 # Default precision
-    filter_data = symbol_filters.get(filter_type)
-    size_key = 'tickSize' if filter_type == 'PRICE_FILTER' else 'stepSize' if filter_type == 'LOT_SIZE' else None
-
-    if filter_data and size_key and size_key in filter_data:
-        size_str = filter_data[size_key]
-        try:
-            # Attempt to calculate precision from the size string
-            precision = get_significant_digits(size_str)
-        except Exception as e:
-            logger.warning(f"Could not determine precision from {size_key} '{size_str}': {e}. Using default {precision}.")
-
-    # Format the value to the determined precision, avoiding scientific notation for common ranges
-    try:
-        formatted_value = f"{value:.{precision}f}"
-        # Check if the formatted value resulted in scientific notation (less common with 'f')
-        if 'e' in formatted_value.lower():
-             # Fallback to normalize() which handles scientific notation better for very small/large numbers
-             logger.debug(f"Using normalize() for value {value} due to potential scientific notation.")
-             return str(value.normalize())
-        return formatted_value
-    except Exception as e:
-        logger.error(f"Error formatting decimal {value} with precision {precision}: {e}")
-        # Fallback to simple string conversion or normalize
-        return str(value.normalize())
+    return quantizer_for(symbol_filters).format(value, filter_type)
 
 def format_number(number: Decimal, max_decimals: int = 8, min_decimals: int = 2) -> str:
     """
@@ -698,7 +1571,7 @@ def format_trade_history(trades: list, limit: int = 20, include_stats: bool = Tr
     
     return stats_text
 
-def format_market_movers(movers: list, title: str, limit: int = 10) -> str:
+def format_market_movers(movers: list, title: str, limit: int = 10, offset: int = 0) -> str:
     """Formats market movers (gainers/losers/search results) into a readable string."""
     if not movers: return f"لم يتم العثور على بيانات لـ {title} حاليًا."
     text = f"📊 <b>{title} (آخر 24 ساعة):</b>\n\n"; count = 0
@@ -711,7 +1584,7 @@ def format_market_movers(movers: list, title: str, limit: int = 10) -> str:
             change_percent = decimal_context.create_decimal(change_percent_str)
             last_price = decimal_context.create_decimal(last_price_str).normalize()
             emoji = "⬆️" if change_percent > 0 else "⬇️" if change_percent < 0 else "➡️"
-            text += f"{count + 1}. {emoji} <b>{symbol}</b>: {change_percent:+.2f}% (السعر: {last_price:f})\n"
+            text += f"{offset + count + 1}. {emoji} <b>{symbol}</b>: {change_percent:+.2f}% (السعر: {last_price:f})\n"
             count += 1
         except Exception as e:
             logger.error(f"خطأ في تنسيق بيانات السوق لـ {mover.get('symbol')}: {e}")
@@ -765,6 +1638,7 @@ def build_search_menu_keyboard() -> InlineKeyboardMarkup:
     keyboard = [
         [InlineKeyboardButton("⬆️ الأكثر ربحاً", callback_data=CALLBACK_SHOW_GAINERS)],
         [InlineKeyboardButton("⬇️ الأكثر خسارة", callback_data=CALLBACK_SHOW_LOSERS)],
+        [InlineKeyboardButton("💹 الأعلى حجم تداول", callback_data=CALLBACK_SHOW_VOLUME_LEADERS)],
         [InlineKeyboardButton("⌨️ بحث يدوي عن عملة", callback_data=CALLBACK_SEARCH_MANUAL_START)],
         [InlineKeyboardButton("🔙 رجوع للقائمة الرئيسية", callback_data=CALLBACK_MAIN_MENU)],
     ]
@@ -944,6 +1818,405 @@ def build_alert_threshold_keyboard(percentages: List[int] = [1, 2, 5, 10]) -> In
     return InlineKeyboardMarkup(keyboard)
 
 
+# --- مُبلّغ التقدم (تعديلات مُجمّعة) ---
+PROGRESS_EDIT_INTERVAL_SECONDS = 2.0 # أقل مدة بين تعديلين لرسالة التقدم
+
+class ProgressReporter:
+    """
+    Edits a progress message from a background task instead of inside the
+    caller's loop. update() only records the latest text; the task edits at
+    most once per `interval` and only when the text differs from what is shown.
+    Updates that never reach Telegram are counted in `suppressed`.
+    """
+
+    def __init__(self, message: Any, interval: float = PROGRESS_EDIT_INTERVAL_SECONDS):
+        self.message = message
+        self.interval = interval
+        self.edits = 0
+        self.suppressed = 0
+        self._pending: Optional[str] = None
+        self._shown: Optional[str] = getattr(message, 'text', None)
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> 'ProgressReporter':
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return self
+
+    def update(self, text: str) -> None:
+        """Queues `text` for display; never waits on Telegram."""
+        if text == (self._pending if self._pending is not None else self._shown):
+            self.suppressed += 1 # Nothing changed
+            return
+        if self._pending is not None:
+            self.suppressed += 1 # Replaced before it was shown
+        self._pending = text
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        next_edit_at = 0.0
+        while True:
+            await self._wakeup.wait()
+            delay = next_edit_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay) # Let further updates coalesce
+            self._wakeup.clear()
+            text, self._pending = self._pending, None
+            if text is None or text == self._shown:
+                continue
+            await self._edit(text)
+            next_edit_at = time.monotonic() + self.interval
+
+    async def _edit(self, text: str) -> None:
+        try:
+            # rate_limit_args is only accepted by ExtBot methods, not Message shortcuts
+            await self.message.get_bot().edit_message_text(
+                chat_id=self.message.chat_id, message_id=self.message.message_id, text=text,
+                rate_limit_args={'priority': PRIORITY_PROGRESS})
+            self._shown = text
+            self.edits += 1
+        except RetryAfter as e:
+            logger.warning(f"Progress edit throttled by Telegram for {e.retry_after}s")
+            if self._pending is None:
+                self._pending = text
+            await asyncio.sleep(e.retry_after)
+            self._wakeup.set()
+        except TelegramError as e:
+            if "message is not modified" not in str(e).lower():
+                logger.debug(f"Progress edit failed: {e}")
+        except Exception as e:
+            # Progress is best effort; an edit failure must not kill the reporter task
+            logger.warning(f"Progress edit failed unexpectedly: {e}", exc_info=True)
+
+    async def close(self, flush: bool = False) -> None:
+        """Stops the reporter; with flush=True the last pending text is shown first."""
+        task, self._task = self._task, None
+        if task:
+            task.cancel()
+            try: await task
+            except asyncio.CancelledError: pass
+            except Exception as e: logger.warning(f"Progress reporter task failed: {e}")
+        if flush and self._pending is not None and self._pending != self._shown:
+            await self._edit(self._pending)
+        elif self._pending is not None:
+            self.suppressed += 1
+        self._pending = None
+        logger.debug(f"Progress reporter closed: {self.edits} edits, {self.suppressed} suppressed")
+
+    async def __aenter__(self) -> 'ProgressReporter':
+        return self.start()
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+# --- جدولة الرسائل الصادرة (حدود Telegram) ---
+PRIORITY_INTERACTIVE = 0 # ردود على تفاعل المستخدم
+PRIORITY_PROGRESS = 1 # تحديثات رسائل التقدم
+PRIORITY_BACKGROUND = 2 # تنبيهات وإشعارات خلفية
+TELEGRAM_GLOBAL_MESSAGES_PER_SECOND = 30
+TELEGRAM_CHAT_BURST = 3 # رسائل متتالية مسموحة لنفس المحادثة
+TELEGRAM_CHAT_PERIOD_SECONDS = 3.0 # أي بمعدل رسالة في الثانية لكل محادثة
+TELEGRAM_MAX_SEND_RETRIES = 3
+SCHEDULED_ENDPOINTS = {
+    'sendMessage', 'editMessageText', 'editMessageReplyMarkup', 'sendPhoto',
+    'sendDocument', 'copyMessage', 'forwardMessage',
+}
+MERGEABLE_ENDPOINTS = {'editMessageText', 'editMessageReplyMarkup'}
+
+@dataclass(eq=False)
+class _OutboundJob:
+    priority: int
+    seq: int
+    chat_id: Any
+    edit_key: Optional[Tuple[Any, ...]] = None
+    turn: asyncio.Future = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+    outcome: asyncio.Future = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+    superseded_by: Optional['_OutboundJob'] = None
+    merged: bool = False # Someone waits on `outcome`
+
+class OutboundScheduler(BaseRateLimiter):
+    """
+    Rate limiter plugged into the Application: every outgoing message/edit
+    waits in a priority queue until both the global bucket (~30 msg/s) and
+    its chat's bucket (~1 msg/s) allow it. Interactive replies (sent while an
+    update is being handled) go ahead of background notifications, a pending
+    edit of a message is replaced by a newer edit of the same message, and
+    RetryAfter pauses the queue and retries instead of dropping the message.
+    Callers may pass rate_limit_args={'priority': ...} to override the priority.
+    """
+
+    def __init__(self):
+        self.global_bucket = TokenBucket(TELEGRAM_GLOBAL_MESSAGES_PER_SECOND, 1.0)
+        self._chat_buckets: Dict[Any, TokenBucket] = {}
+        self._heap: List[Tuple[int, int, _OutboundJob]] = []
+        self._pending_edits: Dict[Tuple[Any, ...], _OutboundJob] = {}
+        self._seq = 0
+        self._paused_until = 0.0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self.stats = {'sent': 0, 'merged': 0, 'retried': 0}
+
+    async def initialize(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._dispatcher = asyncio.create_task(self._dispatch(), name="outbound-scheduler")
+
+    async def shutdown(self) -> None:
+        if self._dispatcher:
+            self._dispatcher.cancel()
+            try: await self._dispatcher
+            except asyncio.CancelledError: pass
+            self._dispatcher = None
+        logger.info(f"Outbound scheduler stats: {self.stats}")
+
+    def _chat_bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(TELEGRAM_CHAT_BURST, TELEGRAM_CHAT_PERIOD_SECONDS)
+        return bucket
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if endpoint not in SCHEDULED_ENDPOINTS or self._dispatcher is None:
+            return await callback(*args, **kwargs)
+
+        default_priority = PRIORITY_INTERACTIVE if current_user_id.get() is not None else PRIORITY_BACKGROUND
+        priority = (rate_limit_args or {}).get('priority', default_priority)
+        chat_id = data.get('chat_id')
+        edit_key = (endpoint, chat_id, data.get('message_id')) if endpoint in MERGEABLE_ENDPOINTS and data.get('message_id') else None
+
+        job = self._new_job(priority, chat_id, edit_key)
+        for attempt in range(TELEGRAM_MAX_SEND_RETRIES + 1):
+            self._enqueue(job)
+            await job.turn
+            if job.superseded_by is not None:
+                # A newer edit of the same message replaced this one; share its outcome
+                self.stats['merged'] += 1
+                try:
+                    result = await asyncio.shield(job.superseded_by.outcome)
+                except Exception as e:
+                    self._resolve(job, error=e)
+                    raise
+                self._resolve(job, result=result)
+                return result
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                self._wakeup.set()
+                if attempt < TELEGRAM_MAX_SEND_RETRIES:
+                    self.stats['retried'] += 1
+                    logger.warning(f"Telegram flood limit hit ({endpoint}), retrying in {e.retry_after}s")
+                    job.turn = asyncio.get_running_loop().create_future()
+                    continue
+                self._resolve(job, error=e)
+                raise
+            except Exception as e:
+                self._resolve(job, error=e)
+                raise
+            self.stats['sent'] += 1
+            self._resolve(job, result=result)
+            return result
+
+    def _new_job(self, priority: int, chat_id: Any, edit_key: Optional[Tuple[Any, ...]]) -> _OutboundJob:
+        self._seq += 1
+        return _OutboundJob(priority=priority, seq=self._seq, chat_id=chat_id, edit_key=edit_key)
+
+    def _enqueue(self, job: _OutboundJob) -> None:
+        if job.edit_key is not None:
+            previous = self._pending_edits.get(job.edit_key)
+            if previous is not None and previous is not job and not previous.turn.done():
+                previous.superseded_by = job
+                job.merged = True
+                job.priority = min(job.priority, previous.priority) # Keep the better place in line
+                previous.turn.set_result(None)
+            self._pending_edits[job.edit_key] = job
+        heapq.heappush(self._heap, (job.priority, job.seq, job))
+        self._wakeup.set()
+
+    def _resolve(self, job: _OutboundJob, result: Any = None, error: Optional[BaseException] = None) -> None:
+        if job.edit_key is not None and self._pending_edits.get(job.edit_key) is job:
+            del self._pending_edits[job.edit_key]
+        if job.outcome.done() or not job.merged:
+            return
+        if error is not None: job.outcome.set_exception(error)
+        else: job.outcome.set_result(result)
+
+    async def _dispatch(self) -> None:
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            wait = self._paused_until - time.monotonic()
+            if wait <= 0:
+                wait = self.global_bucket.delay_for(1)
+            if wait <= 0:
+                wait = self._grant_next()
+            if wait > 0:
+                self._wakeup.clear()
+                try: await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError: pass
+
+    def _grant_next(self) -> float:
+        """Lets the best job whose chat has budget proceed. Returns 0, or how long until one could."""
+        skipped = []
+        next_ready = float('inf')
+        granted = False
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            job = entry[2]
+            if job.turn.done(): # Superseded while queued
+                continue
+            bucket = self._chat_bucket(job.chat_id)
+            delay = bucket.delay_for(1)
+            if delay > 0:
+                skipped.append(entry)
+                next_ready = min(next_ready, delay)
+                continue
+            bucket.try_acquire(1)
+            self.global_bucket.try_acquire(1)
+            job.turn.set_result(None)
+            granted = True
+            break
+        for entry in skipped:
+            heapq.heappush(self._heap, entry)
+        return 0.0 if granted or not self._heap else next_ready
+
+outbound_scheduler = OutboundScheduler()
+
+# --- معالجة التحديثات المتزامنة ---
+MAX_CONCURRENT_UPDATES = 64 # تحديثات قيد المعالجة في نفس الوقت (لمستخدمين مختلفين)
+HEAVY_HANDLER_WORKERS = 2 # عمليات ثقيلة (مسح PnL/السجل) تعمل في نفس الوقت
+SLOW_QUEUE_WAIT_SECONDS = 2.0 # تسجيل تحذير إذا انتظر التحديث أكثر من ذلك
+
+class QueueWaitMetric:
+    """Running count/mean/max plus a recent window for percentiles, in seconds."""
+
+    def __init__(self, window: int = 500):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._recent: deque = deque(maxlen=window)
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self._recent.append(seconds)
+
+    def snapshot(self) -> Dict[str, float]:
+        recent = sorted(self._recent)
+        p95 = recent[int(len(recent) * 0.95) - 1] if recent else 0.0
+        return {
+            'count': self.count,
+            'mean': round(self.total / self.count, 4) if self.count else 0.0,
+            'p95': round(p95, 4),
+            'max': round(self.max, 4),
+        }
+
+class OrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes updates of different chats concurrently while keeping each
+    chat's (or user's) updates strictly in arrival order, so ConversationHandler
+    states never see two updates of one user at the same time.
+    The per-chat lock is taken before one of the `max_concurrent_updates`
+    slots, so a chat flooding updates queues on its own lock instead of
+    holding slots every other chat needs.
+    Queue wait = time from receiving the update until its handlers start.
+    """
+
+    def __init__(self, max_concurrent_updates: int = MAX_CONCURRENT_UPDATES):
+        super().__init__(max_concurrent_updates)
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._locks: Dict[Any, asyncio.Lock] = {}
+        self._lock_users: Dict[Any, int] = defaultdict(int)
+        self.queue_wait = QueueWaitMetric()
+
+    @staticmethod
+    def _ordering_key(update: object) -> Any:
+        if isinstance(update, Update):
+            if update.effective_chat: return ('chat', update.effective_chat.id)
+            if update.effective_user: return ('user', update.effective_user.id)
+        return None
+
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        # Replaces the base implementation, which takes a slot first and would then wait on the chat lock inside it
+        coroutine = self._timed(coroutine, time.monotonic())
+        key = self._ordering_key(update)
+        if key is None:
+            async with self._slots:
+                await self.do_process_update(update, coroutine)
+            return
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._lock_users[key] += 1
+        try:
+            async with lock: # asyncio.Lock wakes waiters in FIFO order
+                async with self._slots:
+                    await self.do_process_update(update, coroutine)
+        finally:
+            self._lock_users[key] -= 1
+            if not self._lock_users[key]:
+                del self._lock_users[key]
+                self._locks.pop(key, None)
+
+    async def _timed(self, coroutine: Awaitable[Any], received: float) -> Any:
+        # Runs once the chat lock and a slot are held, i.e. when the handlers really start
+        waited = time.monotonic() - received
+        self.queue_wait.observe(waited)
+        if waited > SLOW_QUEUE_WAIT_SECONDS:
+            logger.warning(f"Update waited {waited:.2f}s before processing")
+        return await coroutine
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        logger.info(f"Update queue wait (s): {self.queue_wait.snapshot()}")
+
+update_processor = OrderedUpdateProcessor()
+heavy_handler_slots = asyncio.Semaphore(HEAVY_HANDLER_WORKERS)
+heavy_handler_jobs: Set[Tuple[int, str]] = set() # (user or chat id, handler) queued or running
+HEAVY_JOB_BUSY_TEXT = "⏳ الطلب السابق ما زال قيد التنفيذ، الرجاء الانتظار."
+
+def heavy_handler(func: Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[Any]]):
+    """
+    Runs a long handler (minutes of Binance syncing) in the bounded heavy pool,
+    detached from the update, so the user's next updates are not held behind it.
+    Only for handlers that do not return a conversation state. The callback
+    query is answered here, before waiting for a slot, so it cannot expire in
+    the queue; the wrapped handler must not answer it again. Each user has at
+    most one job per handler queued or running; repeated taps are dropped.
+    """
+    @functools.wraps(func)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        owner = update.effective_user or update.effective_chat
+        job = (owner.id if owner else 0, func.__name__)
+        busy = job in heavy_handler_jobs
+        if update.callback_query:
+            try:
+                await update.callback_query.answer(HEAVY_JOB_BUSY_TEXT if busy else None)
+                if busy: return
+            except TelegramError as e: logger.debug(f"Callback query already answered: {e}")
+        if busy:
+            if update.effective_chat:
+                await context.bot.send_message(chat_id=update.effective_chat.id, text=HEAVY_JOB_BUSY_TEXT)
+            return
+        heavy_handler_jobs.add(job)
+        async def run() -> None:
+            try:
+                async with heavy_handler_slots:
+                    await func(update, context)
+            finally:
+                heavy_handler_jobs.discard(job)
+        context.application.create_task(run(), update=update)
+    return wrapper
+
 # --- دوال عرض القوائم والمعلومات ---
 async def _send_or_edit(
     update: Update,
@@ -988,6 +2261,8 @@ async def _send_or_edit(
         # Handle specific errors like "message is not modified" silently
         if "message is not modified" in str(e).lower():
             pass # Ignore this specific error
+        elif isinstance(e, RetryAfter):
+            pass # Already retried by outbound_scheduler; another send would hit the same limit
         elif chat_id: # Attempt fallback send for other errors
              try:
                   await context.bot.send_message(
@@ -1064,13 +2339,15 @@ async def show_alerts_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     
     if custom_alerts:
         text += "<b>التنبيهات المخصصة النشطة:</b>\n"
+        # جلب أسعار كل الرموز مرة واحدة
+        try:
+            current_prices = await get_current_prices(custom_alerts.keys(), context)
+        except Exception as e:
+            logger.error(f"Error fetching alert prices: {e}")
+            current_prices = {}
         for symbol, settings in custom_alerts.items():
-            # جلب السعر الحالي
-            try:
-                current_price = await get_current_price(symbol, context)
-                price_text = f"السعر الحالي: ${current_price:f}" if current_price else "لا يوجد سعر حالي"
-            except:
-                price_text = "لا يوجد سعر حالي"
+            current_price = current_prices.get(symbol)
+            price_text = f"السعر الحالي: ${current_price:f}" if current_price else "لا يوجد سعر حالي"
 
             # عرض آخر سعر تم التنبيه عنده
             last_price = settings.get('last_price')
@@ -1154,6 +2431,8 @@ async def handle_custom_alert_threshold(update: Update, context: ContextTypes.DE
             'last_alert': None
         }
         
+        alert_engine.sync_user(update.effective_user.id, context.user_data)
+
         text = f"✅ تم إضافة تنبيه لـ {symbol} عند تغير {threshold}%"
         await update.message.reply_text(text)
         await show_alerts_menu(update, context)
@@ -1175,6 +2454,7 @@ async def remove_custom_alert(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     if symbol in custom_alerts:
         del custom_alerts[symbol]
+        alert_engine.sync_user(update.effective_user.id, context.user_data)
         text = f"✅ تم حذف التنبيه لـ {symbol}"
     else:
         text = "❌ لم يتم العثور على التنبيه"
@@ -1340,7 +2620,7 @@ async def show_orders_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     })
 
         # Get open orders
-        open_orders = binance_client.get_open_orders()
+        open_orders = await get_open_orders()
         
         # Format message
         final_text = ""
@@ -1355,7 +2635,7 @@ async def show_orders_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
             final_text += "<b>📋 الأوامر المفتوحة:</b>\n\n"
             for order in open_orders:
                 symbol = order['symbol']
-                filters = get_symbol_filters(symbol, context)
+                filters = await get_symbol_filters(symbol, context)
                 orig_qty = decimal_context.create_decimal(order['origQty'])
                 exec_qty = decimal_context.create_decimal(order['executedQty'])
                 price = decimal_context.create_decimal(order.get('price','0'))
@@ -1574,7 +2854,7 @@ async def handle_quick_sell_tp_percent(update: Update, context: ContextTypes.DEF
         tp_price = current_price * (1 + Decimal(percentage) / 100)
         
         # Get symbol filters
-        symbol_filters = get_symbol_filters(pair, context)
+        symbol_filters = await get_symbol_filters(pair, context)
         
         # Adjust prices and quantity according to filters
         adjusted_quantity = adjust_quantity(quantity, symbol_filters)
@@ -1588,7 +2868,7 @@ async def handle_quick_sell_tp_percent(update: Update, context: ContextTypes.DEF
         
         # Place OCO order
         try:
-            order = binance_client.create_oco_order(
+            order = await binance_call('create_oco_order',
                 symbol=pair,
                 side=SIDE_SELL,
                 quantity=formatted_qty,
@@ -1622,10 +2902,10 @@ async def handle_quick_sell_tp_percent(update: Update, context: ContextTypes.DEF
 # Define common trading pairs at module level
 COMMON_TRADING_PAIRS = {'BTCUSDT', 'ETHUSDT', 'BNBUSDT', 'SOLUSDT', 'XRPUSDT', 'ADAUSDT'}
 
+@heavy_handler
 async def show_total_pnl(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Calculates and displays total PnL across all trading pairs."""
+    """Calculates and displays total PnL across all trading pairs. (Query answered by heavy_handler.)"""
     query = update.callback_query
-    if query: await query.answer()
     chat_id = update.effective_chat.id
 
     if not binance_client:
@@ -1637,184 +2917,97 @@ async def show_total_pnl(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         chat_id=chat_id,
         text="⏳ جاري تحضير البيانات..."
     )
+    progress = ProgressReporter(loading_message).start()
 
     try:
         # Get cached tickers for price calculations
-        await loading_message.edit_text("🔄 جاري تحديث أسعار العملات...")
+        progress.update("🔄 جاري تحديث أسعار العملات...")
         tickers = await get_cached_tickers(context, quote_asset='USDT', force_refresh=True)
         
-        # Initialize traded symbols with common pairs
-        traded_symbols = set()
-        
-        # Try to identify traded pairs
+        # Identify traded pairs from balances, previously seen symbols and order updates
+        progress.update("🔍 جاري البحث عن الأزواج المتداولة...")
         try:
-            await loading_message.edit_text("🔍 جاري البحث عن الأزواج المتداولة...")
-            
-            # First check common pairs
-            common_pairs = {'BTCUSDT', 'ETHUSDT', 'BNBUSDT', 'SOLUSDT', 'XRPUSDT', 'ADAUSDT'}
-            for pair in common_pairs:
-                try:
-                    trades = binance_client.get_my_trades(symbol=pair, limit=1)
-                    if trades:
-                        traded_symbols.add(pair)
-                except:
-                    continue
-
-            # Then check other USDT pairs from exchange info
-            exchange_info = context.bot_data.get(EXCHANGE_INFO_CACHE_KEY)
-            if exchange_info and 'symbols' in exchange_info:
-                usdt_pairs = [
-                    s['symbol'] for s in exchange_info['symbols']
-                    if s['status'] == 'TRADING' and s['symbol'].endswith('USDT')
-                ]
-                
-                # Process in batches to avoid rate limits
-                batch_size = 5
-                for i in range(0, len(usdt_pairs), batch_size):
-                    batch = usdt_pairs[i:i + batch_size]
-                    for pair in batch:
-                        if pair not in traded_symbols:
-                            try:
-                                trades = binance_client.get_my_trades(symbol=pair, limit=1)
-                                if trades:
-                                    traded_symbols.add(pair)
-                            except:
-                                continue
-                    await asyncio.sleep(0.5)  # Rate limit protection
-                    
-                    # Update progress
-                    progress = (i + batch_size) / len(usdt_pairs) * 100
-                    await loading_message.edit_text(
-                        f"🔍 جاري البحث عن الأزواج المتداولة...\n"
-                        f"تم فحص {min(i + batch_size, len(usdt_pairs))} من {len(usdt_pairs)} زوج\n"
-                        f"تم العثور على {len(traded_symbols)} زوج متداول"
-                    )
-            
+            traded_symbols = await symbol_discovery.candidates(context)
         except Exception as e:
             logger.error(f"Error identifying traded pairs: {e}")
-            if not traded_symbols:
-                traded_symbols = common_pairs
+            traded_symbols = set()
 
         if not traded_symbols:
+            await progress.close()
             await loading_message.delete()
-            await _send_or_edit(update, context, "لم يتم العثور على أي أزواج متداولة.", edit=bool(query))
+            text = "لم يتم العثور على أي أزواج متداولة."
+            if symbol_discovery.probing:
+                text += f"\n\n🔍 {symbol_discovery.progress_text()}"
+            await _send_or_edit(update, context, text, edit=bool(query))
             return
 
-        await loading_message.edit_text(f"✅ تم تحديد {len(traded_symbols)} زوج متداول، جاري التحليل...")
+        progress.update(f"✅ تم تحديد {len(traded_symbols)} زوج متداول، جاري التحليل...")
 
-        # Initialize result containers
-        total_pnl = Decimal('0')
+        # Initialize result containers (all values in USDT)
+        total_realized = Decimal('0')
+        total_unrealized = Decimal('0')
         total_buy_value = Decimal('0')
         total_sell_value = Decimal('0')
         total_commission_usdt = Decimal('0')
+        total_open_value = Decimal('0')
         total_trades_count = 0
         pnl_by_symbol = {}
         error_pairs = []
 
+        def to_usdt(amount: Decimal, asset: str) -> Decimal:
+            if asset == 'USDT' or amount == 0: return amount
+            price = tickers.get(f"{asset}USDT")
+            return amount * price if price else Decimal('0')
+
         # Process each symbol
         total_symbols = len(traded_symbols)
         processed_symbols = 0
         
-        for symbol in sorted(traded_symbols):  # Sort for consistent display
+        # Positions arrive as each symbol finishes syncing; only new trades are replayed
+        async for symbol, state, sync_error in fetch_symbol_histories(traded_symbols, after_sync=pnl_engine.update):
             try:
                 processed_symbols += 1
-                
+                if sync_error:
+                    logger.error(f"Failed to sync trades for {symbol}: {sync_error}")
+                    error_pairs.append(symbol)
+
                 # Update progress message
                 progress_text = (
                     f"⏳ جاري تحليل البيانات التاريخية...\n"
                     f"تم معالجة {processed_symbols} من {total_symbols} زوج\n"
                     f"نسبة التقدم: {(processed_symbols / total_symbols * 100):.1f}%\n"
-                    f"الزوج الحالي: {symbol}\n"
+                    f"آخر زوج: {symbol}\n"
                     f"عدد الصفقات المحللة: {total_trades_count}"
                 )
-                
-                try:
-                    await loading_message.edit_text(progress_text)
-                except:
-                    pass
-
-                # Fetch complete trade history for symbol
-                symbol_trades = []
-                last_id = None
-                retry_count = 0
-                max_retries = 3
-                
-                while True:
-                    try:
-                        params = {'symbol': symbol, 'limit': 1000}
-                        if last_id:
-                            params['fromId'] = last_id
-                            
-                        batch = binance_client.get_my_trades(**params)
-                        if not batch:
-                            break
-                            
-                        symbol_trades.extend(batch)
-                        
-                        if len(batch) < 1000:
-                            break
-                            
-                        last_id = max(int(trade['id']) for trade in batch) + 1
-                        await asyncio.sleep(0.1)  # Rate limit protection
-                        
-                    except Exception as e:
-                        retry_count += 1
-                        if retry_count >= max_retries:
-                            logger.error(f"Failed to fetch trades for {symbol} after {max_retries} attempts: {e}")
-                            error_pairs.append(symbol)
-                            break
-                        await asyncio.sleep(1)  # Wait before retry
-                        continue
+                progress.update(progress_text)
 
-                if not symbol_trades:
+                if not state or not state.trades:
                     continue
 
-                # Calculate symbol statistics
-                symbol_buy_value = Decimal('0')
-                symbol_sell_value = Decimal('0')
-                symbol_commission_usdt = Decimal('0')
-
-                for trade in symbol_trades:
-                    quote_qty = decimal_context.create_decimal(trade['quoteQty'])
-                    commission = decimal_context.create_decimal(trade.get('commission', '0'))
-                    commission_asset = trade.get('commissionAsset', '')
+                quote = state.quote_asset
+                current_price = tickers.get(symbol)
+                symbol_realized = to_usdt(state.realized, quote)
+                symbol_unrealized = to_usdt(state.unrealized(current_price), quote)
+                symbol_commission_usdt = sum((to_usdt(amount, asset) for asset, amount in state.fees.items()), Decimal('0'))
+                external_fees_usdt = sum((to_usdt(amount, asset) for asset, amount in state.external_fees.items()), Decimal('0'))
+                symbol_pnl = symbol_realized + symbol_unrealized - external_fees_usdt
 
-                    if trade.get('isBuyer'):
-                        symbol_buy_value += quote_qty
-                    else:
-                        symbol_sell_value += quote_qty
-
-                    # Convert commission to USDT
-                    if commission > 0:
-                        commission_usdt_value = Decimal('0')
-                        if commission_asset == 'USDT':
-                            commission_usdt_value = commission
-                        else:
-                            commission_pair = f"{commission_asset}USDT"
-                            if commission_pair in tickers:
-                                commission_usdt_value = commission * tickers[commission_pair]
-                            elif commission_asset == 'BNB' and 'BNBUSDT' in tickers:
-                                commission_usdt_value = commission * tickers['BNBUSDT']
-                            elif commission_asset == 'BTC' and 'BTCUSDT' in tickers:
-                                commission_usdt_value = commission * tickers['BTCUSDT']
-                        symbol_commission_usdt += commission_usdt_value
-
-                # Calculate symbol PnL
-                symbol_pnl = symbol_sell_value - symbol_buy_value
-                
                 # Update totals
-                total_buy_value += symbol_buy_value
-                total_sell_value += symbol_sell_value
+                total_realized += symbol_realized
+                total_unrealized += symbol_unrealized
+                total_buy_value += to_usdt(state.buy_value, quote)
+                total_sell_value += to_usdt(state.sell_value, quote)
                 total_commission_usdt += symbol_commission_usdt
-                total_trades_count += len(symbol_trades)
-                total_pnl += symbol_pnl
+                total_open_value += to_usdt(state.position * current_price, quote) if current_price else Decimal('0')
+                total_trades_count += state.trades
 
                 # Store symbol results
                 pnl_by_symbol[symbol] = {
                     'pnl': symbol_pnl,
-                    'trades': len(symbol_trades),
-                    'buy_value': symbol_buy_value,
-                    'sell_value': symbol_sell_value,
+                    'realized': symbol_realized,
+                    'unrealized': symbol_unrealized,
+                    'external_fees_usdt': external_fees_usdt,
+                    'trades': state.trades,
                     'commission_usdt': symbol_commission_usdt
                 }
 
@@ -1824,6 +3017,7 @@ async def show_total_pnl(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 continue
 
         # Delete loading message
+        await progress.close()
         try:
             await loading_message.delete()
         except:
@@ -1834,6 +3028,7 @@ async def show_total_pnl(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             return
 
         # Calculate final statistics
+        total_pnl = sum((r['pnl'] for r in pnl_by_symbol.values()), Decimal('0'))
         pnl_percentage = (total_pnl / total_buy_value * 100) if total_buy_value > 0 else Decimal('0')
 
         # Format response message
@@ -1843,11 +3038,16 @@ async def show_total_pnl(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         text += f"عدد الصفقات الكلي: {total_trades_count}\n"
         text += f"إجمالي المشتريات: ${format_number(total_buy_value)}\n"
         text += f"إجمالي المبيعات: ${format_number(total_sell_value)}\n"
+        text += f"قيمة المراكز المفتوحة: ${format_number(total_open_value)}\n"
+        text += f"الربح/الخسارة المحقق: ${format_number(total_realized)}\n"
+        text += f"الربح/الخسارة غير المحقق: ${format_number(total_unrealized)}\n"
         text += f"صافي الربح/الخسارة: ${format_number(total_pnl)} ({format_number(pnl_percentage)}%)\n"
         text += f"إجمالي العمولات: ${format_number(total_commission_usdt)}"
         
         if error_pairs:
             text += f"\n\n⚠️ تعذر تحليل {len(error_pairs)} زوج"
+        if symbol_discovery.probing:
+            text += f"\n\n🔍 {symbol_discovery.progress_text()}"
 
         keyboard = [[InlineKeyboardButton("🔙 رجوع لقائمة الحساب", callback_data=CALLBACK_GOTO_ACCOUNT)]]
         await _send_or_edit(update, context, text, InlineKeyboardMarkup(keyboard), edit=bool(query), parse_mode=ParseMode.HTML)
@@ -1857,6 +3057,7 @@ async def show_total_pnl(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         error_text = "⚠️ حدث خطأ أثناء حساب الأرباح والخسائر."
         keyboard = [[InlineKeyboardButton("🔙 رجوع لقائمة الحساب", callback_data=CALLBACK_GOTO_ACCOUNT)]]
         await _send_or_edit(update, context, error_text, InlineKeyboardMarkup(keyboard), edit=bool(query))
+        await progress.close()
         if loading_message:
             try:
                 await loading_message.delete()
@@ -1918,29 +3119,73 @@ async def navigation_button_handler(update: Update, context: ContextTypes.DEFAUL
 
 
 # --- وظائف جلب بيانات السوق وعرضها ---
-async def fetch_and_get_market_movers(context: ContextTypes.DEFAULT_TYPE, quote_asset: str = 'USDT', limit: int = 10, sort_key: str = 'priceChangePercent') -> List[Dict[str, Any]]:
-    """Fetches and sorts market movers based on 24hr ticker data."""
+# Row layout of the 24h snapshot: floats are only used as selection keys,
+# Decimals are built for the k rows that get displayed.
+MARKET_STATS_SORT_FIELDS = {'priceChangePercent': 1, 'quoteVolume': 2}
+
+ALL_MARKET_STATS_KEY = '*'
+
+async def get_market_stats(quote_asset: Optional[str] = 'USDT') -> List[Tuple[str, float, float, str, str]]:
+    """
+    Returns the shared 24h snapshot (all symbols when quote_asset is None) as
+    (symbol, change_percent, quote_volume, lastPrice, priceChangePercent) rows.
+    One get_ticker call (weight 80) serves every user and every quote for the cache TTL.
+    """
+    rows = market_stats_cache.get(quote_asset or ALL_MARKET_STATS_KEY)
+    if rows is not None:
+        return rows
+    all_rows = market_stats_cache.get(ALL_MARKET_STATS_KEY)
+    if all_rows is None:
+        all_rows = await request_coalescer.do('ticker_24hr', _refresh_market_stats)
+    if quote_asset is None:
+        return all_rows
+    trading = set(symbol_registry.trading_symbols(quote_asset))
+    rows = [row for row in all_rows if (row[0] in trading if trading else row[0].endswith(quote_asset))]
+    # The per-quote view expires together with the snapshot it was cut from
+    source_stored_at = market_stats_cache.stored_at(ALL_MARKET_STATS_KEY)
+    if source_stored_at is not None:
+        market_stats_cache.set(quote_asset, rows, stored_at=source_stored_at)
+    return rows
+
+def _market_stats_row(ticker: Dict[str, Any]) -> Tuple[str, float, float, str, str]:
+    return (ticker['symbol'], float(ticker['priceChangePercent']), float(ticker.get('quoteVolume') or 0),
+            ticker['lastPrice'], ticker['priceChangePercent'])
+
+async def _refresh_market_stats() -> List[Tuple[str, float, float, str, str]]:
+    tickers_24hr = await binance_call('get_ticker') # Fetches all tickers
+    registry_loaded = len(symbol_registry) > 0
+    rows = []
+    for ticker in tickers_24hr:
+        symbol = ticker['symbol']
+        # Delisted symbols keep frozen 24h stats; skip them when the registry is loaded
+        meta = symbol_registry.get(symbol)
+        if registry_loaded and (meta is None or meta.status != 'TRADING'):
+            continue
+        try:
+            rows.append(_market_stats_row(ticker))
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Skipping ticker {symbol} due to data issue: {e}")
+    market_stats_cache.set(ALL_MARKET_STATS_KEY, rows)
+    symbol_registry.search_index.set_liquidity((row[0], row[2]) for row in rows)
+    logger.info(f"Cached 24h stats for {len(rows)} symbols.")
+    return rows
+
+async def fetch_and_get_market_movers(context: ContextTypes.DEFAULT_TYPE, quote_asset: str = 'USDT', limit: int = 10,
+                                      sort_key: str = 'priceChangePercent', largest: bool = True,
+                                      predicate: Optional[Callable[[Tuple[str, float, float, str, str]], bool]] = None) -> List[Dict[str, Any]]:
+    """Selects the top `limit` movers by sort_key from the cached 24h snapshot (heap selection, already ordered)."""
     if not binance_client: return []
     try:
-        # Fetch 24hr ticker data which includes priceChangePercent
-        tickers_24hr = binance_client.get_ticker() # Fetches all tickers
-        movers = []
-        for ticker in tickers_24hr:
-            symbol = ticker['symbol']
-            if symbol.endswith(quote_asset):
-                try:
-                    movers.append({
-                        'symbol': symbol,
-                        'priceChangePercent': decimal_context.create_decimal(ticker['priceChangePercent']),
-                        'lastPrice': decimal_context.create_decimal(ticker['lastPrice'])
-                        # Add other fields like 'volume' if needed
-                    })
-                except (InvalidOperation, KeyError, TypeError) as e:
-                     logger.warning(f"Skipping ticker {symbol} due to data issue: {e}")
-
-        # Sort by the specified key (default: priceChangePercent)
-        movers.sort(key=lambda x: x.get(sort_key, Decimal(0)), reverse=True) # reverse=True for gainers
-        return movers # Return sorted list, limit applied by caller
+        rows = await get_market_stats(quote_asset)
+        field = MARKET_STATS_SORT_FIELDS[sort_key]
+        candidates = rows if predicate is None else filter(predicate, rows)
+        select = heapq.nlargest if largest else heapq.nsmallest
+        return [{
+            'symbol': symbol,
+            'priceChangePercent': decimal_context.create_decimal(change_str),
+            'lastPrice': decimal_context.create_decimal(last_price),
+            'quoteVolume': decimal_context.create_decimal(quote_volume),
+        } for symbol, _, quote_volume, last_price, change_str in select(limit, candidates, key=lambda row: row[field])]
     except (BinanceAPIException, BinanceRequestException) as e:
         logger.error(f"Binance API Error fetching 24hr tickers: {e}")
         return []
@@ -1953,9 +3198,9 @@ async def show_gainers(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     query = update.callback_query
     if query: await query.answer()
     await _send_or_edit(update, context, "⏳ جاري جلب الأكثر ارتفاعًا...", edit=bool(query))
-    movers = await fetch_and_get_market_movers(context, quote_asset='USDT', sort_key='priceChangePercent')
-    # Filter only positive changes for gainers
-    gainers = [m for m in movers if m.get('priceChangePercent', Decimal(0)) > 0]
+    # Only positive changes count as gainers
+    gainers = await fetch_and_get_market_movers(context, quote_asset='USDT', sort_key='priceChangePercent',
+                                                predicate=lambda row: row[1] > 0)
     
     if not gainers:
         text = "لم يتم العثور على عملات مرتفعة حالياً."
@@ -1992,12 +3237,9 @@ async def show_losers(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     query = update.callback_query
     if query: await query.answer()
     await _send_or_edit(update, context, "⏳ جاري جلب الأكثر انخفاضًا...", edit=bool(query))
-    movers = await fetch_and_get_market_movers(context, quote_asset='USDT', sort_key='priceChangePercent')
-    # Filter only negative changes and sort ascending (most negative first)
-    losers = sorted(
-        [m for m in movers if m.get('priceChangePercent', Decimal(0)) < 0],
-        key=lambda x: x.get('priceChangePercent', Decimal(0))  # Sort ascending
-    )
+    # Only negative changes, most negative first
+    losers = await fetch_and_get_market_movers(context, quote_asset='USDT', sort_key='priceChangePercent', largest=False,
+                                               predicate=lambda row: row[1] < 0)
 
     if not losers:
         text = "لم يتم العثور على عملات منخفضة حالياً."
@@ -2030,56 +3272,531 @@ async def show_losers(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     await _send_or_edit(update, context, text, InlineKeyboardMarkup(keyboard), edit=True, parse_mode=ParseMode.HTML)
 
 
+async def show_volume_leaders(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Displays the pairs with the highest 24h quote volume with quick buy buttons."""
+    query = update.callback_query
+    if query: await query.answer()
+    await _send_or_edit(update, context, "⏳ جاري جلب الأعلى حجم تداول...", edit=bool(query))
+    leaders = await fetch_and_get_market_movers(context, quote_asset='USDT', sort_key='quoteVolume')
+
+    if not leaders:
+        text = "تعذر جلب بيانات حجم التداول حالياً."
+        keyboard = [[InlineKeyboardButton("🔙 رجوع لقائمة البحث", callback_data=CALLBACK_GOTO_SEARCH)]]
+        await _send_or_edit(update, context, text, InlineKeyboardMarkup(keyboard), edit=True)
+        return
+
+    text = "📊 <b>الأعلى حجم تداول (آخر 24 ساعة):</b>\n\n"
+    keyboard = []
+
+    for i, leader in enumerate(leaders):
+        try:
+            symbol = leader['symbol']
+            text += (f"{i + 1}. 💹 <b>{symbol}</b>: ${format_number(leader['quoteVolume'])} "
+                     f"({leader['priceChangePercent']:+.2f}%, السعر: {leader['lastPrice'].normalize():f})\n")
+            keyboard.append([
+                InlineKeyboardButton(f"📈 شراء {symbol}", callback_data=f"{CALLBACK_BUY_FAVORITE_PREFIX}{symbol}")
+            ])
+        except Exception as e:
+            logger.error(f"Error formatting volume leader {leader.get('symbol')}: {e}")
+
+    keyboard.append([InlineKeyboardButton("🔙 رجوع لقائمة البحث", callback_data=CALLBACK_GOTO_SEARCH)])
+
+    await _send_or_edit(update, context, text, InlineKeyboardMarkup(keyboard), edit=True, parse_mode=ParseMode.HTML)
+
+
 # --- وظائف سجل التداول ---
-async def fetch_all_trades(symbol: str, context: ContextTypes.DEFAULT_TYPE) -> List[Dict]:
+# --- مخزن سجل التداول المحلي (SQLite) ---
+TRADES_DB_PATH = os.getenv('TRADES_DB_PATH', 'trades.db')
+TRADES_PAGE_LIMIT = 1000 # الحد الأقصى لـ get_my_trades
+
+class TradeStore:
     """
-    Fetches all historical trades for a symbol using pagination.
-    Returns a list of all trades.
+    Local copy of `get_my_trades` per (account, symbol).
+    Each symbol remembers the last synced trade id, so a sync only asks
+    Binance for trades with `fromId` above it. Reads never touch the API.
+    SQLite work runs in a worker thread; the connection is guarded by a lock.
     """
-    if not binance_client:
-        return []
-    
-    all_trades = []
-    last_id = None
-    batch_size = 1000  # Maximum allowed by Binance API
-    
-    try:
+
+    def __init__(self, path: str = TRADES_DB_PATH, account: str = ""):
+        self.path = path
+        self.account = account
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS trades ("
+                " account TEXT NOT NULL, symbol TEXT NOT NULL, id INTEGER NOT NULL,"
+                " time INTEGER NOT NULL, payload TEXT NOT NULL,"
+                " PRIMARY KEY (account, symbol, id))"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS trades_by_time ON trades (account, time)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS trade_sync ("
+                " account TEXT NOT NULL, symbol TEXT NOT NULL, last_id INTEGER NOT NULL,"
+                " synced_at REAL NOT NULL, PRIMARY KEY (account, symbol))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS seen_symbols ("
+                " account TEXT NOT NULL, symbol TEXT NOT NULL, source TEXT NOT NULL,"
+                " seen_at REAL NOT NULL, PRIMARY KEY (account, symbol))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS pnl_checkpoints ("
+                " account TEXT NOT NULL, symbol TEXT NOT NULL, last_id INTEGER NOT NULL,"
+                " state TEXT NOT NULL, PRIMARY KEY (account, symbol))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS store_meta ("
+                " account TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+                " PRIMARY KEY (account, key))"
+            )
+
+    # -- sync (blocking parts) --
+    def _last_id(self, symbol: str) -> Optional[int]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT last_id FROM trade_sync WHERE account = ? AND symbol = ?", (self.account, symbol)
+            ).fetchone()
+        return row[0] if row else None
+
+    def _save_batch(self, symbol: str, batch: List[Dict[str, Any]]) -> int:
+        """Stores one page and advances the sync cursor in the same transaction. Returns the new last id."""
+        last_id = max(int(t['id']) for t in batch)
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO trades (account, symbol, id, time, payload) VALUES (?, ?, ?, ?, ?)",
+                [(self.account, symbol, int(t['id']), int(t['time']), json.dumps(t)) for t in batch]
+            )
+            self._conn.execute(
+                "INSERT INTO trade_sync (account, symbol, last_id, synced_at) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT (account, symbol) DO UPDATE SET"
+                " last_id = MAX(last_id, excluded.last_id), synced_at = excluded.synced_at",
+                (self.account, symbol, last_id, time.time())
+            )
+        return last_id
+
+    def _touch(self, symbol: str, last_id: int) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO trade_sync (account, symbol, last_id, synced_at) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT (account, symbol) DO UPDATE SET synced_at = excluded.synced_at",
+                (self.account, symbol, last_id, time.time())
+            )
+
+    # -- reads (blocking) --
+    def _load(self, symbol: Optional[str], since_ms: Optional[int]) -> List[Dict[str, Any]]:
+        sql = "SELECT payload FROM trades WHERE account = ?"
+        args: List[Any] = [self.account]
+        if symbol:
+            sql += " AND symbol = ?"; args.append(symbol)
+        if since_ms is not None:
+            sql += " AND time >= ?"; args.append(since_ms)
+        sql += " ORDER BY time, id"
+        with self._lock:
+            rows = self._conn.execute(sql, args).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def _load_after(self, symbol: str, after_id: int) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT payload FROM trades WHERE account = ? AND symbol = ? AND id > ? ORDER BY id",
+                (self.account, symbol, after_id)
+            ).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def _load_checkpoint(self, symbol: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state FROM pnl_checkpoints WHERE account = ? AND symbol = ?", (self.account, symbol)
+            ).fetchone()
+        return row[0] if row else None
+
+    def _save_checkpoint(self, symbol: str, last_id: int, state: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pnl_checkpoints (account, symbol, last_id, state) VALUES (?, ?, ?, ?)",
+                (self.account, symbol, last_id, state)
+            )
+
+    def _synced_symbols(self) -> Set[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT symbol FROM trade_sync WHERE account = ?", (self.account,)).fetchall()
+        return {r[0] for r in rows}
+
+    def _seen_symbols(self) -> Set[str]:
+        """Symbols known to have trades: marked as seen, or with at least one stored trade."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT symbol FROM seen_symbols WHERE account = ?"
+                " UNION SELECT symbol FROM trade_sync WHERE account = ? AND last_id >= 0",
+                (self.account, self.account)
+            ).fetchall()
+        return {r[0] for r in rows}
+
+    def _mark_seen(self, symbol: str, source: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO seen_symbols (account, symbol, source, seen_at) VALUES (?, ?, ?, ?)",
+                (self.account, symbol, source, time.time())
+            )
+
+    def _get_meta(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM store_meta WHERE account = ? AND key = ?", (self.account, key)
+            ).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO store_meta (account, key, value) VALUES (?, ?, ?)", (self.account, key, value)
+            )
+
+    # -- async API --
+    async def sync(self, symbol: str) -> int:
+        """Fetches trades newer than the stored cursor. Concurrent syncs of one symbol are coalesced."""
+        return await request_coalescer.do(f"trade_sync_{self.account}_{symbol}", lambda: self._sync(symbol))
+
+    async def _sync(self, symbol: str) -> int:
+        last_id = await asyncio.to_thread(self._last_id, symbol)
+        from_id = 0 if last_id is None else last_id + 1
+        fetched = 0
         while True:
-            # Fetch batch of trades
-            params = {
-                'symbol': symbol,
-                'limit': batch_size
-            }
-            if last_id:
-                params['fromId'] = last_id
-            
-            batch = binance_client.get_my_trades(**params)
+            batch = await binance_call('get_my_trades', symbol=symbol, fromId=from_id, limit=TRADES_PAGE_LIMIT)
             if not batch:
                 break
-                
-            all_trades.extend(batch)
-            
-            # Update last_id for next iteration
-            last_id = max(int(trade['id']) for trade in batch) + 1
-            
-            # If we got less than batch_size trades, we've reached the end
-            if len(batch) < batch_size:
+            last_id = await asyncio.to_thread(self._save_batch, symbol, batch)
+            fetched += len(batch)
+            if len(batch) < TRADES_PAGE_LIMIT:
                 break
-            
-            # Add small delay to avoid rate limits
-            await asyncio.sleep(0.1)
-        
-        logger.info(f"Fetched total of {len(all_trades)} trades for {symbol}")
-        return all_trades
-        
-    except Exception as e:
-        logger.error(f"Error fetching all trades for {symbol}: {e}")
-        return all_trades  # Return what we have so far
+            from_id = last_id + 1
+        if fetched == 0:
+            # Remember that the symbol was checked (and has no trades yet if last_id is None)
+            await asyncio.to_thread(self._touch, symbol, -1 if last_id is None else last_id)
+        if fetched:
+            logger.info(f"Synced {fetched} new trades for {symbol}")
+        return fetched
+
+    async def trades(self, symbol: Optional[str] = None, since_ms: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Returns stored trades (all symbols when `symbol` is None) ordered by time."""
+        return await asyncio.to_thread(self._load, symbol, since_ms)
+
+    async def synced_symbols(self) -> Set[str]:
+        return await asyncio.to_thread(self._synced_symbols)
+
+    async def seen_symbols(self) -> Set[str]:
+        return await asyncio.to_thread(self._seen_symbols)
+
+    async def mark_seen(self, symbol: str, source: str) -> None:
+        await asyncio.to_thread(self._mark_seen, symbol, source)
+
+    async def get_meta(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self._get_meta, key)
+
+    async def set_meta(self, key: str, value: str) -> None:
+        await asyncio.to_thread(self._set_meta, key, value)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+# The account id is a digest of the API key, so the key itself never reaches the database
+trade_store = TradeStore(account=hashlib.sha256((BINANCE_API_KEY or '').encode()).hexdigest()[:16])
+
+# --- محرك الأرباح والخسائر التراكمي ---
+ZERO = Decimal('0')
+
+def _decimal_map_to_json(values: Dict[str, Decimal]) -> Dict[str, str]:
+    return {k: str(v) for k, v in values.items()}
+
+def _decimal_map_from_json(values: Dict[str, str]) -> Dict[str, Decimal]:
+    return {k: decimal_context.create_decimal(v) for k, v in values.items()}
+
+@dataclass
+class PositionState:
+    """
+    Average-cost position of one symbol, built by replaying trades in id order.
+    Amounts are in the symbol's quote asset. Commissions paid in the base or
+    quote asset are folded into the position/proceeds; commissions paid in any
+    other asset (e.g. BNB) are kept in `external_fees` and valued at display time.
+    """
+    base_asset: str
+    quote_asset: str
+    position: Decimal = ZERO # الكمية المملوكة
+    cost: Decimal = ZERO # تكلفة الكمية المملوكة
+    realized: Decimal = ZERO
+    buy_value: Decimal = ZERO
+    sell_value: Decimal = ZERO
+    unmatched_sell_qty: Decimal = ZERO # كمية بيعت دون شراء مسجل (إيداع مثلاً)
+    trades: int = 0
+    last_id: int = -1
+    fees: Dict[str, Decimal] = field(default_factory=dict)
+    external_fees: Dict[str, Decimal] = field(default_factory=dict)
+
+    @property
+    def average_cost(self) -> Decimal:
+        return self.cost / self.position if self.position > 0 else ZERO
+
+    def unrealized(self, price: Optional[Decimal]) -> Decimal:
+        if price is None or self.position <= 0: return ZERO
+        return self.position * price - self.cost
+
+    def apply(self, trade: Dict[str, Any]) -> None:
+        trade_id = int(trade['id'])
+        if trade_id <= self.last_id: return # Already applied
+        qty = decimal_context.create_decimal(trade['qty'])
+        quote_qty = decimal_context.create_decimal(trade['quoteQty'])
+        commission = decimal_context.create_decimal(trade.get('commission', '0'))
+        commission_asset = trade.get('commissionAsset', '')
+
+        if commission > 0:
+            self.fees[commission_asset] = self.fees.get(commission_asset, ZERO) + commission
+            if commission_asset not in (self.base_asset, self.quote_asset):
+                self.external_fees[commission_asset] = self.external_fees.get(commission_asset, ZERO) + commission
+
+        if trade.get('isBuyer'):
+            self.buy_value += quote_qty
+            received = qty - commission if commission_asset == self.base_asset else qty
+            self.cost += quote_qty + (commission if commission_asset == self.quote_asset else ZERO)
+            self.position += received
+        else:
+            self.sell_value += quote_qty
+            proceeds = quote_qty - (commission if commission_asset == self.quote_asset else ZERO)
+            sold = qty + (commission if commission_asset == self.base_asset else ZERO)
+            matched = min(sold, self.position)
+            if matched > 0:
+                cost_removed = self.average_cost * matched
+                self.realized += proceeds * (matched / sold) - cost_removed
+                self.cost -= cost_removed
+                self.position -= matched
+            if sold > matched:
+                self.unmatched_sell_qty += sold - matched
+            if self.position <= 0:
+                self.position, self.cost = ZERO, ZERO
+        self.trades += 1
+        self.last_id = trade_id
+
+    def to_json(self) -> str:
+        return json.dumps({
+            'base_asset': self.base_asset, 'quote_asset': self.quote_asset,
+            'position': str(self.position), 'cost': str(self.cost), 'realized': str(self.realized),
+            'buy_value': str(self.buy_value), 'sell_value': str(self.sell_value),
+            'unmatched_sell_qty': str(self.unmatched_sell_qty), 'trades': self.trades, 'last_id': self.last_id,
+            'fees': _decimal_map_to_json(self.fees), 'external_fees': _decimal_map_to_json(self.external_fees),
+        })
+
+    @classmethod
+    def from_json(cls, raw: str) -> 'PositionState':
+        data = json.loads(raw)
+        return cls(
+            base_asset=data['base_asset'], quote_asset=data['quote_asset'],
+            position=decimal_context.create_decimal(data['position']), cost=decimal_context.create_decimal(data['cost']),
+            realized=decimal_context.create_decimal(data['realized']),
+            buy_value=decimal_context.create_decimal(data['buy_value']), sell_value=decimal_context.create_decimal(data['sell_value']),
+            unmatched_sell_qty=decimal_context.create_decimal(data['unmatched_sell_qty']),
+            trades=data['trades'], last_id=data['last_id'],
+            fees=_decimal_map_from_json(data['fees']), external_fees=_decimal_map_from_json(data['external_fees']),
+        )
+
+class PnLEngine:
+    """
+    Keeps a PositionState per symbol, checkpointed in the trade store.
+    update() replays only the trades stored after the checkpoint's last id.
+    """
+
+    def __init__(self, store: TradeStore):
+        self.store = store
+
+    async def update(self, symbol: str) -> PositionState:
+        return await request_coalescer.do(f"pnl_{self.store.account}_{symbol}", lambda: self._update(symbol))
+
+    async def _update(self, symbol: str) -> PositionState:
+        raw = await asyncio.to_thread(self.store._load_checkpoint, symbol)
+        if raw:
+            state = PositionState.from_json(raw)
+        else:
+            meta = symbol_registry.get(symbol)
+            if meta:
+                state = PositionState(base_asset=meta.base_asset, quote_asset=meta.quote_asset)
+            else: # Registry not loaded; USDT pairs are the common case
+                quote = 'USDT' if symbol.endswith('USDT') else symbol[-3:]
+                state = PositionState(base_asset=symbol[:-len(quote)], quote_asset=quote)
+
+        new_trades = await asyncio.to_thread(self.store._load_after, symbol, state.last_id)
+        if new_trades or not raw:
+            for trade in new_trades:
+                state.apply(trade)
+            await asyncio.to_thread(self.store._save_checkpoint, symbol, state.last_id, state.to_json())
+        return state
+
+pnl_engine = PnLEngine(trade_store)
+
+# --- جلب السجلات المتوازي ---
+HISTORY_FETCH_MAX_CONCURRENCY = 8 # الحد الأعلى للأزواج التي تُزامن في نفس الوقت
+HISTORY_SYNC_MAX_RETRIES = 3
+
+def history_fetch_concurrency() -> int:
+    """How many symbols to sync at once: as many first pages as the free request weight covers, within bounds."""
+    page_weight = request_weight('get_my_trades', {})
+    return max(1, min(HISTORY_FETCH_MAX_CONCURRENCY, int(exchange_rate_limiter.weight.available() // page_weight)))
+
+async def fetch_symbol_histories(symbols: Set[str], after_sync: Optional[Callable[[str], Awaitable[Any]]] = None):
+    """
+    Syncs many symbols concurrently under a semaphore and yields
+    (symbol, result, error) as each one finishes, fastest first.
+    `result` is what after_sync(symbol) returned (None without it).
+    """
+    semaphore = asyncio.Semaphore(history_fetch_concurrency())
+
+    async def sync_one(symbol: str) -> Tuple[str, Any, Optional[Exception]]:
+        error = None
+        async with semaphore:
+            for attempt in range(HISTORY_SYNC_MAX_RETRIES):
+                try:
+                    await trade_store.sync(symbol)
+                    error = None
+                    break
+                except Exception as e:
+                    error = e
+                    if attempt + 1 < HISTORY_SYNC_MAX_RETRIES:
+                        await asyncio.sleep(1)  # Wait before retry
+        result = await after_sync(symbol) if after_sync else None
+        return symbol, result, error
+
+    tasks = [asyncio.create_task(sync_one(s)) for s in symbols]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
 
+# --- اكتشاف الأزواج المتداولة ---
+DISCOVERY_PROBE_CONCURRENCY = 4 # عدد طلبات الفحص المتزامنة في الفحص الأولي
+DISCOVERY_QUOTE_ASSETS = {'USDT'} # العملات المقابلة المعتمدة عند الاشتقاق من الأرصدة
+FULL_PROBE_META_KEY = "full_probe_done"
+PROBE_CHECKED_META_KEY = "full_probe_checked" # JSON list of pairs already probed successfully
+
+class SymbolDiscovery:
+    """
+    Works out which symbols the account has traded without probing every pair.
+    Candidates are the union of symbols already seen (persisted in the trade
+    store), symbols derived from current balances, and symbols reported by
+    order updates. A full `get_my_trades(limit=1)` probe over all USDT pairs
+    runs once per account, in the background and under a small semaphore;
+    pairs probed successfully are recorded, so a rerun only retries the failed ones.
+    """
+
+    def __init__(self, store: TradeStore, concurrency: int = DISCOVERY_PROBE_CONCURRENCY):
+        self.store = store
+        self.concurrency = concurrency
+        self._probe_task: Optional[asyncio.Task] = None
+        self.probed = 0
+        self.probe_total = 0
+
+    @property
+    def probing(self) -> bool:
+        return self._probe_task is not None and not self._probe_task.done()
+
+    def progress_text(self) -> str:
+        return f"الفحص الأولي لكل الأزواج جارٍ في الخلفية ({self.probed}/{self.probe_total})، قد تظهر أزواج إضافية لاحقًا."
+
+    async def stop(self) -> None:
+        if self._probe_task:
+            self._probe_task.cancel()
+            try: await self._probe_task
+            except asyncio.CancelledError: pass
+            self._probe_task = None
+
+    async def note(self, symbol: str, source: str) -> None:
+        """Records a symbol seen in an order update or placed order."""
+        try:
+            await self.store.mark_seen(symbol, source)
+        except Exception as e:
+            logger.error(f"Failed to record seen symbol {symbol}: {e}")
+
+    async def candidates(self, context: ContextTypes.DEFAULT_TYPE) -> Set[str]:
+        """Returns the symbols worth syncing; starts the first-run probe if it never completed."""
+        registry = get_symbol_registry(context)
+        symbols = await self.store.seen_symbols()
+
+        held_assets = {b['asset'] for b in await get_account_balances(context)}
+        quotes = DISCOVERY_QUOTE_ASSETS | held_assets
+        for asset in held_assets:
+            for symbol in registry.trading_symbols_with_base(asset):
+                if registry.get(symbol).quote_asset in quotes:
+                    symbols.add(symbol)
+
+        # Without exchange info there is nothing to probe; a run now would only mark discovery as done
+        if not self.probing and registry.trading_symbols('USDT') and await self.store.get_meta(FULL_PROBE_META_KEY) is None:
+            self._probe_task = asyncio.create_task(self._full_probe(registry), name="symbol-discovery-probe")
+        return symbols
+
+    async def _full_probe(self, registry: SymbolRegistry) -> None:
+        seen = await self.store.seen_symbols()
+        checked: Set[str] = set(json.loads(await self.store.get_meta(PROBE_CHECKED_META_KEY) or '[]'))
+        universe = registry.trading_symbols('USDT')
+        if not universe:
+            logger.warning("Discovery probe skipped: exchange info is not loaded.")
+            return
+        pairs = [p for p in universe if p not in seen and p not in checked]
+        self.probed, self.probe_total = 0, len(pairs)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        failures = 0
+        logger.info(f"Starting discovery probe over {len(pairs)} pairs ({len(checked)} already checked)")
+
+        async def probe(pair: str) -> None:
+            nonlocal failures
+            async with semaphore:
+                try:
+                    if await binance_call('get_my_trades', symbol=pair, limit=1):
+                        await self.store.mark_seen(pair, 'probe')
+                    checked.add(pair)
+                except Exception as e:
+                    failures += 1
+                    logger.debug(f"Probe failed for {pair}: {e}")
+                finally:
+                    self.probed += 1
+
+        try:
+            await asyncio.gather(*(probe(p) for p in pairs))
+            if failures:
+                logger.warning(f"Discovery probe finished with {failures} failures; only those pairs will be probed again.")
+            elif not checked:
+                logger.warning("Discovery probe checked no pairs; it will run again next time.")
+            else:
+                await self.store.set_meta(FULL_PROBE_META_KEY, str(int(time.time())))
+                logger.info("First-run discovery probe completed.")
+        except Exception as e:
+            logger.error(f"Discovery probe aborted: {e}", exc_info=True)
+        finally:
+            # Also runs on cancellation at shutdown, so finished pairs are not probed again
+            try: await self.store.set_meta(PROBE_CHECKED_META_KEY, json.dumps(sorted(checked)))
+            except Exception as e: logger.error(f"Failed to record probed pairs: {e}")
+
+symbol_discovery = SymbolDiscovery(trade_store)
+
+async def fetch_all_trades(symbol: str, context: ContextTypes.DEFAULT_TYPE) -> List[Dict]:
+    """
+    Returns all historical trades for a symbol from the local trade store,
+    syncing only trades newer than the last stored one first.
+    """
+    if binance_client:
+        try:
+            await trade_store.sync(symbol)
+        except Exception as e:
+            logger.error(f"Error syncing trades for {symbol}: {e}")  # Serve what we have stored
+
+    all_trades = await trade_store.trades(symbol)
+    logger.info(f"Loaded {len(all_trades)} stored trades for {symbol}")
+    return all_trades
+
+@heavy_handler
 async def show_today_trades(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Displays trades from the last 24 hours."""
+    """Displays trades from the last 24 hours. (Query answered by heavy_handler.)"""
     query = update.callback_query
-    if query: await query.answer()
     chat_id = update.effective_chat.id
     if not binance_client:
         await _send_or_edit(update, context, "⚠️ عذرًا، اتصال Binance غير متاح حالياً.", edit=bool(query))
@@ -2091,66 +3808,26 @@ async def show_today_trades(update: Update, context: ContextTypes.DEFAULT_TYPE)
             loading_message = await query.message.edit_text("⏳ جاري جلب إحصائيات اليوم...")
         else:
             loading_message = await context.bot.send_message(chat_id=chat_id, text="⏳ جاري جلب إحصائيات اليوم...")
+        progress = ProgressReporter(loading_message).start()
 
         # Get start time for 24 hours ago
         start_time_dt = datetime.now() - timedelta(days=1)
         start_time_ms = int(start_time_dt.timestamp() * 1000)
         
-        # Get all valid USDT pairs
-        exchange_info = context.bot_data.get(EXCHANGE_INFO_CACHE_KEY)
-        valid_pairs = set()
-        if exchange_info and 'symbols' in exchange_info:
-            valid_pairs = {s['symbol'] for s in exchange_info['symbols'] if s['status'] == 'TRADING' and s['symbol'].endswith('USDT')}
-        
-        # Initialize variables for progress tracking
-        total_pairs = len(valid_pairs)
+        # Sync only the pairs the account is known to trade, then read the last 24h locally
+        traded_symbols = await symbol_discovery.candidates(context)
+        total_pairs = len(traded_symbols)
         processed_pairs = 0
-        all_trades = []
-        
-        # Try common pairs first
-        common_pairs = {'BTCUSDT', 'ETHUSDT', 'BNBUSDT', 'SOLUSDT', 'XRPUSDT', 'ADAUSDT'}
-        for pair in common_pairs:
-            if pair in valid_pairs:
-                try:
-                    trades = binance_client.get_my_trades(symbol=pair, startTime=start_time_ms)
-                    if trades:
-                        all_trades.extend(trades)
-                        valid_pairs.remove(pair)  # Remove from main set to avoid processing again
-                except Exception as e:
-                    logger.debug(f"No trades found for common pair {pair}: {e}")
-                processed_pairs += 1
-                # Update progress every few pairs
-                try:
-                    await loading_message.edit_text(
-                        f"⏳ جاري جلب الصفقات...\n"
-                        f"تم معالجة {processed_pairs} من {total_pairs} زوج\n"
-                        f"تم العثور على {len(all_trades)} صفقة"
-                    )
-                except Exception:
-                    pass  # Ignore edit errors
-        
-        # Process remaining pairs in batches
-        batch_size = 5
-        for i in range(0, len(valid_pairs), batch_size):
-            batch = list(valid_pairs)[i:i + batch_size]
-            for pair in batch:
-                try:
-                    trades = binance_client.get_my_trades(symbol=pair, startTime=start_time_ms)
-                    if trades:
-                        all_trades.extend(trades)
-                except Exception as e:
-                    logger.debug(f"No trades found for {pair}: {e}")
-                processed_pairs += 1
-                # Update progress every batch
-                try:
-                    await loading_message.edit_text(
-                        f"⏳ جاري جلب الصفقات...\n"
-                        f"تم معالجة {processed_pairs} من {total_pairs} زوج\n"
-                        f"تم العثور على {len(all_trades)} صفقة"
-                    )
-                except Exception:
-                    pass  # Ignore edit errors
-            await asyncio.sleep(0.5)  # Rate limit protection
+        async for pair, _, sync_error in fetch_symbol_histories(traded_symbols):
+            if sync_error:
+                logger.debug(f"Could not sync trades for {pair}: {sync_error}")
+            processed_pairs += 1
+            progress.update(
+                f"⏳ جاري جلب الصفقات...\n"
+                f"تم معالجة {processed_pairs} من {total_pairs} زوج"
+            )
+        await progress.close()
+        all_trades = await trade_store.trades(since_ms=start_time_ms)
         
         if not all_trades:
             text = "لم يتم العثور على صفقات في آخر 24 ساعة."
@@ -2173,6 +3850,8 @@ async def show_today_trades(update: Update, context: ContextTypes.DEFAULT_TYPE)
                 # Remove the header from symbol_stats and add symbol name
                 symbol_stats = symbol_stats.split('\n', 2)[2]  # Skip the first two lines
                 text += f"<b>{symbol}</b>\n{symbol_stats}\n\n---\n\n"
+        if symbol_discovery.probing:
+            text = text.rstrip() + f"\n\n🔍 {symbol_discovery.progress_text()}"
         
         keyboard = [[InlineKeyboardButton("🔙 رجوع لقائمة السجل", callback_data=CALLBACK_GOTO_HISTORY)]]
         
@@ -2196,6 +3875,8 @@ async def show_today_trades(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await _send_or_edit(update, context, error_text, InlineKeyboardMarkup([[InlineKeyboardButton("🔙 رجوع لقائمة السجل", callback_data=CALLBACK_GOTO_HISTORY)]]), edit=True)
 
     finally:
+        if 'progress' in locals():
+            await progress.close()
         # Clean up loading message if it exists and we're not editing it
         if 'loading_message' in locals() and not query:
             try:
@@ -2230,7 +3911,7 @@ async def history_by_pair_start(update: Update, context: ContextTypes.DEFAULT_TY
             # Get trades from last 24 hours
             start_time_dt = datetime.now() - timedelta(days=1)
             start_time_ms = int(start_time_dt.timestamp() * 1000)
-            recent_trades = binance_client.get_my_trades(startTime=start_time_ms)
+            recent_trades = await binance_call('get_my_trades', startTime=start_time_ms)
             recent_pairs = {trade['symbol'] for trade in recent_trades}
         except Exception as e:
             logger.error(f"Error getting recent trades: {e}")
@@ -2397,6 +4078,71 @@ async def handle_history_pair_selection(update: Update, context: ContextTypes.DE
 
 
 # --- وظائف البحث عن عملة ---
+SEARCH_PAGE_SIZE = 20
+PAIR_SUGGESTION_LIMIT = 6 # اقتراحات الإكمال التلقائي عند إدخال زوج غير صالح
+SEARCH_BATCH_MAX_SYMBOLS = 100 # فوق هذا الحد تكون اللقطة الكاملة (وزن 80) أرخص من symbols=[...]
+
+async def fetch_search_stats(symbols: Set[str]) -> List[Tuple[str, float, float, str, str]]:
+    """
+    24h rows for the matched symbols in a single round trip: the shared
+    snapshot when it is cached or the match set is large, otherwise one
+    multi-symbol get_ticker call (weight 2-40).
+    """
+    all_rows = market_stats_cache.get(ALL_MARKET_STATS_KEY)
+    if all_rows is None and len(symbols) <= SEARCH_BATCH_MAX_SYMBOLS:
+        logger.info(f"Fetching 24hr ticker for {len(symbols)} search matches in one batch...")
+        symbols_param = json.dumps(sorted(symbols), separators=(',', ':'))
+        rows = []
+        for ticker in await binance_call('get_ticker', symbols=symbols_param):
+            try:
+                rows.append(_market_stats_row(ticker))
+            except (ValueError, KeyError, TypeError) as e:
+                logger.warning(f"Skipping ticker {ticker.get('symbol')} in search: {e}")
+        return rows
+    if all_rows is None:
+        all_rows = await get_market_stats(None)
+    return [row for row in all_rows if row[0] in symbols]
+
+def build_search_results_page(search_term: str, rows: List[Tuple[str, float, float, str, str]], page: int) -> Tuple[str, InlineKeyboardMarkup]:
+    """Renders one page of search results with previous/next buttons."""
+    back_row = [InlineKeyboardButton("🔙 رجوع لقائمة البحث", callback_data=CALLBACK_GOTO_SEARCH)]
+    if not rows:
+        return f"لم يتم العثور على أزواج تداول نشطة تحتوي على '{search_term}'.", InlineKeyboardMarkup([back_row])
+
+    pages = (len(rows) + SEARCH_PAGE_SIZE - 1) // SEARCH_PAGE_SIZE
+    page = max(0, min(page, pages - 1))
+    offset = page * SEARCH_PAGE_SIZE
+    movers = [{'symbol': symbol, 'priceChangePercent': change_str, 'lastPrice': last_price}
+              for symbol, _, _, last_price, change_str in rows[offset:offset + SEARCH_PAGE_SIZE]]
+    title = f"نتائج البحث عن '{search_term}'"
+    if pages > 1:
+        title += f" - صفحة {page + 1}/{pages}, {len(rows)} نتيجة"
+    text = format_market_movers(movers, title, limit=SEARCH_PAGE_SIZE, offset=offset)
+
+    nav_row = []
+    if page > 0:
+        nav_row.append(InlineKeyboardButton("◀️ السابق", callback_data=f"{CALLBACK_SEARCH_PAGE_PREFIX}{page - 1}"))
+    if page < pages - 1:
+        nav_row.append(InlineKeyboardButton("التالي ▶️", callback_data=f"{CALLBACK_SEARCH_PAGE_PREFIX}{page + 1}"))
+    keyboard = [nav_row, back_row] if nav_row else [back_row]
+    return text, InlineKeyboardMarkup(keyboard)
+
+async def search_page_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Shows another page of the user's last search (no API calls)."""
+    query = update.callback_query
+    if not query: return
+    await query.answer()
+    cached = search_results_cache.get(str(update.effective_user.id))
+    if cached is None:
+        keyboard = [[InlineKeyboardButton("🔍 بحث جديد", callback_data=CALLBACK_SEARCH_MANUAL_START)],
+                    [InlineKeyboardButton("🔙 رجوع لقائمة البحث", callback_data=CALLBACK_GOTO_SEARCH)]]
+        await _send_or_edit(update, context, "⌛ انتهت صلاحية نتائج البحث. أعد البحث من جديد.", InlineKeyboardMarkup(keyboard), edit=True)
+        return
+    search_term, rows = cached
+    page = int(query.data[len(CALLBACK_SEARCH_PAGE_PREFIX):])
+    text, reply_markup = build_search_results_page(search_term, rows, page)
+    await _send_or_edit(update, context, text, reply_markup, edit=True, parse_mode=ParseMode.HTML)
+
 async def search_manual_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Starts the manual symbol search conversation."""
     query = update.callback_query
@@ -2420,53 +4166,26 @@ async def search_ask_pair_handler(update: Update, context: ContextTypes.DEFAULT_
 
     try:
         await context.bot.send_chat_action(chat_id=update.effective_chat.id, action='typing')
-        # Use cached exchange info for faster filtering
-        exchange_info = context.bot_data.get(EXCHANGE_INFO_CACHE_KEY)
-        valid_symbols = context.bot_data.get(SYMBOLS_CACHE_KEY, set())
-        matches_symbols = set()
-
-        if valid_symbols:
-             matches_symbols = {s for s in valid_symbols if search_term in s}
-        elif exchange_info: # Fallback if only exchange_info is cached
-             matches_symbols = {s['symbol'] for s in exchange_info.get('symbols', []) if s.get('status') == 'TRADING' and search_term in s['symbol']}
-        else: # Slowest fallback: fetch all tickers if cache failed
-             all_tickers_raw = binance_client.get_symbol_ticker()
+        search_index = get_symbol_registry(context).search_index
+        ranked_symbols: List[str] = []
+
+        if len(search_index):
+             ranked_symbols = search_index.search(search_term)
+             matches_symbols = set(ranked_symbols)
+        else: # Slowest fallback: fetch all tickers if exchange info is not loaded
+             all_tickers_raw = await binance_call('get_symbol_ticker')
              matches_symbols = {t['symbol'] for t in all_tickers_raw if search_term in t['symbol']}
 
-
-        matches_data = []
-        if matches_symbols:
-             # Fetch 24hr data only for matching symbols
-             # This can still be many API calls if search term is broad
-             # Consider limiting the number of symbols to fetch details for
-             symbols_to_fetch = list(matches_symbols)[:30] # Limit details fetch
-             logger.info(f"Fetching 24hr ticker for {len(symbols_to_fetch)} search matches...")
-             try:
-                 # Binance API might allow fetching multiple tickers at once? Check documentation.
-                 # If not, fetch one by one (can be slow)
-                 for symbol in symbols_to_fetch:
-                      try:
-                           ticker_24hr = binance_client.get_ticker(symbol=symbol)
-                           matches_data.append({
-                               'symbol': symbol,
-                               'priceChangePercent': decimal_context.create_decimal(ticker_24hr.get('priceChangePercent', '0')),
-                               'lastPrice': decimal_context.create_decimal(ticker_24hr.get('lastPrice', '0'))
-                           })
-                      except Exception: # Ignore errors for single symbols during search
-                           logger.warning(f"Failed to get 24hr ticker for {symbol} in search.")
-                           pass # Optionally add symbol with price 0 or skip
-             except (BinanceAPIException, BinanceRequestException) as multi_e:
-                  logger.error(f"API error fetching multiple tickers for search: {multi_e}")
-                  # Proceed with potentially incomplete data or show error
-
-        if matches_data:
-            matches_data.sort(key=lambda x: x['priceChangePercent'], reverse=True)
-            text = format_market_movers(matches_data, f"نتائج البحث عن '{search_term}'", limit=20)
+        # One pass for all matches; pages are served from this result
+        rows = await fetch_search_stats(matches_symbols) if matches_symbols else []
+        if ranked_symbols:
+            position = {symbol: i for i, symbol in enumerate(ranked_symbols)}
+            rows.sort(key=lambda row: position.get(row[0], len(position)))
         else:
-            text = f"لم يتم العثور على أزواج تداول نشطة تحتوي على '{search_term}'."
-
-        keyboard = [[InlineKeyboardButton("🔙 رجوع لقائمة البحث", callback_data=CALLBACK_GOTO_SEARCH)]]
-        await update.message.reply_html(text, reply_markup=InlineKeyboardMarkup(keyboard))
+            rows.sort(key=lambda row: row[1], reverse=True)
+        search_results_cache.set(str(update.effective_user.id), (search_term, rows))
+        text, reply_markup = build_search_results_page(search_term, rows, 0)
+        await update.message.reply_html(text, reply_markup=reply_markup)
 
     except (BinanceAPIException, BinanceRequestException) as e:
          logger.error(f"Binance API Error searching for {search_term}: {e}")
@@ -2517,6 +4236,7 @@ async def add_favorite_pair_handler(update: Update, context: ContextTypes.DEFAUL
         favorites.add(pair)
         # Ensure the set is saved back if persistence is used (it's mutable)
         context.user_data['favorite_pairs'] = favorites
+        alert_engine.sync_user(update.effective_user.id, context.user_data)
         await update.message.reply_text(f"✅ تم إضافة {pair} إلى المفضلة.")
         logger.info(f"Added {pair} to favorites for user {update.effective_user.id}")
 
@@ -2558,6 +4278,7 @@ async def remove_favorite_pair_handler(update: Update, context: ContextTypes.DEF
     if pair_to_remove in favorites:
         favorites.remove(pair_to_remove)
         context.user_data['favorite_pairs'] = favorites # Save changes
+        alert_engine.sync_user(update.effective_user.id, context.user_data)
         logger.info(f"Removed {pair_to_remove} from favorites for user {update.effective_user.id}")
         await query.answer(f"تم إزالة {pair_to_remove}") # Show confirmation toast
         # Show updated favorites menu
@@ -2824,7 +4545,7 @@ async def ask_sell_amount_handler(update: Update, context: ContextTypes.DEFAULT_
                   await _send_or_edit(update, context, f"⚠️ لم أجد زوج تداول شائع (مقابل USDT أو BUSD) لـ {selected_asset}. لا يمكن البيع تلقائيًا.", InlineKeyboardMarkup([[InlineKeyboardButton("🔙 رجوع", callback_data=CALLBACK_GOTO_TRADING)]]), edit=True)
                   return ConversationHandler.END
 
-        symbol_filters = get_symbol_filters(pair, context)
+        symbol_filters = await get_symbol_filters(pair, context)
         adjusted_qty = adjust_quantity(available_qty, symbol_filters)
         min_qty = decimal_context.create_decimal(symbol_filters.get('LOT_SIZE', {}).get('minQty', '0'))
 
@@ -2895,7 +4616,7 @@ async def handle_sell_amount_input(update: Update, context: ContextTypes.DEFAULT
             raise ValueError(f"القيمة المطلوبة (${usdt_amount:.2f}) تتجاوز القيمة المتاحة (${available_value:.2f})")
 
         # Get symbol filters and adjust quantity
-        symbol_filters = get_symbol_filters(pair, context)
+        symbol_filters = await get_symbol_filters(pair, context)
         adjusted_quantity = adjust_quantity(token_quantity, symbol_filters)
         
         if adjusted_quantity <= 0:
@@ -2942,7 +4663,12 @@ async def ask_pair_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 
     # <<-- Validate Symbol -->>
     if not is_valid_symbol(pair, context):
-        await update.message.reply_text(f"⚠️ الرمز '{pair}' غير صالح أو غير متداول حاليًا. الرجاء إدخال رمز صحيح:", reply_markup=build_cancel_keyboard(CALLBACK_CANCEL_TRADE))
+        # Offer the closest trading pairs as buttons (handled by handle_buy_favorite_selection)
+        suggestions = get_symbol_registry(context).search_index.search(pair, limit=PAIR_SUGGESTION_LIMIT)
+        keyboard = [[InlineKeyboardButton(f"🪙 {symbol}", callback_data=f"{CALLBACK_BUY_FAVORITE_PREFIX}{symbol}")] for symbol in suggestions]
+        keyboard.append([InlineKeyboardButton("❌ إلغاء", callback_data=CALLBACK_CANCEL_TRADE)])
+        hint = "\nهل تقصد أحد الأزواج التالية؟" if suggestions else ""
+        await update.message.reply_text(f"⚠️ الرمز '{pair}' غير صالح أو غير متداول حاليًا. الرجاء إدخال رمز صحيح:{hint}", reply_markup=InlineKeyboardMarkup(keyboard))
         return T_ASK_PAIR
 
     context.user_data['trade_pair'] = pair
@@ -2952,11 +4678,7 @@ async def ask_pair_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     available_balance_text = ""
     quote_balance = await get_quote_asset_balance(pair, context)
     if quote_balance is not None:
-         quote_asset = ""; # Determine quote asset
-         exchange_info = context.bot_data.get(EXCHANGE_INFO_CACHE_KEY)
-         if exchange_info:
-              for symbol_data in exchange_info.get('symbols', []):
-                   if symbol_data['symbol'] == pair: quote_asset = symbol_data.get('quoteAsset'); break
+         quote_asset = get_quote_asset(pair, context)
          if quote_asset: available_balance_text = f"\n<i>(رصيد {quote_asset} المتاح: {quote_balance.normalize():f})</i>"
 
     text = f"الزوج: {pair}{available_balance_text}\n\nالرجاء إدخال الكمية للشراء:"
@@ -2981,7 +4703,7 @@ async def ask_amount_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("⚠️ خطأ داخلي: لم يتم تحديد زوج العملات.", reply_markup=build_main_menu_keyboard())
         return ConversationHandler.END
 
-    symbol_filters = get_symbol_filters(pair, context)
+    symbol_filters = await get_symbol_filters(pair, context)
     if not symbol_filters:
         logger.error(f"Could not get filters for {pair} in amount handler.")
         await update.message.reply_text(f"⚠️ لم أتمكن من جلب قيود التداول لـ {pair}. لا يمكن المتابعة.", reply_markup=build_cancel_keyboard(CALLBACK_CANCEL_TRADE))
@@ -3094,7 +4816,7 @@ async def ask_sltp_choice_handler(update: Update, context: ContextTypes.DEFAULT_
             return T_ASK_SLTP_CHOICE # Stay in choice state
 
         context.user_data['current_price_for_sltp'] = current_price
-        symbol_filters = get_symbol_filters(pair, context) # Needed for formatting price
+        symbol_filters = await get_symbol_filters(pair, context) # Needed for formatting price
         formatted_price = format_decimal(current_price, symbol_filters, 'PRICE_FILTER')
         text = f"السعر الحالي لـ {pair} هو {formatted_price}\n\nاختر نسبة إيقاف الخسارة (SL):"
         keyboard = build_percent_keyboard(CALLBACK_SL_PERCENT_PREFIX, [1, 2, 3, 5]) # Use updated keyboard
@@ -3130,13 +4852,11 @@ async def ask_sl_percent_handler(update: Update, context: ContextTypes.DEFAULT_T
         sl_price_raw = current_price * (1 - percentage_decimal) if trade_side == SIDE_BUY else current_price * (1 + percentage_decimal)
 
         # Adjust and validate calculated SL price
-        symbol_filters = get_symbol_filters(pair, context)
-        sl_price = adjust_price(sl_price_raw, symbol_filters)
+        quantizer = await get_symbol_quantizer(pair, context)
+        sl_price = quantizer.round_price(sl_price_raw)
 
         # Validate against price filters again after calculation
-        price_filter = symbol_filters.get('PRICE_FILTER')
-        min_price = decimal_context.create_decimal(price_filter.get('minPrice', '0')) if price_filter else Decimal(0)
-        max_price = decimal_context.create_decimal(price_filter.get('maxPrice', 'inf')) if price_filter else Decimal('inf')
+        min_price = max(quantizer.min_price, Decimal(0)); max_price = quantizer.max_price
         if sl_price < min_price or sl_price > max_price:
              raise ValueError(f"السعر المحسوب ({sl_price:f}) خارج حدود الفلتر ({min_price:f} - {max_price:f}).")
         if sl_price <= 0 and min_price > 0:
@@ -3146,7 +4866,7 @@ async def ask_sl_percent_handler(update: Update, context: ContextTypes.DEFAULT_T
         context.user_data['sl_price'] = sl_price # Store adjusted price
         logger.info(f"Calculated SL price at {percentage}%: Raw={sl_price_raw}, Adjusted={sl_price}")
 
-        formatted_sl = format_decimal(sl_price, symbol_filters, 'PRICE_FILTER')
+        formatted_sl = quantizer.format(sl_price, 'PRICE_FILTER')
         text = f"تم تحديد SL بنسبة {percentage}% ({formatted_sl}).\n\nاختر نسبة جني الأرباح (TP) (أو تخطَّ):"
         keyboard = build_percent_keyboard(CALLBACK_TP_PERCENT_PREFIX, [2, 3, 5, 10]) # Different TP options
         keyboard.inline_keyboard.append([InlineKeyboardButton("➡️ تخطَّ TP", callback_data=CALLBACK_SKIP_TP)]) # Clearer skip text
@@ -3191,13 +4911,11 @@ async def ask_tp_percent_handler(update: Update, context: ContextTypes.DEFAULT_T
             tp_price_raw = current_price * (1 + percentage_decimal) if trade_side == SIDE_BUY else current_price * (1 - percentage_decimal)
 
             # Adjust and validate calculated TP price
-            symbol_filters = get_symbol_filters(pair, context)
-            tp_price = adjust_price(tp_price_raw, symbol_filters)
+            quantizer = await get_symbol_quantizer(pair, context)
+            tp_price = quantizer.round_price(tp_price_raw)
 
             # Validate against price filters
-            price_filter = symbol_filters.get('PRICE_FILTER')
-            min_price = decimal_context.create_decimal(price_filter.get('minPrice', '0')) if price_filter else Decimal(0)
-            max_price = decimal_context.create_decimal(price_filter.get('maxPrice', 'inf')) if price_filter else Decimal('inf')
+            min_price = max(quantizer.min_price, Decimal(0)); max_price = quantizer.max_price
             if tp_price < min_price or tp_price > max_price:
                  raise ValueError(f"السعر المحسوب ({tp_price:f}) خارج حدود الفلتر ({min_price:f} - {max_price:f}).")
             if tp_price <= 0 and min_price > 0:
@@ -3217,7 +4935,7 @@ async def ask_tp_percent_handler(update: Update, context: ContextTypes.DEFAULT_T
         except (ValueError, IndexError, TypeError, InvalidOperation) as e:
             logger.error(f"Error processing TP percentage '{choice}': {e}")
             # Rebuild SL percentage keyboard for TP selection retry
-            sl_perc_text = f"تم تحديد SL: {format_decimal(sl_price, get_symbol_filters(pair, context), 'PRICE_FILTER') if sl_price else 'لم يحدد'}.\n\n"
+            sl_perc_text = f"تم تحديد SL: {(await get_symbol_quantizer(pair, context)).format(sl_price, 'PRICE_FILTER') if sl_price else 'لم يحدد'}.\n\n"
             error_text = f"⚠️ خطأ في حساب أو التحقق من سعر TP: {e}\nاختر نسبة TP مرة أخرى (أو تخطَّ):"
             keyboard = build_percent_keyboard(CALLBACK_TP_PERCENT_PREFIX, [2, 3, 5, 10])
             keyboard.inline_keyboard.append([InlineKeyboardButton("➡️ تخطَّ TP", callback_data=CALLBACK_SKIP_TP)])
@@ -3243,7 +4961,7 @@ async def ask_sl_price_handler(update: Update, context: ContextTypes.DEFAULT_TYP
          await update.message.reply_text("⚠️ خطأ داخلي. لا يمكن التحقق من السعر.", reply_markup=build_cancel_keyboard(CALLBACK_CANCEL_TRADE))
          return ConversationHandler.END
 
-    symbol_filters = get_symbol_filters(pair, context)
+    symbol_filters = await get_symbol_filters(pair, context)
     price_filter = symbol_filters.get('PRICE_FILTER')
     min_price = decimal_context.create_decimal(price_filter.get('minPrice', '0')) if price_filter else Decimal(0)
     max_price = decimal_context.create_decimal(price_filter.get('maxPrice', 'inf')) if price_filter else Decimal('inf')
@@ -3310,7 +5028,7 @@ async def ask_tp_price_handler(update: Update, context: ContextTypes.DEFAULT_TYP
          await update.message.reply_text("⚠️ خطأ داخلي. لا يمكن التحقق من السعر.", reply_markup=build_cancel_keyboard(CALLBACK_CANCEL_TRADE))
          return ConversationHandler.END
 
-    symbol_filters = get_symbol_filters(pair, context)
+    symbol_filters = await get_symbol_filters(pair, context)
     price_filter = symbol_filters.get('PRICE_FILTER')
     min_price = decimal_context.create_decimal(price_filter.get('minPrice', '0')) if price_filter else Decimal(0)
     max_price = decimal_context.create_decimal(price_filter.get('maxPrice', 'inf')) if price_filter else Decimal('inf')
@@ -3380,7 +5098,7 @@ async def build_and_show_confirmation(update: Update, context: ContextTypes.DEFA
         await _send_or_edit(update, context, "❌ خطأ داخلي: تفاصيل الصفقة مفقودة.", build_main_menu_keyboard(), edit=True)
         return ConversationHandler.END
 
-    symbol_filters = get_symbol_filters(pair, context)
+    symbol_filters = await get_symbol_filters(pair, context)
     if not symbol_filters:
          logger.error(f"Could not get filters for {pair} in confirmation.")
          await _send_or_edit(update, context, f"⚠️ لم أتمكن من جلب قيود التداول لـ {pair}. لا يمكن المتابعة.", build_cancel_keyboard(CALLBACK_CANCEL_TRADE), edit=True)
@@ -3453,26 +5171,26 @@ async def _place_sltp_orders(
 
     opposite_side = SIDE_SELL if trade_side == SIDE_BUY else SIDE_BUY
     status_msg = ""
-    lot_filter = symbol_filters.get('LOT_SIZE')
-    min_qty = decimal_context.create_decimal(lot_filter.get('minQty', '0')) if lot_filter else Decimal(0)
+    quantizer = quantizer_for(symbol_filters)
+    min_qty = quantizer.min_qty
 
     try:
         # Adjust executed quantity according to LOT_SIZE filter for SL/TP orders
-        adjusted_exec_qty = adjust_quantity(executed_qty, symbol_filters)
+        adjusted_exec_qty = quantizer.round_qty(executed_qty)
         logger.info(f"Adjusted executed quantity for SL/TP orders: {adjusted_exec_qty}")
 
         if adjusted_exec_qty < min_qty:
             logger.warning(f"Adjusted SL/TP quantity {adjusted_exec_qty} is below minQty {min_qty}.")
             return f"\n\n⚠️ الكمية المنفذة بعد التعديل ({adjusted_exec_qty:f}) أقل من الحد الأدنى ({min_qty:f}) لوضع SL/TP."
 
-        adjusted_exec_qty_str = format_decimal(adjusted_exec_qty, symbol_filters, 'LOT_SIZE')
+        adjusted_exec_qty_str = quantizer.format(adjusted_exec_qty, 'LOT_SIZE')
 
         # --- OCO Order (SL and TP) ---
         if sl_price and tp_price:
             # Prices are already adjusted, just format them
-            sl_stop_price_str = format_decimal(sl_price, symbol_filters, 'PRICE_FILTER') # Trigger price
-            sl_limit_price_str = format_decimal(sl_price, symbol_filters, 'PRICE_FILTER') # Limit price (can be same as trigger for OCO stop)
-            tp_limit_price_str = format_decimal(tp_price, symbol_filters, 'PRICE_FILTER') # Limit price for TP leg
+            sl_stop_price_str = quantizer.format(sl_price, 'PRICE_FILTER') # Trigger price
+            sl_limit_price_str = quantizer.format(sl_price, 'PRICE_FILTER') # Limit price (can be same as trigger for OCO stop)
+            tp_limit_price_str = quantizer.format(tp_price, 'PRICE_FILTER') # Limit price for TP leg
 
             oco_params = {
                 'symbol': pair,
@@ -3484,13 +5202,13 @@ async def _place_sltp_orders(
                 'stopLimitTimeInForce': TIME_IN_FORCE_GTC, # Required for stopLimitPrice
             }
             logger.info(f"--- Attempting OCO order: {oco_params}")
-            binance_client.create_oco_order(**oco_params)
+            await binance_call('create_oco_order', **oco_params)
             status_msg = "\n\n✅ تم وضع أمر OCO (SL/TP) بنجاح."
 
         # --- Individual SL Order (STOP_LOSS_LIMIT) ---
         elif sl_price:
-            sl_stop_price_str = format_decimal(sl_price, symbol_filters, 'PRICE_FILTER') # Trigger
-            sl_limit_price_str = format_decimal(sl_price, symbol_filters, 'PRICE_FILTER') # Limit
+            sl_stop_price_str = quantizer.format(sl_price, 'PRICE_FILTER') # Trigger
+            sl_limit_price_str = quantizer.format(sl_price, 'PRICE_FILTER') # Limit
 
             sl_params = {
                 'symbol': pair,
@@ -3502,13 +5220,13 @@ async def _place_sltp_orders(
                 'timeInForce': TIME_IN_FORCE_GTC, # Required for limit price
             }
             logger.info(f"--- Attempting SL Limit order: {sl_params}")
-            binance_client.create_order(**sl_params)
+            await binance_call('create_order', **sl_params)
             status_msg = "\n\n✅ تم وضع أمر SL بنجاح."
 
         # --- Individual TP Order (TAKE_PROFIT_LIMIT) ---
         elif tp_price:
-            tp_stop_price_str = format_decimal(tp_price, symbol_filters, 'PRICE_FILTER') # Trigger
-            tp_limit_price_str = format_decimal(tp_price, symbol_filters, 'PRICE_FILTER') # Limit
+            tp_stop_price_str = quantizer.format(tp_price, 'PRICE_FILTER') # Trigger
+            tp_limit_price_str = quantizer.format(tp_price, 'PRICE_FILTER') # Limit
 
             tp_params = {
                 'symbol': pair,
@@ -3520,7 +5238,7 @@ async def _place_sltp_orders(
                 'timeInForce': TIME_IN_FORCE_GTC, # Required for limit price
             }
             logger.info(f"--- Attempting TP Limit order: {tp_params}")
-            binance_client.create_order(**tp_params)
+            await binance_call('create_order', **tp_params)
             status_msg = "\n\n✅ تم وضع أمر TP بنجاح."
 
     except (BinanceAPIException, BinanceOrderException) as e:
@@ -3529,6 +5247,9 @@ async def _place_sltp_orders(
         if e.code == -2010: error_detail = "خطأ في الرصيد أو قيود التداول (Code: -2010)"
         elif e.code == -1013: error_detail = "خطأ في قيود السعر/الكمية (Code: -1013)"
         status_msg = f"\n\n⚠️ فشل وضع أمر SL/TP: {error_detail}"
+    except RateLimitExceeded as e:
+        logger.warning(f"--- SL/TP order skipped, order budget exhausted: {e}")
+        status_msg = f"\n\n⚠️ تم تجاوز حد الأوامر في الدقيقة، لم يتم وضع SL/TP (حاول بعد {e.retry_after:.0f} ثانية)."
     except Exception as e:
         logger.error(f"--- Generic error placing SL/TP order: {e}", exc_info=True)
         status_msg = "\n\n⚠️ حدث خطأ غير متوقع أثناء محاولة وضع SL/TP."
@@ -3572,7 +5293,7 @@ async def confirm_trade_final_handler(update: Update, context: ContextTypes.DEFA
         return ConversationHandler.END
 
     # --- Get Filters ---
-    symbol_filters = get_symbol_filters(pair, context)
+    symbol_filters = await get_symbol_filters(pair, context)
     if not symbol_filters:
          logger.error(f"Could not get filters for {pair} before placing order.")
          await _send_or_edit(update, context, f"⚠️ لم أتمكن من جلب قيود التداول لـ {pair}. لا يمكن المتابعة.", build_main_menu_keyboard(), edit=True)
@@ -3601,7 +5322,7 @@ async def confirm_trade_final_handler(update: Update, context: ContextTypes.DEFA
             'type': ORDER_TYPE_MARKET,
             'quantity': formatted_amount_str
         }
-        order_response = binance_client.create_order(**order_params)
+        order_response = await binance_call('create_order', **order_params)
         logger.info(f"Binance main order response: {order_response}")
 
         # --- Build Success Message ---
@@ -3610,6 +5331,7 @@ async def confirm_trade_final_handler(update: Update, context: ContextTypes.DEFA
         avg_price = (cummulative_quote_qty / executed_qty_dec) if executed_qty_dec > 0 else Decimal(0)
         status = order_response.get('status')
         order_id = order_response.get('orderId')
+        await symbol_discovery.note(pair, 'order')
 
         final_message = f"✅ <b>تم {trade_action_text} بنجاح!</b>\n\n"
         final_message += f"<b>الزوج:</b> {pair}\n"
@@ -3643,6 +5365,11 @@ async def confirm_trade_final_handler(update: Update, context: ContextTypes.DEFA
         error_msg += f"\n(Code: {e.code})"
         await _send_or_edit(update, context, error_msg, final_keyboard, edit=True, parse_mode=ParseMode.HTML)
 
+    except RateLimitExceeded as e:
+        logger.warning(f"Trade budget exhausted ({trade_action_text}): {e}")
+        error_msg = f"⚠️ تم تجاوز الحد المسموح من الصفقات في الدقيقة. الرجاء المحاولة بعد {e.retry_after:.0f} ثانية."
+        await _send_or_edit(update, context, error_msg, final_keyboard, edit=True)
+
     except ValueError as e:
          logger.error(f"Value Error ({trade_action_text}): {e}")
          error_msg = f"❌ **خطأ في البيانات:**\n\n<code>{e}</code>"
@@ -3663,6 +5390,7 @@ async def toggle_alerts(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     query = update.callback_query
     if query: await query.answer()
     context.user_data['alert_config']['enabled'] = not context.user_data['alert_config']['enabled']
+    alert_engine.sync_user(update.effective_user.id, context.user_data)
     status = "مفعلة ✅" if context.user_data['alert_config']['enabled'] else "معطلة ❌"
     text = f"تم تغيير حالة التنبيهات إلى: {status}"
     keyboard = build_alerts_menu_keyboard(context)
@@ -3697,6 +5425,7 @@ async def handle_manual_threshold_input(update: Update, context: ContextTypes.DE
             
         config = context.user_data.setdefault('alert_config', {})
         config['threshold_percent'] = percentage
+        alert_engine.sync_user(update.effective_user.id, context.user_data)
         
         await show_alerts_menu(update, context)
         return ConversationHandler.END
@@ -3729,6 +5458,7 @@ async def handle_alert_threshold_selection(update: Update, context: ContextTypes
         percentage = int(query.data.split(CALLBACK_ALERT_PERC_PREFIX, 1)[1])
         config = context.user_data.setdefault('alert_config', {})
         config['threshold_percent'] = Decimal(percentage)
+        alert_engine.sync_user(update.effective_user.id, context.user_data)
         
         await show_alerts_menu(update, context)
         
@@ -3736,6 +5466,508 @@ async def handle_alert_threshold_selection(update: Update, context: ContextTypes
         logger.error(f"Error processing alert threshold selection: {e}")
         await _send_or_edit(update, context, "⚠️ حدث خطأ في تحديد نسبة التغير.", build_alerts_menu_keyboard(context), edit=True)
 
+# --- محرك تقييم التنبيهات (مهمة خلفية) ---
+ALERT_ENGINE_TICK_SECONDS = 30 # كل دورة تقرأ لقطة أسعار واحدة مشتركة
+
+AlertKey = Tuple[int, str] # (user_id, symbol)
+
+class AlertTriggerIndex:
+    """
+    Per-symbol sorted arrays of alert trigger prices. Each alert with a
+    reference price p and threshold t has the band [p - p*t%, p + p*t%];
+    `crossed` finds the alerts whose band a new price left with two bisects,
+    O(log n + k). Alerts without a reference price yet are kept aside and
+    returned on every call until they get one.
+    """
+
+    def __init__(self):
+        self._upper: Dict[str, List[Tuple[Decimal, int]]] = defaultdict(list)
+        self._lower: Dict[str, List[Tuple[Decimal, int]]] = defaultdict(list)
+        self._pending: Dict[str, Set[int]] = defaultdict(set)
+        self._bands: Dict[AlertKey, Optional[Tuple[Decimal, Decimal]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._bands)
+
+    def symbols(self) -> Set[str]:
+        """Symbols with at least one indexed or pending alert (O(symbols), not O(alerts))."""
+        return {symbol for symbol, levels in self._upper.items() if levels} | {symbol for symbol, users in self._pending.items() if users}
+
+    def add(self, key: AlertKey, reference: Optional[Decimal], threshold: Decimal) -> None:
+        """Indexes (or re-indexes) one alert around its reference price."""
+        self.remove(key)
+        user_id, symbol = key
+        if not reference:
+            self._pending[symbol].add(user_id)
+            self._bands[key] = None
+            return
+        band = reference * threshold / 100
+        lower, upper = reference - band, reference + band
+        bisect.insort(self._upper[symbol], (upper, user_id))
+        bisect.insort(self._lower[symbol], (lower, user_id))
+        self._bands[key] = (lower, upper)
+
+    def remove(self, key: AlertKey) -> None:
+        if key not in self._bands: return
+        bounds = self._bands.pop(key)
+        user_id, symbol = key
+        if bounds is None:
+            self._pending[symbol].discard(user_id)
+            return
+        lower, upper = bounds
+        self._discard(self._upper[symbol], (upper, user_id))
+        self._discard(self._lower[symbol], (lower, user_id))
+
+    @staticmethod
+    def _discard(levels: List[Tuple[Decimal, int]], item: Tuple[Decimal, int]) -> None:
+        i = bisect.bisect_left(levels, item)
+        if i < len(levels) and levels[i] == item:
+            del levels[i]
+
+    def crossed(self, symbol: str, price: Decimal) -> List[AlertKey]:
+        """Alerts on symbol whose band does not contain price (plus alerts awaiting a reference)."""
+        user_ids = list(self._pending.get(symbol, ()))
+        upper = self._upper.get(symbol)
+        if upper: # upper level <= price
+            user_ids.extend(user_id for _, user_id in upper[:bisect.bisect_right(upper, (price, float('inf')))])
+        lower = self._lower.get(symbol)
+        if lower: # lower level >= price
+            user_ids.extend(user_id for _, user_id in lower[bisect.bisect_left(lower, (price, float('-inf'))):])
+        return [(user_id, symbol) for user_id in user_ids]
+
+class RollingPriceWindow:
+    """
+    Fixed-capacity ring buffer (array of doubles) of one symbol's sampled
+    prices, plus a monotonic min deque and max deque per tracked window
+    length, so window extremes are O(1) amortized per sample.
+    """
+
+    __slots__ = ('prices', 'seq', 'windows')
+
+    def __init__(self, capacity: int):
+        self.prices = array('d', bytes(8 * capacity))
+        self.seq = 0 # samples pushed so far
+        self.windows: Dict[int, Tuple[deque, deque]] = {}
+
+    def samples(self) -> List[Tuple[int, float]]:
+        """Stored (seq, price) samples, oldest first."""
+        first = max(0, self.seq - len(self.prices))
+        return [(i, self.prices[i % len(self.prices)]) for i in range(first, self.seq)]
+
+    def track(self, length: int) -> None:
+        if length in self.windows: return
+        self.windows[length] = (deque(), deque())
+        for i, price in self.samples()[-length:]:
+            self._push_window(length, i, price)
+
+    def push(self, price: float) -> None:
+        i = self.seq
+        self.prices[i % len(self.prices)] = price
+        self.seq += 1
+        for length in self.windows:
+            self._push_window(length, i, price)
+
+    def _push_window(self, length: int, i: int, price: float) -> None:
+        mins, maxs = self.windows[length]
+        while mins and mins[-1][1] >= price: mins.pop()
+        mins.append((i, price))
+        while maxs and maxs[-1][1] <= price: maxs.pop()
+        maxs.append((i, price))
+        oldest = i - length + 1
+        while mins[0][0] < oldest: mins.popleft()
+        while maxs[0][0] < oldest: maxs.popleft()
+
+    def extremes(self, length: int) -> Tuple[float, float]:
+        mins, maxs = self.windows[length]
+        return mins[0][1], maxs[0][1]
+
+    def change(self, length: int) -> Optional[float]:
+        """% change from the sample length-1 steps back to the latest one (None if not buffered)."""
+        if self.seq < length or length > len(self.prices): return None
+        old = self.prices[(self.seq - length) % len(self.prices)]
+        new = self.prices[(self.seq - 1) % len(self.prices)]
+        return (new - old) / old * 100 if old else None
+
+class MarketPriceHistory:
+    """
+    Rolling price windows for every symbol in the ticker snapshot, sampled
+    once per alert-engine tick. Buffers are sized to the longest window in
+    use; `moves` scans the whole market in one pass.
+    """
+
+    def __init__(self, sample_seconds: float):
+        self.sample_seconds = sample_seconds
+        self.capacity = 2
+        self.lengths: Set[int] = set()
+        self._windows: Dict[str, RollingPriceWindow] = {}
+
+    def window_length(self, minutes: float) -> int:
+        """Samples covering `minutes` (both end points included)."""
+        return max(2, math.ceil(minutes * 60 / self.sample_seconds) + 1)
+
+    def track(self, length: int) -> None:
+        if length in self.lengths: return
+        self.lengths.add(length)
+        if length > self.capacity:
+            self.capacity = length
+            for symbol, window in list(self._windows.items()):
+                self._windows[symbol] = self._resized(window)
+        for window in self._windows.values():
+            window.track(length)
+
+    def untrack(self, length: int) -> None:
+        """Drops a window length no alert uses any more; buffers shrink to the longest one left."""
+        if length not in self.lengths: return
+        self.lengths.discard(length)
+        for window in self._windows.values():
+            window.windows.pop(length, None)
+        capacity = max(self.lengths, default=2)
+        if capacity < self.capacity:
+            self.capacity = capacity
+            for symbol, window in list(self._windows.items()):
+                self._windows[symbol] = self._resized(window)
+
+    def _resized(self, window: RollingPriceWindow) -> RollingPriceWindow:
+        resized = RollingPriceWindow(self.capacity)
+        for _, price in window.samples():
+            resized.push(price)
+        for length in window.windows:
+            resized.track(length)
+        return resized
+
+    def record(self, tickers: Mapping[str, Decimal]) -> None:
+        for symbol, price in tickers.items():
+            window = self._windows.get(symbol)
+            if window is None:
+                window = self._windows[symbol] = RollingPriceWindow(self.capacity)
+                for length in self.lengths:
+                    window.track(length)
+            window.push(float(price))
+
+    def moves(self, length: int, min_move: float) -> List[Tuple[str, float]]:
+        """(symbol, % move) for every symbol whose latest price is min_move% or more away from its window low/high."""
+        result = []
+        for symbol, window in self._windows.items():
+            if length not in window.windows: continue
+            low, high = window.extremes(length)
+            price = window.prices[(window.seq - 1) % len(window.prices)]
+            up = (price - low) / low * 100 if low else 0.0
+            down = (price - high) / high * 100 if high else 0.0
+            move = up if up >= -down else down
+            if abs(move) >= min_move:
+                result.append((symbol, move))
+        return result
+
+@dataclass
+class SuppressedMoves:
+    """Moves of one (user, symbol) held back during its cooldown, merged into one digest line."""
+    count: int = 0
+    largest_change: Decimal = Decimal(0)
+    last_change: Decimal = Decimal(0)
+    last_price: Decimal = Decimal(0)
+
+    def merge(self, price: Decimal, change: Decimal) -> None:
+        self.count += 1
+        if abs(change) > abs(self.largest_change): self.largest_change = change
+        self.last_change = change
+        self.last_price = price
+
+class CooldownScheduler:
+    """
+    spam_delay enforcement keyed by (user_id, symbol): a min-heap of
+    next-eligible times (lazy deletion) plus the current deadline per key.
+    Checking a key is O(1), starting a cooldown O(log n), and a tick only pops
+    the cooldowns that actually expired. Moves suppressed meanwhile are merged
+    and handed back as a digest when the cooldown ends.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[float, AlertKey]] = []
+        self._until: Dict[AlertKey, float] = {}
+        self._suppressed: Dict[AlertKey, SuppressedMoves] = {}
+
+    def __len__(self) -> int:
+        return len(self._until)
+
+    def allow(self, key: AlertKey, now: float) -> bool:
+        return self._until.get(key, 0.0) <= now
+
+    def start(self, key: AlertKey, until: float) -> None:
+        self._until[key] = until
+        heapq.heappush(self._heap, (until, key))
+
+    def suppress(self, key: AlertKey, price: Decimal, change: Decimal) -> None:
+        self._suppressed.setdefault(key, SuppressedMoves()).merge(price, change)
+
+    def discard(self, key: AlertKey) -> None:
+        self._until.pop(key, None) # heap entry is skipped when popped
+        self._suppressed.pop(key, None)
+
+    def expired(self, now: float) -> List[Tuple[AlertKey, SuppressedMoves]]:
+        """Ends due cooldowns; returns those that suppressed moves (their digests)."""
+        digests = []
+        while self._heap and self._heap[0][0] <= now:
+            until, key = heapq.heappop(self._heap)
+            if self._until.get(key) != until: continue # superseded or discarded
+            del self._until[key]
+            moves = self._suppressed.pop(key, None)
+            if moves: digests.append((key, moves))
+        return digests
+
+class AlertEngine:
+    """
+    Background task evaluating every user's alerts against one shared ticker
+    snapshot per tick; no per-user REST calls are made.
+
+    - Custom alerts (custom_alerts[symbol]) fire when the price has moved
+      threshold% from `last_price`; they live in an AlertTriggerIndex so a
+      tick only visits crossed alerts.
+    - The global threshold watches the user's favorite pairs (those without a
+      custom alert) and fires when the price moved threshold% within the last
+      interval_minutes, using MarketPriceHistory windows.
+
+    Both update `last_price` / `last_alert`. After an alert the (user, symbol)
+    pair cools down for spam_delay_minutes in a CooldownScheduler; moves in
+    that time are merged and sent as one digest when the cooldown expires.
+    State is built from user_data at the first tick and kept current by
+    sync_user(), which handlers call after changing alerts or favorites.
+    """
+
+    def __init__(self, tick_seconds: float = ALERT_ENGINE_TICK_SECONDS):
+        self.tick_seconds = tick_seconds
+        self.ticks = 0
+        self.sent = 0
+        self.index = AlertTriggerIndex()
+        self.history = MarketPriceHistory(tick_seconds)
+        self.cooldowns = CooldownScheduler()
+        self._alerts: Dict[AlertKey, Tuple[Dict[str, Any], Decimal]] = {} # custom alert key -> (state, threshold)
+        self._watchers: Dict[int, Dict[str, Dict[str, Any]]] = defaultdict(dict) # window length -> {symbol: {user_id: state}}
+        self._configs: Dict[int, Dict[str, Any]] = {}
+        self._user_symbols: Dict[int, Set[str]] = {}
+        self._user_watch: Dict[int, Tuple[int, Set[str]]] = {} # user_id -> (window length, symbols)
+        self._global_thresholds: Dict[int, Dict[int, Decimal]] = defaultdict(dict) # window length -> {user_id: threshold}
+        self._synced = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, application: Application) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(application), name="alert-engine")
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try: await self._task
+            except asyncio.CancelledError: pass
+            self._task = None
+
+    async def _run(self, application: Application) -> None:
+        while True:
+            await asyncio.sleep(self.tick_seconds)
+            try:
+                await self.tick(application)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Alert engine tick failed: {e}", exc_info=True)
+
+    def sync_user(self, user_id: int, user_data: Dict[str, Any]) -> None:
+        """Re-indexes one user's alerts after their settings changed."""
+        config = user_data.get('alert_config')
+        enabled = bool(config and config.get('enabled'))
+        custom_alerts = user_data.get('custom_alerts', {}) if enabled else {}
+
+        for symbol in self._user_symbols.pop(user_id, set()) - custom_alerts.keys():
+            self.index.remove((user_id, symbol))
+            self._alerts.pop((user_id, symbol), None)
+            if not enabled or symbol not in user_data.get('favorite_pairs', DEFAULT_FAVORITE_PAIRS):
+                self.cooldowns.discard((user_id, symbol))
+        for symbol, settings in custom_alerts.items():
+            key = (user_id, symbol)
+            threshold = decimal_context.create_decimal(settings['threshold'])
+            self._alerts[key] = (settings, threshold)
+            self.index.add(key, settings.get('last_price'), threshold)
+            self._restore_cooldown(key, settings, config)
+        if custom_alerts:
+            self._user_symbols[user_id] = set(custom_alerts)
+
+        old_length, old_symbols = self._user_watch.pop(user_id, (0, set()))
+        old_watchers = self._watchers.get(old_length, {})
+        for symbol in old_symbols:
+            users = old_watchers.get(symbol, {})
+            users.pop(user_id, None)
+            if not users: old_watchers.pop(symbol, None)
+            if symbol not in custom_alerts: self.cooldowns.discard((user_id, symbol))
+        self._global_thresholds.get(old_length, {}).pop(user_id, None)
+        if enabled:
+            length = self.history.window_length(float(config.get('interval_minutes', DEFAULT_ALERT_INTERVAL_MINUTES)))
+            favorite_state = config.setdefault('favorite_alerts', {})
+            symbols = {symbol for symbol in user_data.get('favorite_pairs', DEFAULT_FAVORITE_PAIRS) if symbol not in custom_alerts}
+            for symbol in symbols:
+                state = self._watchers[length].setdefault(symbol, {})[user_id] = favorite_state.setdefault(symbol, {})
+                self._restore_cooldown((user_id, symbol), state, config)
+            if symbols:
+                self.history.track(length)
+                self._user_watch[user_id] = (length, symbols)
+                self._global_thresholds[length][user_id] = decimal_context.create_decimal(config.get('threshold_percent', DEFAULT_ALERT_THRESHOLD))
+        if old_length and not self._global_thresholds.get(old_length):
+            self._release_window(old_length)
+
+        if enabled and (custom_alerts or user_id in self._user_watch):
+            self._configs[user_id] = config
+        else:
+            self._configs.pop(user_id, None)
+
+    def _release_window(self, length: int) -> None:
+        """Stops watching a window length once no user's interval maps to it."""
+        self._watchers.pop(length, None)
+        self._global_thresholds.pop(length, None)
+        self.history.untrack(length)
+
+    def resync(self, application: Application) -> None:
+        for user_id, user_data in application.user_data.items():
+            self.sync_user(user_id, user_data)
+        # Reconcile the tracked lengths with the windows users actually watch
+        in_use = {length for length, _ in self._user_watch.values()}
+        for length in self.history.lengths - in_use:
+            self._release_window(length)
+        self._synced = True
+        logger.info(f"Alert engine indexed {len(self.index)} custom alerts and {len(self._user_watch)} favorite watchers.")
+
+    @staticmethod
+    def _spam_delay_seconds(config: Dict[str, Any]) -> float:
+        return float(config.get('spam_delay_minutes', DEFAULT_ALERT_SPAM_DELAY_MINUTES)) * 60
+
+    def _restore_cooldown(self, key: AlertKey, state: Dict[str, Any], config: Dict[str, Any]) -> None:
+        """Keeps a cooldown running across restarts / re-syncs, based on the persisted last_alert."""
+        last_alert = state.get('last_alert')
+        if last_alert is None or not self.cooldowns.allow(key, time.time()): return
+        until = last_alert.timestamp() + self._spam_delay_seconds(config)
+        if until > time.time():
+            self.cooldowns.start(key, until)
+
+    def _record(self, key: AlertKey, state: Dict[str, Any], price: Decimal, change: Decimal, now: datetime,
+                outgoing: Dict[int, List[Tuple[str, Decimal, Decimal]]]) -> bool:
+        """Queues the move for sending (True), or merges it into the pending digest while the pair cools down."""
+        user_id, symbol = key
+        if not self.cooldowns.allow(key, now.timestamp()):
+            self.cooldowns.suppress(key, price, change)
+            return False
+        state['last_price'] = price
+        state['last_alert'] = now
+        self.cooldowns.start(key, now.timestamp() + self._spam_delay_seconds(self._configs[user_id]))
+        outgoing[user_id].append((symbol, price, change))
+        return True
+
+    def _state_for(self, key: AlertKey) -> Optional[Dict[str, Any]]:
+        if key in self._alerts: return self._alerts[key][0]
+        watch = self._user_watch.get(key[0])
+        return self._watchers[watch[0]].get(key[1], {}).get(key[0]) if watch else None
+
+    async def tick(self, application: Application) -> int:
+        """Runs one evaluation pass; returns the number of alert messages sent."""
+        self.ticks += 1
+        if not self._synced:
+            self.resync(application)
+        if not self._configs: return 0
+        tickers = await get_cached_tickers(application, quote_asset='USDT')
+        if not tickers:
+            logger.warning("Alert engine skipped a tick: no ticker snapshot available.")
+            return 0
+
+        now = datetime.now()
+        touched: Set[int] = set()
+        outgoing: Dict[int, List[Tuple[str, Decimal, Decimal]]] = defaultdict(list)
+
+        # Custom alerts: only those whose band was crossed
+        for symbol in self.index.symbols():
+            price = tickers.get(symbol)
+            if price is None: continue
+            for key in self.index.crossed(symbol, price):
+                user_id = key[0]
+                state, threshold = self._alerts[key]
+                change = self._check(state, price, threshold)
+                if change is not None and not self._record(key, state, price, change, now, outgoing):
+                    state['last_price'] = price # Suppressed: the next digest entry needs another full move
+                self.index.add(key, state.get('last_price'), threshold)
+                touched.add(user_id)
+
+        # Global threshold: moves within each user's interval window, one market pass per window length
+        self.history.record(tickers)
+        for length, watchers in self._watchers.items():
+            thresholds = self._global_thresholds[length]
+            if not thresholds: continue
+            window_seconds = length * self.tick_seconds
+            for symbol, move in self.history.moves(length, float(min(thresholds.values()))):
+                for user_id, state in watchers.get(symbol, {}).items():
+                    change = decimal_context.create_decimal(repr(move))
+                    if abs(change) < thresholds[user_id]: continue
+                    # The window keeps showing a move until it ages out; while the pair cools down
+                    # (or the alerted move is still inside the window) only a further threshold
+                    # move away from the last reported price counts as new
+                    key = (user_id, symbol)
+                    price = tickers[symbol]
+                    last_alert = state.get('last_alert')
+                    recent = last_alert is not None and (now - last_alert).total_seconds() < window_seconds
+                    if (recent or not self.cooldowns.allow(key, now.timestamp())) and self._check(state, price, thresholds[user_id]) is None: continue
+                    if not self._record(key, state, price, change, now, outgoing):
+                        state['last_price'] = price
+                    touched.add(user_id)
+
+        # Cooldowns that ended with suppressed moves: one digest line per pair
+        digests: Dict[int, List[Tuple[str, SuppressedMoves]]] = defaultdict(list)
+        for key, moves in self.cooldowns.expired(now.timestamp()):
+            user_id, symbol = key
+            state = self._state_for(key)
+            if state is None or user_id not in self._configs: continue
+            state['last_price'] = moves.last_price
+            state['last_alert'] = now
+            self.cooldowns.start(key, now.timestamp() + self._spam_delay_seconds(self._configs[user_id]))
+            if key in self._alerts:
+                self.index.add(key, moves.last_price, self._alerts[key][1])
+            touched.add(user_id)
+            digests[user_id].append((symbol, moves))
+
+        if touched and hasattr(application, 'mark_data_for_update_persistence'):
+            # last_price / last_alert were changed outside of an update
+            application.mark_data_for_update_persistence(user_ids=touched)
+
+        recipients = outgoing.keys() | digests.keys()
+        results = await asyncio.gather(*(self._send(application, user_id, outgoing.get(user_id, []), digests.get(user_id, [])) for user_id in recipients), return_exceptions=True)
+        sent = sum(1 for result in results if result is True)
+        self.sent += sent
+        return sent
+
+    @staticmethod
+    def _check(state: Dict[str, Any], price: Decimal, threshold: Decimal) -> Optional[Decimal]:
+        """Returns the % move from the reference price when it reaches threshold, otherwise None."""
+        last_price = state.get('last_price')
+        if not last_price:
+            state['last_price'] = price # First observation becomes the reference
+            return None
+        change = (price - last_price) / last_price * 100
+        return change if abs(change) >= threshold else None
+
+    async def _send(self, application: Application, user_id: int, triggered: List[Tuple[str, Decimal, Decimal]],
+                    digests: List[Tuple[str, SuppressedMoves]]) -> bool:
+        text = "🔔 <b>تنبيه تغير الأسعار</b>\n\n"
+        for symbol, price, change in triggered:
+            emoji = "⬆️" if change > 0 else "⬇️"
+            text += f"{emoji} <b>{symbol}</b>: {change:+.2f}% (السعر: ${format_number(price)})\n"
+        if digests:
+            text += ("\n" if triggered else "") + "🔁 <b>ملخص التحركات خلال فترة التهدئة:</b>\n"
+            for symbol, moves in digests:
+                text += (f"• <b>{symbol}</b>: {moves.count} تنبيه مؤجل، أكبر تغير {moves.largest_change:+.2f}%، "
+                         f"آخرها {moves.last_change:+.2f}% (السعر: ${format_number(moves.last_price)})\n")
+        try:
+            await application.bot.send_message(chat_id=user_id, text=text, parse_mode=ParseMode.HTML,
+                                               rate_limit_args={'priority': PRIORITY_BACKGROUND})
+            return True
+        except Exception as e:
+            logger.warning(f"Failed to deliver alerts to user {user_id}: {e}")
+            return False
+
+alert_engine = AlertEngine()
+
 # --- وظائف الشراء السريع ---
 async def quick_buy_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Starts the quick buy conversation."""
@@ -3793,13 +6025,7 @@ async def quick_buy_pair_handler(update: Update, context: ContextTypes.DEFAULT_T
     quote_balance = await get_quote_asset_balance(pair, context)
     balance_text = ""
     if quote_balance is not None:
-        quote_asset = ""
-        exchange_info = context.bot_data.get(EXCHANGE_INFO_CACHE_KEY)
-        if exchange_info:
-            for symbol_data in exchange_info.get('symbols', []):
-                if symbol_data['symbol'] == pair:
-                    quote_asset = symbol_data.get('quoteAsset')
-                    break
+        quote_asset = get_quote_asset(pair, context)
         if quote_asset:
             balance_text = f"\n<i>(رصيد {quote_asset} المتاح: {quote_balance.normalize():f})</i>"
 
@@ -3825,7 +6051,7 @@ async def quick_buy_amount_handler(update: Update, context: ContextTypes.DEFAULT
         await update.message.reply_text("⚠️ خطأ داخلي: لم يتم تحديد الزوج.", reply_markup=build_main_menu_keyboard())
         return ConversationHandler.END
 
-    symbol_filters = get_symbol_filters(pair, context)
+    symbol_filters = await get_symbol_filters(pair, context)
     if not symbol_filters:
         await update.message.reply_text(f"⚠️ لم أتمكن من جلب قيود التداول لـ {pair}.", reply_markup=build_cancel_keyboard(CALLBACK_CANCEL_TRADE))
         return QB_ASK_AMOUNT
@@ -3893,8 +6119,8 @@ async def quick_buy_sl_percent_handler(update: Update, context: ContextTypes.DEF
         percentage_decimal = Decimal(percentage) / 100
         sl_price_raw = current_price * (1 - percentage_decimal) # For buy orders
         
-        symbol_filters = get_symbol_filters(pair, context)
-        sl_price = adjust_price(sl_price_raw, symbol_filters)
+        quantizer = await get_symbol_quantizer(pair, context)
+        sl_price = quantizer.round_price(sl_price_raw)
         
         if sl_price <= 0:
             raise ValueError("سعر SL المحسوب غير صالح.")
@@ -3902,7 +6128,7 @@ async def quick_buy_sl_percent_handler(update: Update, context: ContextTypes.DEF
         context.user_data['qb_sl_price'] = sl_price
         context.user_data['sl_price'] = sl_price # Set for market order
         
-        formatted_sl = format_decimal(sl_price, symbol_filters, 'PRICE_FILTER')
+        formatted_sl = quantizer.format(sl_price, 'PRICE_FILTER')
         text = f"تم تحديد SL بنسبة {percentage}% ({formatted_sl}).\n\nاختر نسبة جني الأرباح (TP) (أو تخطَّ):"
         keyboard = build_percent_keyboard(CALLBACK_QB_TP_PERC_PREFIX, [2, 3, 5, 10])
         keyboard.inline_keyboard.append([InlineKeyboardButton("➡️ تخطَّ TP", callback_data=CALLBACK_QB_SKIP_TP)])
@@ -3939,8 +6165,7 @@ async def quick_buy_tp_percent_handler(update: Update, context: ContextTypes.DEF
         percentage_decimal = Decimal(percentage) / 100
         tp_price_raw = current_price * (1 + percentage_decimal) # For buy orders
         
-        symbol_filters = get_symbol_filters(pair, context)
-        tp_price = adjust_price(tp_price_raw, symbol_filters)
+        tp_price = (await get_symbol_quantizer(pair, context)).round_price(tp_price_raw)
         
         if tp_price <= 0:
             raise ValueError("سعر TP المحسوب غير صالح.")
@@ -4329,7 +6554,7 @@ async def cancel_all_sell_orders(update: Update, context: ContextTypes.DEFAULT_T
 
     try:
         # Get all open orders
-        open_orders = binance_client.get_open_orders()
+        open_orders = await get_open_orders()
         sell_orders = [order for order in open_orders if order['side'] == 'SELL']
         
         if not sell_orders:
@@ -4343,7 +6568,7 @@ async def cancel_all_sell_orders(update: Update, context: ContextTypes.DEFAULT_T
 
         for order in sell_orders:
             try:
-                binance_client.cancel_order(symbol=order['symbol'], orderId=order['orderId'])
+                await binance_call('cancel_order', symbol=order['symbol'], orderId=order['orderId'])
                 cancelled_count += 1
             except Exception as e:
                 failed_count += 1
@@ -4372,23 +6597,334 @@ async def cancel_all_sell_orders(update: Update, context: ContextTypes.DEFAULT_T
         keyboard = [[InlineKeyboardButton("🔙 رجوع لقائمة التداول", callback_data=CALLBACK_GOTO_TRADING)]]
         await _send_or_edit(update, context, error_text, InlineKeyboardMarkup(keyboard), edit=True)
 
-async def main() -> None:
-    """Main function to start the bot."""
+# --- الحفظ المستمر (SQLite) ---
+PERSISTENCE_DB_PATH = os.getenv('PERSISTENCE_DB_PATH', 'bot_state.db')
+LEGACY_PICKLE_PATH = "bot_data.pickle"
+VOLATILE_BOT_DATA_KEYS = {EXCHANGE_INFO_CACHE_KEY, SYMBOLS_CACHE_KEY, "account_balances"}
+VOLATILE_BOT_DATA_PREFIXES = (TICKERS_CACHE_KEY, "symbol_info_direct_")
+
+def is_volatile_bot_data_key(key: Any) -> bool:
+    """Legacy cache keys (now in volatile_cache); dropped if an old pickle still carries them."""
+    return isinstance(key, str) and (key in VOLATILE_BOT_DATA_KEYS or key.startswith(VOLATILE_BOT_DATA_PREFIXES))
+
+class SQLitePersistence(BasePersistence):
+    """
+    Stores user_data, chat_data, bot_data (one row per top-level key) and
+    conversations in SQLite. Each row's last written pickle digest is kept in
+    memory, so a flush only writes rows whose content changed. Volatile bot_data
+    caches are skipped. On first start an existing bot_data.pickle is imported.
+    Values are pickled on the event loop (handlers and the alert engine mutate
+    them there); only the SQLite work runs in a worker thread.
+    """
+
+    _TABLES = ('user_data', 'chat_data', 'bot_data')
+
+    def __init__(self, path: str = PERSISTENCE_DB_PATH, legacy_pickle: Optional[str] = LEGACY_PICKLE_PATH, update_interval: float = 60):
+        super().__init__(update_interval=update_interval)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._digests: Dict[Tuple[str, bytes], bytes] = {}
+        self.writes = 0
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            for table in self._TABLES:
+                self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (key BLOB PRIMARY KEY, value BLOB NOT NULL)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS conversations ("
+                " name TEXT NOT NULL, key BLOB NOT NULL, state BLOB NOT NULL, PRIMARY KEY (name, key))"
+            )
+            self._conn.execute("CREATE TABLE IF NOT EXISTS callback_data (id INTEGER PRIMARY KEY CHECK (id = 0), value BLOB NOT NULL)")
+        if legacy_pickle and os.path.exists(legacy_pickle) and self._is_empty():
+            self._import_pickle(legacy_pickle)
+
+    # -- blocking helpers --
+    def _is_empty(self) -> bool:
+        with self._lock:
+            return not any(self._conn.execute(f"SELECT 1 FROM {t} LIMIT 1").fetchone() for t in self._TABLES)
+
+    def _import_pickle(self, path: str) -> None:
+        try:
+            with open(path, 'rb') as f:
+                data = pickle.load(f)
+        except Exception as e:
+            logger.error(f"Could not import legacy persistence file {path}: {e}")
+            return
+        for user_id, user_data in (data.get('user_data') or {}).items():
+            self._write_row('user_data', user_id, user_data)
+        for chat_id, chat_data in (data.get('chat_data') or {}).items():
+            self._write_row('chat_data', chat_id, chat_data)
+        for key, value in (data.get('bot_data') or {}).items():
+            if not is_volatile_bot_data_key(key):
+                self._write_row('bot_data', key, value)
+        for name, states in (data.get('conversations') or {}).items():
+            for key, state in states.items():
+                self._write_conversation(name, key, state)
+        logger.info(f"Imported legacy persistence from {path}")
+
+    def _read_table(self, table: str) -> Dict[Any, Any]:
+        with self._lock:
+            rows = self._conn.execute(f"SELECT key, value FROM {table}").fetchall()
+        result = {}
+        for raw_key, blob in rows:
+            digest = hashlib.blake2b(blob, digest_size=16).digest()
+            with self._lock:
+                self._digests[(table, raw_key)] = digest
+            result[pickle.loads(raw_key)] = pickle.loads(blob)
+        return result
+
+    @staticmethod
+    def _encode_row(key: Any, value: Any) -> Tuple[bytes, bytes, bytes]:
+        """Pickles one row; returns (raw_key, blob, digest). Call on the thread that owns `value`."""
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        return pickle.dumps(key), blob, hashlib.blake2b(blob, digest_size=16).digest()
+
+    def _write_row(self, table: str, key: Any, value: Any) -> bool:
+        return self._store_row(table, *self._encode_row(key, value))
+
+    def _store_row(self, table: str, raw_key: bytes, blob: bytes, digest: bytes) -> bool:
+        """Writes one encoded row if its digest changed. Returns True when written."""
+        # _digests is shared with the persistence calls running on other threads; only touch it under the lock
+        with self._lock:
+            if self._digests.get((table, raw_key)) == digest:
+                return False
+            with self._conn:
+                self._conn.execute(f"INSERT OR REPLACE INTO {table} (key, value) VALUES (?, ?)", (raw_key, blob))
+            self._digests[(table, raw_key)] = digest
+            self.writes += 1
+        return True
+
+    def _delete_row(self, table: str, key: Any) -> None:
+        raw_key = pickle.dumps(key)
+        with self._lock, self._conn:
+            self._conn.execute(f"DELETE FROM {table} WHERE key = ?", (raw_key,))
+            self._digests.pop((table, raw_key), None)
+
+    def _store_bot_data(self, rows: List[Tuple[bytes, bytes, bytes]]) -> None:
+        """Writes the encoded bot_data rows and deletes rows for keys no longer present."""
+        for row in rows:
+            self._store_row('bot_data', *row)
+        raw_live = {raw_key for raw_key, _, _ in rows}
+        with self._lock:
+            stale = [k for k in self._digests if k[0] == 'bot_data' and k[1] not in raw_live]
+            if not stale:
+                return
+            with self._conn:
+                self._conn.executemany("DELETE FROM bot_data WHERE key = ?", [(raw_key,) for _, raw_key in stale])
+            for k in stale:
+                self._digests.pop(k, None)
+
+    def _read_conversations(self, name: str) -> Dict[Any, Any]:
+        with self._lock:
+            rows = self._conn.execute("SELECT key, state FROM conversations WHERE name = ?", (name,)).fetchall()
+        return {pickle.loads(k): pickle.loads(v) for k, v in rows}
+
+    def _write_conversation(self, name: str, key: Any, state: Any) -> None:
+        self._store_conversation(name, pickle.dumps(key), None if state is None else pickle.dumps(state))
+
+    def _store_conversation(self, name: str, raw_key: bytes, raw_state: Optional[bytes]) -> None:
+        with self._lock, self._conn:
+            if raw_state is None:
+                self._conn.execute("DELETE FROM conversations WHERE name = ? AND key = ?", (name, raw_key))
+            else:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)",
+                    (name, raw_key, raw_state)
+                )
+
+    def _read_callback_data(self) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM callback_data WHERE id = 0").fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def _store_callback_data(self, blob: bytes) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO callback_data (id, value) VALUES (0, ?)", (blob,))
+
+    # -- BasePersistence API --
+    async def get_user_data(self) -> Dict[int, Dict[Any, Any]]:
+        return await asyncio.to_thread(self._read_table, 'user_data')
+
+    async def get_chat_data(self) -> Dict[int, Dict[Any, Any]]:
+        return await asyncio.to_thread(self._read_table, 'chat_data')
+
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        return await asyncio.to_thread(self._read_table, 'bot_data')
+
+    async def get_callback_data(self) -> Optional[Any]:
+        return await asyncio.to_thread(self._read_callback_data)
+
+    async def get_conversations(self, name: str) -> Dict[Any, Any]:
+        return await asyncio.to_thread(self._read_conversations, name)
+
+    async def update_user_data(self, user_id: int, data: Dict[Any, Any]) -> None:
+        await asyncio.to_thread(self._store_row, 'user_data', *self._encode_row(user_id, data))
+
+    async def update_chat_data(self, chat_id: int, data: Dict[Any, Any]) -> None:
+        await asyncio.to_thread(self._store_row, 'chat_data', *self._encode_row(chat_id, data))
+
+    async def update_bot_data(self, data: Dict[Any, Any]) -> None:
+        rows = [self._encode_row(key, value) for key, value in data.items() if not is_volatile_bot_data_key(key)]
+        await asyncio.to_thread(self._store_bot_data, rows)
+
+    async def update_callback_data(self, data: Any) -> None:
+        await asyncio.to_thread(self._store_callback_data, pickle.dumps(data))
+
+    async def update_conversation(self, name: str, key: Any, new_state: Optional[object]) -> None:
+        raw_state = None if new_state is None else pickle.dumps(new_state)
+        await asyncio.to_thread(self._store_conversation, name, pickle.dumps(key), raw_state)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        await asyncio.to_thread(self._delete_row, 'user_data', user_id)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        await asyncio.to_thread(self._delete_row, 'chat_data', chat_id)
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict[Any, Any]) -> None:
+        pass # Single process: memory is always current
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict[Any, Any]) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict[Any, Any]) -> None:
+        pass
+
+    async def flush(self) -> None:
+        logger.info(f"SQLite persistence closed after {self.writes} row writes.")
+        with self._lock:
+            self._conn.close()
+
+# --- وضع Webhook ---
+BOT_MODES = ('polling', 'webhook')
+BOT_MODE = os.getenv('BOT_MODE', 'polling') # polling أو webhook
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL') # العنوان العام (https://example.com)، بدونه لا يتم استدعاء setWebhook
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+# بدون عنوان عام يستمع الخادم محليًا فقط، حتى لا يستطيع أحد إرسال تحديثات مزورة
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0' if WEBHOOK_URL else '127.0.0.1')
+LOOPBACK_HOSTS = {'127.0.0.1', '::1', 'localhost'}
+
+class WebhookServer:
+    """
+    Minimal aiohttp server that feeds Telegram webhook POSTs into the
+    application's update queue. Without WEBHOOK_URL no setWebhook call is made,
+    so fake updates can be POSTed to http://localhost:<port><path> for testing.
+    Every update can trade on the account, so a server reachable from other
+    hosts always requires the X-Telegram-Bot-Api-Secret-Token header.
+    /healthz answers everyone with a bare status; queue and cache metrics need
+    the same header.
+    """
+
+    def __init__(self, application: Application, listen: str = WEBHOOK_LISTEN, port: int = WEBHOOK_PORT,
+                 path: str = WEBHOOK_PATH, public_url: Optional[str] = WEBHOOK_URL, secret_token: Optional[str] = WEBHOOK_SECRET):
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.path = path if path.startswith('/') else f"/{path}"
+        self.public_url = public_url
+        # Only a loopback-only server may accept updates without the secret header
+        if secret_token is None and (public_url or listen not in LOOPBACK_HOSTS):
+            secret_token = secrets.token_urlsafe(32)
+            if not public_url:
+                logger.warning(f"Webhook listens on {listen} without WEBHOOK_SECRET; a random secret is required for every request.")
+        self.secret_token = secret_token
+        self._runner: Optional['web.AppRunner'] = None
+
+    async def start(self) -> None:
+        if web is None:
+            raise RuntimeError("مكتبة aiohttp غير مثبتة (pip install aiohttp)، لا يمكن تشغيل وضع webhook.")
+        app = web.Application()
+        app.router.add_post(self.path, self._handle_update)
+        app.router.add_get('/healthz', self._handle_health)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        logger.info(f"Webhook server listening on {self.listen}:{self.port}{self.path}")
+
+        if self.public_url:
+            await self.application.bot.set_webhook(
+                url=f"{self.public_url.rstrip('/')}{self.path}",
+                secret_token=self.secret_token,
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=True,
+            )
+            logger.info("Webhook registered with Telegram.")
+        else:
+            logger.warning("WEBHOOK_URL is not set; webhook not registered with Telegram (local mode).")
+
+    def _authorized(self, request: 'web.Request') -> bool:
+        if not self.secret_token:
+            return True # Loopback-only server
+        return secrets.compare_digest(request.headers.get('X-Telegram-Bot-Api-Secret-Token', ''), self.secret_token)
+
+    async def _handle_update(self, request: 'web.Request') -> 'web.Response':
+        if not self._authorized(request):
+            return web.Response(status=403)
+        try:
+            payload = await request.json()
+            update = Update.de_json(payload, self.application.bot)
+        except Exception as e:
+            logger.warning(f"Rejected malformed webhook payload: {e}")
+            return web.Response(status=400)
+        await self.application.update_queue.put(update)
+        return web.Response(status=200)
+
+    async def _handle_health(self, request: 'web.Request') -> 'web.Response':
+        if not self._authorized(request):
+            return web.json_response({'ok': True})
+        return web.json_response({
+            'ok': True,
+            'pending_updates': self.application.update_queue.qsize(),
+            'queue_wait_seconds': update_processor.queue_wait.snapshot(),
+            'caches': volatile_cache.stats(),
+        })
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+def _install_stop_signals(stop_event: asyncio.Event) -> None:
+    """SIGINT/SIGTERM set `stop_event` so main() can shut down cleanly."""
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            pass # Windows: KeyboardInterrupt still stops asyncio.run()
+
+async def main(mode: str = BOT_MODE) -> None:
+    """Main function to start the bot (mode: 'polling' or 'webhook')."""
+    if mode not in BOT_MODES:
+        raise ValueError(f"Unknown BOT_MODE '{mode}' (expected one of: {', '.join(BOT_MODES)})")
+    application: Optional[Application] = None
+    webhook_server: Optional[WebhookServer] = None
     try:
         logger.info("Starting main function...")
         
         # Initialize persistence
         logger.info("Initializing persistence...")
-        persistence = PicklePersistence(filepath="bot_data.pickle")
+        persistence = SQLitePersistence()
         
         # Create the Application and pass it your bot's token
         logger.info("Creating application with token...")
         if not TELEGRAM_BOT_TOKEN:
             logger.error("TELEGRAM_BOT_TOKEN is not set!")
             return
-        application = Application.builder().token(TELEGRAM_BOT_TOKEN).persistence(persistence).build()
+        application = (
+            Application.builder()
+            .token(TELEGRAM_BOT_TOKEN)
+            .persistence(persistence)
+            .rate_limiter(outbound_scheduler)
+            .concurrent_updates(update_processor)
+            .build()
+        )
         logger.info("Application created successfully")
 
+        # Per-user request budget and user binding for the rate limiter
+        application.add_handler(TypeHandler(Update, rate_limit_gate), group=-1)
+
         # Get all conversation handlers
         logger.info("Building conversation handlers...")
         conversation_handlers = build_conversation_handlers()
@@ -4426,6 +6962,8 @@ async def main() -> None:
         # Add market data handlers
         application.add_handler(CallbackQueryHandler(show_gainers, pattern=f"^{CALLBACK_SHOW_GAINERS}$"))
         application.add_handler(CallbackQueryHandler(show_losers, pattern=f"^{CALLBACK_SHOW_LOSERS}$"))
+        application.add_handler(CallbackQueryHandler(show_volume_leaders, pattern=f"^{CALLBACK_SHOW_VOLUME_LEADERS}$"))
+        application.add_handler(CallbackQueryHandler(search_page_handler, pattern=f"^{CALLBACK_SEARCH_PAGE_PREFIX}\\d+$"))
         logger.info("Added market data handlers")
         
         # Add favorites handlers
@@ -4461,32 +6999,55 @@ async def main() -> None:
         # Fetch initial exchange info
         await fetch_and_cache_exchange_info(application)
         logger.info("Exchange info cached")
-        
-        logger.info("Starting polling...")
-        
-        # Set up polling in a way that works with Python 3.12
+
+        # Start the live price book
+        market_data.start()
+        user_stream.start()
+        alert_engine.start(application)
+
+        stop_event = asyncio.Event()
+        _install_stop_signals(stop_event)
+
         await application.initialize()
         await application.start()
-        await application.updater.start_polling(drop_pending_updates=True)
+        if mode == 'webhook':
+            logger.info("Starting webhook server...")
+            webhook_server = WebhookServer(application)
+            await webhook_server.start()
+        else:
+            logger.info("Starting polling...")
+            await application.updater.start_polling(drop_pending_updates=True)
         
         logger.info("Bot is running. Press Ctrl+C to stop.")
-        
-        # Keep the bot running
-        while True:
-            await asyncio.sleep(1)
+        await stop_event.wait()
             
-    except KeyboardInterrupt:
-        logger.info("Stopping bot...")
-        await application.stop()
-        await application.shutdown()
     except Exception as e:
         logger.error(f"Error in main function: {e}", exc_info=True)
         raise
+    finally:
+        logger.info("Stopping bot...")
+        if webhook_server:
+            await webhook_server.stop()
+        if application and application.updater and application.updater.running:
+            await application.updater.stop()
+        # The background services send through the bot and read bot_data; stop them while the application is still up
+        await alert_engine.stop()
+        await market_data.stop()
+        await user_stream.stop()
+        await symbol_discovery.stop()
+        if application:
+            if application.running:
+                await application.stop()
+            await application.shutdown()
+        exchange_gateway.shutdown()
+        trade_store.close()
+        logger.info(f"Volatile cache stats: {volatile_cache.stats()}")
 
 if __name__ == '__main__':
     try:
         logger.info("Starting bot script...")
-        asyncio.run(main())
+        mode = 'webhook' if '--webhook' in sys.argv else 'polling' if '--polling' in sys.argv else BOT_MODE
+        asyncio.run(main(mode))
         logger.info("Bot script completed normally")
     except KeyboardInterrupt:
         logger.info("Bot stopped by user.")
@@ -50,7 +50,8 @@ LOG_ALL_ACTIONS = True  # Log all user actions
 
 # Rate Limiting
 RATE_LIMIT = {
-    'trades_per_minute': 5,
-    'orders_per_minute': 10,
-    'api_calls_per_minute': 60
+    'trades_per_minute': 5,  # أوامر السوق لكل مستخدم
+    'orders_per_minute': 10,  # كل الأوامر الجديدة (سوق + SL/TP) لكل مستخدم
+    'api_calls_per_minute': 60,  # عدد الطلبات (ضغطات/رسائل) لكل مستخدم
+    'request_weight_per_minute': 1200  # وزن طلبات Binance REST الكلي (حد المنصة 6000)
 } 
\ No newline at end of file
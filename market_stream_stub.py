@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for Binance's `!miniTicker@arr` market stream.
+
+Serves canned miniTicker frames over WebSocket so MarketDataService can be
+exercised without reaching Binance:
+
+    python market_stream_stub.py --port 8765 --symbols BTCUSDT,ETHUSDT
+    BINANCE_MARKET_STREAM_URL=ws://127.0.0.1:8765 python 666666.py
+
+Every `--interval` seconds each connected client receives one array frame with
+a random-walk close price for a random subset of the symbols (like Binance,
+which only sends symbols that changed). `--drop-after N` closes each
+connection after N frames to exercise the reconnect/reseed path.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Dict, List
+
+import websockets
+
+# --- إعدادات افتراضية ---
+DEFAULT_PRICES: Dict[str, float] = {'BTCUSDT': 65000.0, 'ETHUSDT': 3200.0, 'BNBUSDT': 580.0, 'SOLUSDT': 150.0, 'XRPUSDT': 0.52}
+
+def build_frame(prices: Dict[str, float], changed: List[str]) -> str:
+    """One `!miniTicker@arr` frame for the changed symbols (fields as sent by Binance)."""
+    now_ms = int(time.time() * 1000)
+    return json.dumps([
+        {'e': '24hrMiniTicker', 'E': now_ms, 's': symbol, 'c': f"{prices[symbol]:.8f}",
+         'o': f"{prices[symbol]:.8f}", 'h': f"{prices[symbol]:.8f}", 'l': f"{prices[symbol]:.8f}", 'v': '0', 'q': '0'}
+        for symbol in changed
+    ])
+
+async def serve(host: str, port: int, prices: Dict[str, float], interval: float, drop_after: int) -> None:
+    async def handler(ws, *_):
+        sent = 0
+        while not drop_after or sent < drop_after:
+            changed = random.sample(list(prices), k=random.randint(1, len(prices)))
+            for symbol in changed:
+                prices[symbol] *= 1 + random.uniform(-0.002, 0.002)
+            await ws.send(build_frame(prices, changed))
+            sent += 1
+            await asyncio.sleep(interval)
+        await ws.close()
+
+    async with websockets.serve(handler, host, port):
+        print(f"Market stream stub on ws://{host}:{port} ({len(prices)} symbols)")
+        await asyncio.Future() # run until interrupted
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--symbols', help="Comma separated symbols (default: a few USDT majors)")
+    parser.add_argument('--interval', type=float, default=1.0, help="Seconds between frames")
+    parser.add_argument('--drop-after', type=int, default=0, help="Close each connection after N frames (0 = never)")
+    args = parser.parse_args()
+    prices = dict(DEFAULT_PRICES)
+    if args.symbols:
+        prices = {symbol.strip().upper(): DEFAULT_PRICES.get(symbol.strip().upper(), 1.0) for symbol in args.symbols.split(',') if symbol.strip()}
+    try:
+        asyncio.run(serve(args.host, args.port, prices, args.interval, args.drop_after))
+    except KeyboardInterrupt:
+        pass
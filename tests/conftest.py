@@ -0,0 +1,40 @@
+"""
+Loads 666666.py as the `bot` module for the tests. The script reads config.py
+and creates key.key / trades.db in the working directory on import, so it is
+imported from a temporary directory with a dummy token and no Binance keys.
+"""
+import importlib.util
+import os
+import socket
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture(scope='session')
+def bot(tmp_path_factory):
+    for name in ('telegram', 'binance', 'cryptography'):
+        pytest.importorskip(name)
+    workdir = tmp_path_factory.mktemp('bot')
+    with pytest.MonkeyPatch.context() as mp:
+        mp.chdir(workdir)
+        mp.syspath_prepend(ROOT)
+        mp.setenv('TELEGRAM_BOT_TOKEN', '123456:TEST')
+        mp.delenv('BINANCE_API_KEY', raising=False)
+        mp.delenv('BINANCE_SECRET_KEY', raising=False)
+        mp.setenv('TRADES_DB_PATH', str(workdir / 'trades.db'))
+        mp.setenv('PERSISTENCE_DB_PATH', str(workdir / 'bot_state.db'))
+        spec = importlib.util.spec_from_file_location('bot', os.path.join(ROOT, '666666.py'))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules['bot'] = module
+        spec.loader.exec_module(module)
+        yield module
+        module.trade_store.close()
+        sys.modules.pop('bot', None)
+
+@pytest.fixture
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
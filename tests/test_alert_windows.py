@@ -0,0 +1,27 @@
+from decimal import Decimal
+
+def user_data(interval_minutes, enabled=True):
+    return {
+        'alert_config': {'enabled': enabled, 'interval_minutes': interval_minutes, 'threshold_percent': '3'},
+        'favorite_pairs': ['BTCUSDT', 'ETHUSDT'],
+    }
+
+def test_unused_window_lengths_are_released(bot):
+    engine = bot.AlertEngine(tick_seconds=10)
+    history = engine.history
+    short, long_ = history.window_length(5), history.window_length(30)
+
+    engine.sync_user(1, user_data(30))
+    engine.sync_user(2, user_data(5))
+    history.record({'BTCUSDT': Decimal('100'), 'ETHUSDT': Decimal('10')})
+    assert history.lengths == {short, long_} and history.capacity == long_
+
+    engine.sync_user(1, user_data(5)) # threshold window changed
+    assert history.lengths == {short} and history.capacity == short
+    assert set(history._windows['BTCUSDT'].windows) == {short}
+    assert history.moves(short, 0.0) # samples survive the shrink
+
+    engine.sync_user(1, user_data(5, enabled=False))
+    engine.sync_user(2, user_data(5, enabled=False))
+    assert history.lengths == set()
+    assert not engine._watchers and not engine._global_thresholds
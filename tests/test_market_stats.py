@@ -0,0 +1,13 @@
+import asyncio
+import time
+
+def test_per_quote_view_expires_with_the_snapshot(bot):
+    cache = bot.market_stats_cache
+    cache.invalidate()
+    rows = [('BTCUSDT', 1.0, 100.0, '65000', '1.0'), ('ETHBTC', -1.0, 5.0, '0.05', '-1.0')]
+    snapshot_time = time.monotonic() - (cache.ttl_seconds - 1) # one second before the snapshot expires
+    cache.set(bot.ALL_MARKET_STATS_KEY, rows, stored_at=snapshot_time)
+
+    assert [row[0] for row in asyncio.run(bot.get_market_stats('USDT'))] == ['BTCUSDT']
+    assert cache.stored_at('USDT') == snapshot_time # no fresh TTL of its own
+    cache.invalidate()
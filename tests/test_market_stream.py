@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('websockets')
+
+def test_reconnects_and_reseeds_after_stub_drops(bot, free_port, monkeypatch):
+    import market_stream_stub
+
+    seeds = []
+
+    async def fake_binance_call(method, **params):
+        seeds.append(method)
+        return [{'symbol': 'BTCUSDT', 'price': '1.0'}]
+
+    class Gateway:
+        available = True
+
+    monkeypatch.setattr(bot, 'exchange_gateway', Gateway())
+    monkeypatch.setattr(bot, 'binance_call', fake_binance_call)
+
+    async def scenario():
+        prices = {'BTCUSDT': 65000.0, 'ETHUSDT': 3200.0}
+        stub = asyncio.create_task(market_stream_stub.serve('127.0.0.1', free_port, prices, 0.05, 3))
+        service = bot.MarketDataService(url=f"ws://127.0.0.1:{free_port}")
+        try:
+            await asyncio.sleep(0.2) # let the stub bind
+            service.start()
+            # The stub closes each connection after 3 frames; the service reconnects after a 1 s backoff
+            for _ in range(60):
+                if len(seeds) >= 2 and service.live:
+                    break
+                await asyncio.sleep(0.1)
+            assert len(seeds) >= 2, "price book was not reseeded after the reconnect"
+            assert service.live
+            assert set(service.book) >= {'BTCUSDT', 'ETHUSDT'}
+        finally:
+            await service.stop()
+            stub.cancel()
+            try: await stub
+            except asyncio.CancelledError: pass
+
+    asyncio.run(scenario())
@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+
+SECRET = 'test-secret'
+UPDATE = {'update_id': 1, 'message': {'message_id': 1, 'date': 0, 'chat': {'id': 42, 'type': 'private'}, 'text': '/start'}}
+
+def test_non_loopback_listener_gets_a_secret(bot):
+    application = bot.Application.builder().token('123456:TEST').build()
+    assert bot.WebhookServer(application, listen='0.0.0.0', public_url=None, secret_token=None).secret_token
+    assert bot.WebhookServer(application, listen='127.0.0.1', public_url=None, secret_token=None).secret_token is None
+
+def test_secret_token_guards_updates_and_stats(bot, free_port):
+    async def scenario():
+        application = bot.Application.builder().token('123456:TEST').build()
+        server = bot.WebhookServer(application, listen='127.0.0.1', port=free_port, public_url=None, secret_token=SECRET)
+        await server.start()
+        base = f"http://127.0.0.1:{free_port}"
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.post(base + server.path, json=UPDATE) as resp:
+                    assert resp.status == 403
+                async with session.post(base + server.path, json=UPDATE, headers={'X-Telegram-Bot-Api-Secret-Token': 'wrong'}) as resp:
+                    assert resp.status == 403
+                assert application.update_queue.empty()
+
+                async with session.post(base + server.path, json=UPDATE, headers={'X-Telegram-Bot-Api-Secret-Token': SECRET}) as resp:
+                    assert resp.status == 200
+                update = application.update_queue.get_nowait()
+                assert update.update_id == 1 and update.effective_chat.id == 42
+
+                async with session.get(base + '/healthz') as resp:
+                    assert await resp.json() == {'ok': True}
+                async with session.get(base + '/healthz', headers={'X-Telegram-Bot-Api-Secret-Token': SECRET}) as resp:
+                    assert 'queue_wait_seconds' in await resp.json()
+        finally:
+            await server.stop()
+
+    asyncio.run(scenario())